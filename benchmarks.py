@@ -0,0 +1,301 @@
+import argparse
+import asyncio
+import contextlib
+import inspect
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import config
+import database
+import game_logic
+import modifiers
+import reports
+from memory_backend import MemoryBackend
+from sqlite_backend import SQLiteBackend
+
+# Бенчмарки горячих путей игровой логики и database.py. Работают без сети и без Telegram.
+#
+#   python benchmarks.py                      # свежая база и база на 100k пользователей / 500k игроков
+#   python benchmarks.py --save-baseline      # запомнить результаты как эталон
+#   python benchmarks.py --users 10000        # база поменьше для быстрого прогона
+#
+# Для каждого случая печатаются операции в секунду и перцентили времени одной операции.
+# Если есть эталон (benchmarks_baseline.json), рядом выводится изменение, а падение
+# ops/sec больше чем на --threshold помечается как регресс (код выхода 1).
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks_baseline.json")
+FRESH_USERS = 100  # свежая база: немного пользователей, чтобы было что читать
+PLAYERS_PER_USER = 5
+TACTIC = next(iter(config.TACTICS))
+
+# 1. Замеры
+def _summary(samples: list) -> dict:
+    percentiles = statistics.quantiles(samples, n=100) if len(samples) > 1 else samples * 99
+    return {
+        "ops_per_sec": len(samples) / sum(samples),
+        "p50_us": percentiles[49] * 1e6,
+        "p95_us": percentiles[94] * 1e6,
+        "p99_us": percentiles[98] * 1e6,
+    }
+
+async def _measure(fn, iterations: int, warmup: int) -> dict:
+    """
+    Вызывает fn(i) warmup + iterations раз и замеряет каждый вызов.
+    fn может вернуть корутину — тогда замер включает её выполнение.
+    """
+    samples = []
+    # Заглушки вроде log_random_event печатают в stdout — не мешаем ими таблице
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(warmup + iterations):
+            start = time.perf_counter()
+            result = fn(i)
+            if inspect.isawaitable(result):
+                await result
+            elapsed = time.perf_counter() - start
+            if i >= warmup:
+                samples.append(elapsed)
+    return _summary(samples)
+
+# 2. Данные
+def _random_player(rng: random.Random) -> dict:
+    return {
+        "nickname": rng.choice(config.NICKS),
+        "position": rng.choice(config.POSITIONS),
+        "rarity": rng.choice(config.RARITIES),
+        "aim": rng.randint(30, 95),
+        "reaction": rng.randint(30, 95),
+        "tactics": rng.randint(30, 95),
+        "stamina": rng.randint(20, 100),
+    }
+
+async def _populate(users: int, rng: random.Random):
+    # Одна транзакция на всё заполнение: все записи присоединяются к ней
+    async with database.transaction():
+        for user_id in range(1, users + 1):
+            await database.create_user(user_id, f"Команда {user_id}")
+            await database.create_players(user_id, [_random_player(rng) for _ in range(PLAYERS_PER_USER)])
+
+async def _open_sqlite(path: str, users: int, rng: random.Random):
+    await database.init_db(SQLiteBackend(path))
+    if await database.get_user(users) is None:
+        print(f"Заполняем {path}: {users} пользователей, {users * PLAYERS_PER_USER} игроков...", file=sys.stderr)
+        started = time.perf_counter()
+        await _populate(users, rng)
+        print(f"Готово за {time.perf_counter() - started:.1f} с", file=sys.stderr)
+
+@contextlib.asynccontextmanager
+async def _scenario(name: str, users: int, workdir: str, rebuild: bool, rng: random.Random):
+    """Открывает базу сценария; после прогона закрывает и удаляет рабочую копию."""
+    if name == "memory":
+        await database.init_db(MemoryBackend())
+        await _populate(users, rng)
+        try:
+            yield
+        finally:
+            await database.close_db()
+        return
+
+    path = os.path.join(workdir, f"bench_{name}.db")
+    if name == "populated":
+        # Заполнение долгое, поэтому эталонная копия живёт между запусками, а замеры идут на её копии
+        pristine = os.path.join(tempfile.gettempdir(), f"cs2_arena_bench_{users}.db")
+        if rebuild or not os.path.exists(pristine):
+            for suffix in ("", "-wal", "-shm"):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(pristine + suffix)
+            await _open_sqlite(pristine, users, rng)
+            await database.close_db()
+        shutil.copyfile(pristine, path)
+    await _open_sqlite(path, users, rng)
+    try:
+        yield
+    finally:
+        await database.close_db()
+
+# 3. Случаи
+async def _logic_cases(rng: random.Random) -> dict:
+    """Чистая игровая логика: не зависит от базы."""
+    players = [database.Player(i, 1, *_random_player(rng).values(), 100) for i in range(1, PLAYERS_PER_USER + 1)]
+    vector = modifiers.combine(modifiers.source_vector("mascot", "Волк"), modifiers.tactic_vector(TACTIC))
+    power = database.TeamPower.of(1, players)
+    match = await game_logic.simulate_match_pro(players, TACTIC, seed=1)
+    match["settlement"] = {"money_reward": 3000, "fans_reward": 50, "morale_change": 5,
+                           "stamina_reduction": 12, "bet_win": 0, "match_id": 1}
+
+    async def simulate(i):
+        await game_logic.simulate_match_pro(players, TACTIC, seed=i)
+
+    def render(i):
+        for _ in reports.render_match_report(match, players, match["opponent_name"]):
+            pass
+
+    return {
+        "calculate_team_power": lambda i: game_logic.calculate_team_power(players, vector),
+        "team_power_value": lambda i: game_logic.team_power_value(power, vector),
+        "simulate_match_pro": simulate,
+        "render_match_report": render,
+    }
+
+def _database_cases(users: int, rng: random.Random) -> dict:
+    """По случаю на каждую функцию database.py и полный расчёт матча."""
+    state = {"next_user": users + 1}
+
+    def user():
+        return rng.randint(1, users)
+
+    async def create_user(i):
+        await database.create_user(state["next_user"], "Новая команда")
+        state["next_user"] += 1
+
+    async def get_player(i):
+        players = await database.get_team_players(user())
+        if players:
+            await database.get_player(players[0].player_id)
+
+    async def update_player_stats(i):
+        players = await database.get_team_players(user())
+        if players:
+            await database.update_player_stats(players[0].player_id, aim="+1", morale=90)
+
+    async def adjust_players_stats(i):
+        players = await database.get_team_players(user())
+        await database.adjust_players_stats([p.player_id for p in players[:2]], stamina=-3, morale=2)
+
+    async def market(i):
+        user_id = user()
+        offers = await database.set_market_players(user_id, [dict(_random_player(rng), price=5000) for _ in range(3)])
+        await database.get_market_players(user_id)
+        await database.get_market_offer(user_id, offers[0].offer_id)
+        await database.claim_market_offer(user_id, offers[0].offer_id)
+
+    async def bets(i):
+        user_id = user()
+        await database.create_bet(user_id, 100, 1.9)
+        await database.get_active_bet(user_id)
+        await database.clear_bet(user_id)
+
+    async def effects(i):
+        user_id = user()
+        await database.set_team_modifier(user_id, "mascot", "Волк")
+        await database.add_team_effect(user_id, "Травма на тренировке", 1)
+        await database.get_team_modifiers(user_id)
+        await database.tick_team_effects(user_id)
+
+    async def matches(i):
+        user_id = user()
+        players = await database.get_team_players(user_id)
+        match = await game_logic.simulate_match_pro(players, TACTIC, seed=i)
+        match_id = await database.save_match(match["record"])
+        await database.get_match(match_id)
+        await database.get_user_matches(user_id)
+
+    async def settlement(i):
+        # Полный путь матча: состав, модификаторы, симуляция, расчёт одной транзакцией и отчёт
+        user_id = user()
+        players = await database.get_team_players(user_id)
+        team_modifiers = await modifiers.get_team_vector(user_id)
+        team_power = await database.get_team_power(user_id)
+        match = await game_logic.simulate_match_pro(players, TACTIC, team_modifiers, seed=i, team_power=team_power)
+        match["settlement"] = await game_logic.post_match_processing(
+            user_id, match["result"], players, match_record=match["record"]
+        )
+        for _ in reports.render_match_report(match, players, match["opponent_name"]):
+            pass
+
+    return {
+        "create_user": create_user,
+        "get_user": lambda i: database.get_user(user()),
+        "update_user_balance": lambda i: database.update_user_balance(user(), 10),
+        "add_user_fans": lambda i: database.add_user_fans(user(), 1),
+        "update_user_field": lambda i: database.update_user_field(user(), "reputation", 60),
+        "create_player": lambda i: database.create_player(user(), "bench", "IGL", "Опытный", 50, 50, 50),
+        "create_players": lambda i: database.create_players(user(), [_random_player(rng) for _ in range(3)]),
+        "get_team_players": lambda i: database.get_team_players(user()),
+        "get_player (+get_team_players)": get_player,
+        "get_team_power": lambda i: database.get_team_power(user()),
+        "get_top_teams": lambda i: database.get_top_teams(10),
+        "update_player_stats (+get_team_players)": update_player_stats,
+        "reduce_player_stamina": lambda i: database.reduce_player_stamina(user(), 1),
+        "adjust_team_stats": lambda i: database.adjust_team_stats(user(), stamina=-1, morale=1),
+        "adjust_players_stats (+get_team_players)": adjust_players_stats,
+        "team modifiers (set/add/get/tick)": effects,
+        "market (set/get/offer/claim)": market,
+        "bets (create/get/clear)": bets,
+        "matches (simulate/save/get/list)": matches,
+        "match settlement": settlement,
+    }
+
+# 4. Отчёт и эталон
+def _print_results(results: dict, baseline: dict, threshold: float) -> list:
+    """Печатает таблицу и возвращает список регрессий."""
+    regressions = []
+    print(f"{'случай':<55} {'ops/s':>10} {'p50 мкс':>10} {'p95 мкс':>10} {'p99 мкс':>10} {'к эталону':>10}")
+    for key, stats in results.items():
+        change = ""
+        base = baseline.get(key)
+        if base:
+            ratio = stats["ops_per_sec"] / base["ops_per_sec"] - 1
+            change = f"{ratio:+.0%}"
+            if ratio < -threshold:
+                change += " !"
+                regressions.append(f"{key}: {base['ops_per_sec']:.0f} -> {stats['ops_per_sec']:.0f} ops/s")
+        print(f"{key:<55} {stats['ops_per_sec']:>10.0f} {stats['p50_us']:>10.1f} "
+              f"{stats['p95_us']:>10.1f} {stats['p99_us']:>10.1f} {change:>10}")
+    return regressions
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    results = {}
+
+    for name, fn in (await _logic_cases(rng)).items():
+        results[f"logic/{name}"] = await _measure(fn, args.iterations, args.warmup)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for scenario in args.scenarios:
+            users = FRESH_USERS if scenario == "fresh" else args.users
+            async with _scenario(scenario, users, workdir, args.rebuild, rng):
+                for name, fn in _database_cases(users, rng).items():
+                    results[f"{scenario}/{name}"] = await _measure(fn, args.iterations, args.warmup)
+                await database.flush_pending()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки игровой логики и базы данных")
+    parser.add_argument("--scenarios", nargs="+", default=["fresh", "populated"],
+                        choices=["fresh", "populated", "memory"])
+    parser.add_argument("--users", type=int, default=100_000, help="пользователей в заполненной базе")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rebuild", action="store_true", help="заново заполнить сохранённую большую базу")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="сохранить результаты как эталон")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое падение ops/sec (доля)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = _print_results(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Эталон сохранён в {args.baseline}")
+    elif regressions:
+        print("\nРегрессии:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
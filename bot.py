@@ -1,20 +1,41 @@
 import asyncio
 import random
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import Bot, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 
 import config
 import database
+import fsm_storage
 import keyboards
 import game_logic
+import middlewares
+import modifiers
+import odds
+import reports
+import sender
+import simulation
+import webhook
 
 # Инициализация бота и диспетчера
-bot = Bot(token=config.BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+session = AiohttpSession(api=TelegramAPIServer.from_base(config.BOT_API_URL)) if config.BOT_API_URL else None
+bot = Bot(token=config.BOT_TOKEN, session=session)
+# Состояния FSM живут в базе игры и переживают перезапуск
+storage = fsm_storage.DatabaseStorage()
+throttling = middlewares.ThrottlingMiddleware()
+# Обновления одного пользователя — по очереди, чтобы двойное нажатие не списало деньги дважды;
+# блокировка берётся до чтения состояния FSM (см. middlewares.create_dispatcher)
+user_serial = middlewares.UserSerialMiddleware()
+dp = middlewares.create_dispatcher(storage, throttling, user_serial)
+# Исходящие сообщения — через очередь с лимитами Telegram; при остановке она дописывается
+outbox = sender.SendScheduler(bot)
+dp.shutdown.register(outbox.close)
+
+# Сервер вебхука (config.BOT_MODE == "webhook"); в режиме polling не запускается
+webhook_server = webhook.WebhookServer(dp, bot)
 
 # Состояния FSM
 class GameStates(StatesGroup):
@@ -36,7 +57,8 @@ async def cmd_start(message: types.Message, state: FSMContext):
 
     if user is None:
         # Пользователь новый — запрашиваем название команды
-        await message.answer(
+        outbox.answer(
+            message,
             "👋 Добро пожаловать в CS2 Manager!\n\n"
             "Вы назначены менеджером новой киберспортивной команды.\n"
             "Как будет называться ваша команда?"
@@ -44,9 +66,10 @@ async def cmd_start(message: types.Message, state: FSMContext):
         await state.set_state(GameStates.waiting_for_team_name)
     else:
         # Пользователь уже есть в базе — показываем главное меню
-        await message.answer(
+        outbox.answer(
+            message,
             f"👋 Добро пожаловать обратно, менеджер!\n"
-            f"Ваша команда: *{user[2]}*\n\n"
+            f"Ваша команда: *{user.team_name}*\n\n"
             "Выберите действие:",
             reply_markup=keyboards.main_menu,
             parse_mode="Markdown"
@@ -67,6 +90,7 @@ async def process_team_name(message: types.Message, state: FSMContext):
     # Генерируем 5 случайных игроков для «Кейса новичка»
     rarities = list(config.SALARY_BY_RARITY.keys())
     positions = ["AWPer", "Entry Fragger", "Lurker", "IGL", "Support"]
+    starter_pack = []
 
     for i in range(5):
         # Генерируем характеристики игрока
@@ -94,29 +118,23 @@ async def process_team_name(message: types.Message, state: FSMContext):
         reaction = max(30, min(100, reaction))
         tactics = max(30, min(100, tactics))
 
-        # Создаём игрока в БД
-        await database.add_player(
-            owner_id=user_id,
-            nickname=nickname,
-            position=position,
-            rarity=rarity
-        )
+        starter_pack.append({
+            "nickname": nickname,
+            "position": position,
+            "rarity": rarity,
+            "aim": aim,
+            "reaction": reaction,
+            "tactics": tactics,
+            "stamina": 100,
+            "morale": 80
+        })
 
-        # Сразу обновляем его характеристики
-        players = await database.get_team_players(user_id)
-        player_id = [p[0] for p in players if p[2] == nickname][0]
-        await database.update_player_stats(
-            player_id,
-            aim=aim,
-            reaction=reaction,
-            tactics=tactics,
-            stamina=100,
-            morale=80
-        )
+    # Создаём всех игроков в БД одним запросом
+    await database.create_players(user_id, starter_pack)
 
     # Получаем обновлённый список игроков для отображения
     players = await database.get_team_players(user_id)
-    player_list_text = "\n".join([f"• {p[2]} ({p[4]}) — {p[3]}" for p in players])
+    player_list_text = "\n".join([f"• {p.nickname} ({p.rarity}) — {p.position}" for p in players])
 
     # Отправляем поздравление и список игроков
     welcome_text = (
@@ -128,23 +146,12 @@ async def process_team_name(message: types.Message, state: FSMContext):
         "Используйте главное меню, чтобы управлять командой, тренироваться и играть матчи!"
     )
 
-    await message.answer(welcome_text, parse_mode="Markdown", reply_markup=keyboards.main_menu)
+    outbox.answer(message, welcome_text, parse_mode="Markdown", reply_markup=keyboards.main_menu)
 
     # Сбрасываем состояние
     await state.clear()
 
-# Запуск бота
-async def main():
-    # Инициализируем базу данных
-    await database.init_db()
-    print("База данных инициализирована")
-
-    # Запускаем бота
-    await dp.start_polling(bot)
-
-if __name__ == "__main__":
-    asyncio.run(main())
-    # Хэндлер просмотра списка игроков (team_list)
+# Хэндлер просмотра списка игроков (team_list)
 @dp.callback_query(F.data == "team_list")
 async def show_team_list(callback: types.CallbackQuery):
     """
@@ -165,16 +172,14 @@ async def show_team_list(callback: types.CallbackQuery):
     # Генерируем текст списка игроков
     team_text = "👥 Ваша команда:\n\n"
     for player in players:
-        # player[0] — ID, [2] — nickname, [3] — position, [4] — rarity,
-        # [5] — aim, [6] — reaction, [7] — tactics, [8] — stamina, [9] — morale
         team_text += (
-            f"• **{player[2]}** ({player[4]})\n"
-            f"  Позиция: {player[3]} | "
-            f"Стрельба: {player[5]} | "
-            f"Реакция: {player[6]} | "
-            f"Тактика: {player[7]}\n"
-            f"  🔋 Стамина: {player[8]}% | "
-            f"💪 Мораль: {player[9]}%\n\n"
+            f"• **{player.nickname}** ({player.rarity})\n"
+            f"  Позиция: {player.position} | "
+            f"Стрельба: {player.aim} | "
+            f"Реакция: {player.reaction} | "
+            f"Тактика: {player.tactics}\n"
+            f"  🔋 Стамина: {player.stamina}% | "
+            f"💪 Мораль: {player.morale}%\n\n"
         )
 
     # Используем клавиатуру из keyboards.py
@@ -197,22 +202,22 @@ async def show_player_info(callback: types.CallbackQuery):
     user_id = callback.from_user.id
 
     player = await database.get_player(player_id)
-    if not player or player[1] != user_id:  # проверяем, что игрок принадлежит пользователю
+    if not player or player.owner_id != user_id:  # проверяем, что игрок принадлежит пользователю
         await callback.answer("❌ Игрок не найден или не принадлежит вам.", show_alert=True)
         return
 
     # Формируем карточку игрока
     player_info = (
-        f"👤 **{player[2]}**\n"
-        f"Позиция: {player[3]}\n"
-        f"Редкость: {player[4]}\n"
-        f"💰 Зарплата: {config.SALARY_BY_RARITY[player[4]]} кредитов/матч\n\n"
+        f"👤 **{player.nickname}**\n"
+        f"Позиция: {player.position}\n"
+        f"Редкость: {player.rarity}\n"
+        f"💰 Зарплата: {config.SALARY_BY_RARITY[player.rarity]} кредитов/матч\n\n"
         f"**Характеристики:**\n"
-        f"🎯 Стрельба (Aim): {player[5]}\n"
-        f"⚡ Реакция (Reaction): {player[6]}\n"
-        f"🧠 Тактика (Tactics): {player[7]}\n"
-        f"🔋 Стамина: {player[8]}%\n"
-        f"💪 Мораль: {player[9]}%\n\n"
+        f"🎯 Стрельба (Aim): {player.aim}\n"
+        f"⚡ Реакция (Reaction): {player.reaction}\n"
+        f"🧠 Тактика (Tactics): {player.tactics}\n"
+        f"🔋 Стамина: {player.stamina}%\n"
+        f"💪 Мораль: {player.morale}%\n\n"
         f"*Используйте кнопки ниже для действий с игроком.*"
     )
 
@@ -243,12 +248,12 @@ async def start_training(callback: types.CallbackQuery, state: FSMContext):
     user_id = callback.from_user.id
 
     player = await database.get_player(player_id)
-    if not player or player[1] != user_id:
+    if not player or player.owner_id != user_id:
         await callback.answer("❌ Игрок не найден.", show_alert=True)
         return
 
     user = await database.get_user(user_id)
-    balance = user[1]  # баланс пользователя
+    balance = user.balance
 
     # Проверяем, хватает ли денег на тренировку
     training_cost = config.TRAINING_COST
@@ -278,7 +283,7 @@ async def start_training(callback: types.CallbackQuery, state: FSMContext):
     ])
 
     await callback.message.edit_text(
-        f"🏋️ Выберите тип тренировки для {player[2]}:\n"
+        f"🏋️ Выберите тип тренировки для {player.nickname}:\n"
         f"Стоимость: {training_cost} кредитов",
         parse_mode="Markdown",
         reply_markup=training_keyboard
@@ -298,10 +303,7 @@ async def process_training(callback: types.CallbackQuery, state: FSMContext):
     training_type = callback.data
     training_cost = config.TRAINING_COST
 
-    # Списываем деньги
-    await database.update_user_balance(user_id, -training_cost)
-
-    # Обновляем характеристики игрока
+    # Определяем, какие характеристики улучшаем
     updates = {}
     if training_type == "train_aim":
         updates["aim"] = "+5"
@@ -314,9 +316,16 @@ async def process_training(callback: types.CallbackQuery, state: FSMContext):
         message_text = "✅ Улучшена тактика!"
     else:  # restore_morale
         updates["morale"] = "+10"
-# ... тут заканчивается предыдущая функция
-    message_text = "✅ Мораль восстановлена!"
-    # Убедись, что здесь нет лишних открытых блоков
+        message_text = "✅ Мораль восстановлена!"
+
+    # Списываем деньги и обновляем игрока одной транзакцией
+    async with database.transaction():
+        await database.update_user_balance(user_id, -training_cost)
+        await database.update_player_stats(player_id, **updates)
+
+    await state.clear()
+    outbox.answer(callback.message, message_text, reply_markup=keyboards.main_menu)
+    await callback.answer()
 
 # Эти две строки должны быть ПРИЖАТЫ К ЛЕВОМУ КРАЮ
 @dp.callback_query(F.data == "start_match")
@@ -337,14 +346,18 @@ async def start_match_simulation(callback: types.CallbackQuery, state: FSMContex
         await callback.answer()
         return
 
-    # Переводим в состояние выбора тактики и показываем клавиатуру тактик
+    # Переводим в состояние выбора тактики и показываем клавиатуру тактик;
+    # ставка принята под конкретную тактику, и матч по ней играется только ею
     await state.set_state(GameStates.selecting_tactic)
-    tactics_keyboard = keyboards.create_tactics_keyboard()
+    bet = await database.get_active_bet(user_id)
+    if bet is not None and bet.tactic is not None:
+        tactics_keyboard = keyboards.tactic_selection_kb([bet.tactic])
+        text = f"🚀 Ваша ставка сделана на тактику «{bet.tactic}» — матч играется ею:"
+    else:
+        tactics_keyboard = keyboards.tactic_selection_kb()
+        text = "🚀 Выберите тактику для предстоящего матча:"
 
-    await callback.message.edit_text(
-        "🚀 Выберите тактику для предстоящего матча:",
-        reply_markup=tactics_keyboard
-    )
+    await callback.message.edit_text(text, reply_markup=tactics_keyboard)
     await callback.answer()
 
 @dp.callback_query(GameStates.selecting_tactic, F.data.startswith("tactic_"))
@@ -352,43 +365,80 @@ async def process_tactic_selection(callback: types.CallbackQuery, state: FSMCont
     """
     Обрабатывает выбор тактики, запускает симуляцию матча и отправляет отчёт.
     """
-    tactic = callback.data.split("_")[1]  # например, "aggressive"
+    tactic = modifiers.parse_tactic(callback.data)  # например, "Агрессивный раш"
     user_id = callback.from_user.id
+    if tactic is None:
+        await callback.answer("❌ Такой тактики нет.", show_alert=True)
+        return
+    bet = await database.get_active_bet(user_id)
+    if bet is not None and bet.tactic is not None and bet.tactic != tactic:
+        await callback.answer(f"❌ Ставка сделана на тактику «{bet.tactic}».", show_alert=True)
+        return
 
-    # Получаем команду игрока
+    # Получаем команду игрока и её модификаторы (талисман, спонсор, эффекты событий)
     players = await database.get_team_players(user_id)
-    mascot_name = "Default"  # можно добавить выбор талисмана позже
+    team_modifiers = await modifiers.get_team_vector(user_id)
 
     # Запускаем симуляцию матча
-    match_result = await game_logic.simulate_match_pro(players, tactic, mascot_name)
-
-    # Генерируем красивый отчёт о матче
-    opponent_name = f"Команда {random.choice(['Alpha', 'Beta', 'Gamma', 'Delta'])}"
-    match_report = await game_logic.generate_match_report(match_result, players, opponent_name)
-
-    # Отправляем отчёт пользователю
-    await callback.message.answer(match_report, parse_mode="Markdown")
+    team_power = await database.get_team_power(user_id)
+    match_result = await game_logic.simulate_match_pro(players, tactic, team_modifiers, team_power=team_power)
 
-    # Обрабатываем последствия матча (деньги, фанаты, усталость, мораль)
-    await game_logic.post_match_processing(user_id, match_result["result"], players)
-
-    # Если была ставка, проверяем её результат
-    bet = await database.get_active_bet(user_id)
-    if bet and match_result["result"] == "WIN":
-        # Удваиваем ставку и начисляем выигрыш
-        win_amount = bet["amount"] * 2
-        await database.update_user_balance(user_id, win_amount)
-        await database.clear_bet(user_id)  # очищаем ставку
-        await callback.message.answer(
+    # Обрабатываем последствия матча (деньги, фанаты, усталость, мораль, ставка) одной транзакцией
+    settlement = await game_logic.post_match_processing(
+        user_id, match_result["result"], players, match_record=match_result["record"]
+    )
+    # Итоги в отчёте — реальные числа расчёта
+    match_result["settlement"] = settlement
+
+    # Отправляем отчёт пользователю: длинный — несколькими сообщениями
+    opponent_name = match_result["opponent_name"]
+    for page in reports.render_match_report(match_result, players, opponent_name):
+        outbox.answer(callback.message, page, parse_mode="Markdown")
+
+    # Если ставка сыграла, сообщаем о выигрыше
+    win_amount = settlement["bet_win"]
+    if win_amount:
+        outbox.answer(
+            callback.message,
             f"🎉 Ваша ставка сыграла! Вы выиграли {win_amount} кредитов!",
             parse_mode="Markdown"
         )
 
-    # Возвращаем в главное меню
-    await callback.message.answer("Главное меню:", reply_markup=keyboards.main_menu)
+    # Возвращаем в главное меню; с той же разметкой меню склеится с последней страницей отчёта
+    outbox.answer(callback.message, "Главное меню:", parse_mode="Markdown", reply_markup=keyboards.main_menu)
     await state.clear()
     await callback.answer()
 
+# Талисман команды
+@dp.callback_query(F.data == "choose_mascot")
+async def choose_mascot(callback: types.CallbackQuery):
+    """
+    Показывает талисманы и их бонусы.
+    """
+    await callback.message.edit_text(
+        "🦊 Выберите талисман команды — его бонус действует во всех матчах:",
+        reply_markup=keyboards.mascot_selection_kb()
+    )
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("mascot_"))
+async def process_mascot_selection(callback: types.CallbackQuery):
+    """
+    Ставит выбранный талисман команде.
+    """
+    mascot_name = callback.data.removeprefix("mascot_")
+    if mascot_name not in config.MASCOTS:
+        await callback.answer("❌ Такого талисмана нет.", show_alert=True)
+        return
+
+    await database.set_team_modifier(callback.from_user.id, "mascot", mascot_name)
+    outbox.answer(
+        callback.message,
+        f"🦊 Талисман команды: {mascot_name} ({config.MASCOTS[mascot_name]['bonus']})",
+        reply_markup=keyboards.main_menu
+    )
+    await callback.answer()
+
 # Система зарплат
 @dp.callback_query(F.data == "pay_salary")
 async def pay_team_salary(callback: types.CallbackQuery):
@@ -398,102 +448,124 @@ async def pay_team_salary(callback: types.CallbackQuery):
     user_id = callback.from_user.id
     players = await database.get_team_players(user_id)
 
-    total_salary = sum(config.SALARY_BY_RARITY[player[4]] for player in players)
+    total_salary = sum(config.SALARY_BY_RARITY[player.rarity] for player in players)
     user = await database.get_user(user_id)
-    balance = user[1]
+    balance = user.balance
 
     if balance >= total_salary:
         # Списываем зарплату
         await database.update_user_balance(user_id, -total_salary)
-        await callback.message.answer(
+        outbox.answer(
+            callback.message,
             f"✅ Зарплата выплачена!\n"
             f"Всего списано: {total_salary} кредитов\n"
             f"Остаток: {balance - total_salary} кредитов"
         )
     else:
         # Не хватает денег — снижаем мораль всем игрокам
-        for player in players:
-            player_id = player[0]
-            current_morale = player[9]
-            new_morale = max(0, current_morale - 20)
-            await database.update_player_stats(player_id, morale=new_morale)
+        await database.adjust_team_stats(user_id, morale=-20)
 
-        await callback.message.answer(
+        outbox.answer(
+            callback.message,
             f"❌ Недостаточно средств для выплаты зарплаты!\n"
             f"Команда недовольна — мораль всех игроков снижена на 20 пунктов."
         )
 
-    await callback.message.answer("Главное меню:", reply_markup=keyboards.main_menu)
+    outbox.answer(callback.message, "Главное меню:", reply_markup=keyboards.main_menu)
     await callback.answer()
 
 # Секция «Букмекер»
 @dp.callback_query(F.data == "bookmaker")
 async def show_bookmaker(callback: types.CallbackQuery, state: FSMContext):
     """
-    Показывает интерфейс букмекера и позволяет сделать ставку на победу.
+    Показывает интерфейс букмекера: шанс и коэффициент для каждой тактики.
+    Ставка делается на победу конкретной тактикой — коэффициент зависит от неё.
     """
     user_id = callback.from_user.id
     user = await database.get_user(user_id)
-    balance = user[1]
-
-    bookmaker_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [
-            types.InlineKeyboardButton(text="💰 Ставка 100 кредитов", callback_data="bet_100"),
-            types.InlineKeyboardButton(text="💰 Ставка 500 кредитов", callback_data="bet_500")
-        ],
-        [
-            types.InlineKeyboardButton(text="💰 Ставка 1 000 кредитов", callback_data="bet_1000"),
-            types.InlineKeyboardButton(text="◀️ Назад", callback_data="main_menu")
-        ]
-    ])
+    balance = user.balance
+    players = await database.get_team_players(user_id)
+    team_vector = await modifiers.get_team_vector(user_id)
+
+    lines = []
+    buttons = []
+    for tactic in config.TACTICS:
+        win_chance = odds.bet_win_probability(players, team_vector, tactic)
+        bet_odds = odds.bet_odds(players, team_vector, tactic)
+        if bet_odds is None:
+            lines.append(f"• {tactic}: шанс {win_chance:.0%}, ставки не принимаются")
+            continue
+        lines.append(f"• {tactic}: шанс {win_chance:.0%}, коэффициент {bet_odds:.2f}")
+        buttons.append([types.InlineKeyboardButton(text=f"🎯 {tactic} — {bet_odds:.2f}",
+                                                   callback_data=f"bettactic_{tactic}")])
+    buttons.append([types.InlineKeyboardButton(text="◀️ Назад", callback_data="main_menu")])
 
     await callback.message.edit_text(
         f"💰 Букмекерская контора\n\n"
-        f"Сделайте ставку на победу в следующем матче.\n"
-        f"При выигрыше ставка удваивается!\n\n"
-        f"Ваш баланс: {balance} кредитов",
-        reply_markup=bookmaker_keyboard
+        f"Сделайте ставку на победу в следующем матче выбранной тактикой.\n"
+        + "\n".join(lines) +
+        f"\n\nВаш баланс: {balance} кредитов",
+        reply_markup=types.InlineKeyboardMarkup(inline_keyboard=buttons)
+    )
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("bettactic_"))
+async def choose_bet_amount(callback: types.CallbackQuery):
+    """
+    Предлагает сумму ставки на победу выбранной тактикой.
+    """
+    tactic = modifiers.parse_tactic(callback.data.removeprefix("bettactic_"))
+    if tactic is None:
+        await callback.answer("❌ Такой тактики нет.", show_alert=True)
+        return
+    await callback.message.edit_text(
+        f"💰 Ставка на победу тактикой «{tactic}». Выберите сумму:",
+        reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text=f"💰 {amount:,} кредитов".replace(",", " "),
+                                        callback_data=f"bet_{amount}_{tactic}")]
+            for amount in (100, 500, 1000)
+        ] + [[types.InlineKeyboardButton(text="◀️ Назад", callback_data="bookmaker")]])
     )
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("bet_"))
 async def process_bet(callback: types.CallbackQuery):
     """
-    Обрабатывает ставку пользователя и сохраняет её в БД.
+    Обрабатывает ставку пользователя (bet_<сумма>_<тактика>) и сохраняет её в БД.
     """
-    amount = int(callback.data.split("_")[1])
+    amount, _, tactic = callback.data.removeprefix("bet_").partition("_")
+    tactic = modifiers.parse_tactic(tactic)
+    if not amount.isdigit() or tactic is None:
+        await callback.answer("❌ Такой ставки нет.", show_alert=True)
+        return
+    amount = int(amount)
     user_id = callback.from_user.id
     user = await database.get_user(user_id)
-    balance = user[1]
+    balance = user.balance
 
     if amount > balance:
         await callback.answer("❌ Недостаточно средств для ставки!", show_alert=True)
         return
 
-    # Сохраняем ставку в БД
-    await database.create_bet(user_id, amount)
+    # Коэффициент фиксируем в момент ставки: состав к матчу может измениться
+    players = await database.get_team_players(user_id)
+    bet_odds = odds.bet_odds(players, await modifiers.get_team_vector(user_id), tactic)
+    if bet_odds is None:
+        await callback.answer("❌ Победа этой тактикой почти гарантирована — ставки не принимаются.",
+                              show_alert=True)
+        return
+    await database.create_bet(user_id, amount, bet_odds, tactic)
 
     await callback.message.edit_text(
         f"✅ Ставка принята!\n"
-        f"Вы поставили {amount} кредитов на победу.\n"
-        f"Если выиграете — получите {amount * 2} кредитов!\n\n"
+        f"Вы поставили {amount} кредитов на победу тактикой «{tactic}» (коэффициент {bet_odds:.2f}).\n"
+        f"Если выиграете — получите {round(amount * bet_odds)} кредитов!\n\n"
         f"Главное меню:",
         reply_markup=keyboards.main_menu
     )
     await callback.answer()
 
-# Запуск бота
-async def main():
-    # Инициализируем базу данных
-    await database.init_db()
-    print("База данных инициализирована")
-
-    # Запускаем бота
-    await dp.start_polling(bot)
-
-if __name__ == "__main__":
-    asyncio.run(main())
-    # Раздел «Трансферный рынок»
+# Раздел «Трансферный рынок»
 @dp.callback_query(F.data == "transfer_market")
 async def show_transfer_market(callback: types.CallbackQuery):
     """
@@ -501,7 +573,7 @@ async def show_transfer_market(callback: types.CallbackQuery):
     """
     user_id = callback.from_user.id
     user = await database.get_user(user_id)
-    balance = user[1]
+    balance = user.balance
 
     # Генерируем 3 случайных игрока для рынка
     market_players = []
@@ -535,20 +607,20 @@ async def show_transfer_market(callback: types.CallbackQuery):
             "price": price
         })
 
-    # Сохраняем игроков рынка в БД для текущего пользователя
-    await database.set_market_players(user_id, market_players)
+    # Сохраняем предложения рынка в БД для текущего пользователя
+    offers = await database.set_market_players(user_id, market_players)
 
     # Формируем сообщение
     market_text = "🏪 Трансферный рынок\n\n"
-    for i, player in enumerate(market_players, 1):
+    for i, offer in enumerate(offers, 1):
         market_text += (
-            f"{i}. **{player['nickname']}**\n"
-            f"Позиция: {player['position']} | Редкость: {player['rarity']}\n"
-            f"Стрельба: {player['aim']} | Реакция: {player['reaction']} | Тактика: {player['tactics']}\n"
-            f"💰 Цена: {player['price']} кредитов\n\n"
+            f"{i}. **{offer.nickname}**\n"
+            f"Позиция: {offer.position} | Редкость: {offer.rarity}\n"
+            f"Стрельба: {offer.aim} | Реакция: {offer.reaction} | Тактика: {offer.tactics}\n"
+            f"💰 Цена: {offer.price} кредитов\n\n"
         )
 
-    market_keyboard = keyboards.create_market_keyboard(market_players)
+    market_keyboard = keyboards.create_market_keyboard(offers)
 
     await callback.message.edit_text(
         market_text,
@@ -562,45 +634,47 @@ async def buy_player_from_market(callback: types.CallbackQuery):
     """
     Обрабатывает покупку игрока с трансферного рынка.
     """
-    player_index = int(callback.data.split("_")[2])
+    offer_id = int(callback.data.split("_")[2])
     user_id = callback.from_user.id
 
-    market_players = await database.get_market_players(user_id)
-    if not market_players or player_index >= len(market_players):
+    offer = await database.get_market_offer(user_id, offer_id)
+    if offer is None:
         await callback.answer("❌ Игрок недоступен.", show_alert=True)
         return
 
-    player = market_players[player_index]
-    price = player["price"]
-    user = await database.get_user(user_id)
-    balance = user[1]
+    price = offer.price
+
+    # Проверка баланса, захват предложения, списание и создание игрока — одной транзакцией
+    async with database.transaction():
+        user = await database.get_user(user_id)
+        balance = user.balance
+        if balance < price:
+            player = None
+        else:
+            player = await database.claim_market_offer(user_id, offer_id)
+            if player is not None:
+                await database.update_user_balance(user_id, -price)
+                await database.create_player(
+                    owner_id=user_id,
+                    nickname=player.nickname,
+                    position=player.position,
+                    rarity=player.rarity,
+                    aim=player.aim,
+                    reaction=player.reaction,
+                    tactics=player.tactics,
+                    stamina=100,
+                    morale=80
+                )
 
     if balance < price:
         await callback.answer(f"❌ Недостаточно средств! Требуется: {price} кредитов.", show_alert=True)
         return
-
-    # Покупаем игрока
-    await database.update_user_balance(user_id, -price)
-    await database.add_player(
-        owner_id=user_id,
-        nickname=player["nickname"],
-        position=player["position"],
-        rarity=player["rarity"]
-    )
-
-    players = await database.get_team_players(user_id)
-    player_id = [p[0] for p in players if p[2] == player["nickname"]][0]
-    await database.update_player_stats(
-        player_id,
-        aim=player["aim"],
-        reaction=player["reaction"],
-        tactics=player["tactics"],
-        stamina=100,
-        morale=80
-    )
+    if player is None:
+        await callback.answer("❌ Игрок уже куплен или предложение истекло.", show_alert=True)
+        return
 
     await callback.message.edit_text(
-        f"✅ Игрок **{player['nickname']}** успешно куплен!\n"
+        f"✅ Игрок **{player.nickname}** успешно куплен!\n"
         f"Списано: {price} кредитов\n"
         f"Остаток: {balance - price} кредитов",
         parse_mode="Markdown",
@@ -616,16 +690,13 @@ async def open_case(callback: types.CallbackQuery, state: FSMContext):
     """
     user_id = callback.from_user.id
     user = await database.get_user(user_id)
-    balance = user[1]
+    balance = user.balance
 
     case_cost = config.CASE_COST
     if balance < case_cost:
         await callback.answer(f"❌ Недостаточно средств для открытия кейса! Требуется: {case_cost} кредитов.", show_alert=True)
         return
 
-    # Списываем стоимость кейса
-    await database.update_user_balance(user_id, -case_cost)
-
     # Определяем редкость выпавшего игрока
     rarity_weights = [
         ("Неопытный", 50),
@@ -658,11 +729,10 @@ async def open_case(callback: types.CallbackQuery, state: FSMContext):
     reaction += random.randint(-5, 5)
     tactics += random.randint(-5, 5)
 
-    # Создаём игрока в БД
-    await database.add_player(user_id, nickname, position, rarity)
-    players = await database.get_team_players(user_id)
-    player_id = [p[0] for p in players if p[2] == nickname][0]
-    await database.update_player_stats(player_id, aim=aim, reaction=reaction, tactics=tactics, stamina=100, morale=80)
+    # Списываем стоимость кейса и создаём игрока одной транзакцией
+    async with database.transaction():
+        await database.update_user_balance(user_id, -case_cost)
+        await database.create_player(user_id, nickname, position, rarity, aim, reaction, tactics, stamina=100, morale=80)
 
     # Отправляем сообщение о выпавшем игроке
     case_result = (
@@ -679,7 +749,7 @@ async def open_case(callback: types.CallbackQuery, state: FSMContext):
     """
     user_id = callback.from_user.id
     user = await database.get_user(user_id)
-    balance = user[1]
+    balance = user.balance
 
     case_cost = config.CASE_COST
     if balance < case_cost:
@@ -687,9 +757,6 @@ async def open_case(callback: types.CallbackQuery, state: FSMContext):
         return
 
 
-    # Списываем стоимость кейса
-    await database.update_user_balance(user_id, -case_cost)
-
     # Определяем редкость выпавшего игрока
     rarity_weights = [
         ("Неопытный", 50),
@@ -722,11 +789,10 @@ async def open_case(callback: types.CallbackQuery, state: FSMContext):
     reaction += random.randint(-5, 5)
     tactics += random.randint(-5, 5)
 
-    # Создаём игрока в БД
-    await database.add_player(user_id, nickname, position, rarity)
-    players = await database.get_team_players(user_id)
-    player_id = [p[0] for p in players if p[2] == nickname][0]
-    await database.update_player_stats(player_id, aim=aim, reaction=reaction, tactics=tactics, stamina=100, morale=80)
+    # Списываем стоимость кейса и создаём игрока одной транзакцией
+    async with database.transaction():
+        await database.update_user_balance(user_id, -case_cost)
+        await database.create_player(user_id, nickname, position, rarity, aim, reaction, tactics, stamina=100, morale=80)
 
     # Отправляем сообщение о выпавшем игроке
     case_result = (
@@ -779,7 +845,31 @@ async def cmd_help(message: types.Message):
         "Если возникли проблемы — напишите @admin"
     )
 
-    await message.answer(help_text, parse_mode="Markdown")
+    outbox.answer(message, help_text, parse_mode="Markdown")
+
+# Команда /stats — метрики для администратора
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    """
+    Показывает глубину очередей обработчиков, пул симуляций и кэши базы.
+    """
+    if message.from_user.id != config.ADMIN_ID:
+        return
+
+    queues = user_serial.stats()
+    stats_text = (
+        "📈 Очереди пользователей:\n"
+        f"• В работе: {queues['active_users']}, ждут: {queues['waiting']} (сейчас максимум {queues['deepest']})\n"
+        f"• Пиковая глубина: {queues['max_depth']}\n"
+        f"• Обработано: {queues['processed']}, склеено повторов: {queues['coalesced']}\n"
+        f"• Отклонено по частоте: {throttling.stats()['rejected']} (вёдер: {throttling.stats()['buckets']})\n\n"
+        f"🌐 Вебхук: {webhook_server.stats()}\n"
+        f"🧮 Симуляции: {simulation.get_executor().stats()}\n"
+        f"🗄 Кэши: {database.cache_stats()}\n"
+        f"🧭 Состояния FSM: {storage.stats()}\n"
+        f"📤 Исходящие: {outbox.stats()}"
+    )
+    outbox.answer(message, stats_text, sender.PRIORITY_LOW)
 
 # Обработка ошибок и запуск бота
 async def main():
@@ -787,17 +877,32 @@ async def main():
         # Инициализируем базу данных
         await database.init_db()
         print("База данных инициализирована")
+        simulation.start()
 
         # Запускаем бота
-        print("Бот запущен и готов к работе!")
-        await dp.start_polling(bot)
+        print(f"Бот запущен и готов к работе! Режим: {config.BOT_MODE}")
+        if config.BOT_MODE == "webhook":
+            await webhook.run(dp, bot, webhook_server)
+        else:
+            # getUpdates не работает, пока установлен вебхук (например, после запуска в режиме webhook)
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
 
     except Exception as e:
         print(f"Критическая ошибка: {e}")
         print("Попытка перезапуска через 10 секунд...")
+        await storage.close()
+        await database.close_db()
+        await simulation.stop()
         await asyncio.sleep(10)
         await main()  # рекурсивный перезапуск при ошибке
 
+    finally:
+        # Сбрасываем состояния FSM, закрываем пул соединений и пул симуляций при остановке
+        await storage.close()
+        await database.close_db()
+        await simulation.stop()
+
 if __name__ == "__main__":
 
     asyncio.run(main())
@@ -3,11 +3,76 @@ import os
 # Берем токен из переменных окружения Railway
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Настройки базы данных
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")  # "sqlite" или "memory" (для бенчмарков и тестов)
+DB_PATH = os.getenv("DB_PATH", "cs2_manager.db")
+DB_READERS = int(os.getenv("DB_READERS", "4"))  # количество соединений-читателей в пуле
+DB_TIMEOUT = 5.0  # сколько секунд ждать снятия блокировки SQLite
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))  # страничный кэш на соединение
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # объём отображения файла в память
+
+# Кэш пользователей и составов в памяти процесса
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "10000"))  # записей в каждом кэше
+CACHE_TTL = float(os.getenv("CACHE_TTL", "30"))  # секунд жизни записи
+
+# Отложенная запись приращений баланса и фанатов (выключена по умолчанию)
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "1.0"))  # период сброса, секунд
+WRITE_BEHIND_MAX_PENDING = int(os.getenv("WRITE_BEHIND_MAX_PENDING", "500"))  # сброс раньше при стольких пользователях
+
+# Пул процессов для тяжёлых симуляций (турниры, пакеты матчей)
+SIM_WORKERS = int(os.getenv("SIM_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))  # 0 — считать в основном процессе
+SIM_MAX_PENDING = int(os.getenv("SIM_MAX_PENDING", "32"))  # задач в работе и в очереди одновременно
+SIM_INLINE_MAX_MATCHES = 256  # пакеты не больше этого считаются без пула
+
+# Режим получения обновлений: "polling" (long polling) или "webhook" (aiohttp-сервер, см. webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+BOT_API_URL = os.getenv("BOT_API_URL")  # свой сервер Bot API (локальный или поддельный для тестов); None — api.telegram.org
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес экземпляра или балансировщика; None — вебхук задан снаружи
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # сверяется с заголовком X-Telegram-Bot-Api-Secret-Token
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("PORT", "8080"))  # Railway передаёт порт в PORT
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "64"))  # обновлений в обработке одновременно
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "25"))  # секунд ждать начатые обновления при остановке
+
+# Хранилище состояний FSM в базе (fsm_storage.py)
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))  # состояний в памяти (LRU)
+FSM_TTL = float(os.getenv("FSM_TTL", str(24 * 60 * 60)))  # через сколько секунд без изменений сценарий считается брошенным
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1.0"))  # период записи изменений в базу, секунд
+FSM_FLUSH_MAX_PENDING = 200  # запись раньше при стольких изменённых состояниях
+FSM_SWEEP_INTERVAL = 10 * 60  # как часто (секунд) удалять брошенные сценарии
+
+# Очередь исходящих сообщений (sender.py): (сообщений в секунду, размер ведра)
+OUTBOX_GLOBAL_RATE = (30.0, 30)  # на весь бот
+OUTBOX_CHAT_RATE = (1.0, 3)  # в личный чат
+OUTBOX_GROUP_RATE = (20 / 60, 5)  # в группу: не больше 20 в минуту
+OUTBOX_MAX_ATTEMPTS = 3  # попыток при сетевых ошибках и ошибках сервера
+OUTBOX_DRAIN_TIMEOUT = float(os.getenv("OUTBOX_DRAIN_TIMEOUT", "10"))  # секунд дописывать очередь при остановке
+
+# Ограничение частоты действий пользователя: (токенов в секунду, размер ведра)
+THROTTLE_USER_RATE = (float(os.getenv("THROTTLE_USER_PER_SEC", "2")), int(os.getenv("THROTTLE_USER_BURST", "8")))
+# Отдельные вёдра для дорогих действий; ключ — начало callback_data или команда без «/»
+THROTTLE_ACTION_RATES = {
+    "start_match": (0.2, 2),
+    "tactic_": (0.2, 2),  # сама симуляция матча
+    "open_case": (0.5, 3),
+    "transfer_market": (0.5, 3),
+    "buy_player_": (0.5, 3),
+}
+THROTTLE_SWEEP_INTERVAL = 60.0  # как часто (секунд) удалять заполнившиеся вёдра
+
 # Настройки экономики
 START_BALANCE = 50000
 CASE_PRICE = 2500
 TRAINING_COST = 1000  # Добавь, если Алиса использовала это название
 BOOST_CAMP_COST = 10000 
+MARKET_OFFER_TTL = 15 * 60  # сколько секунд действуют предложения трансферного рынка
+BOOKMAKER_MARGIN = 0.05  # доля, которую букмекер закладывает в коэффициент
+BET_MAX_ODDS = 10.0  # потолок коэффициента для заведомо слабых составов
+BET_MIN_ODDS = 1.05  # ниже — ставку на заведомую победу не принимаем
+ENEMY_POWER_RANGE = (4.5, 5.5)  # сила соперника: средняя сила игрока × U(min, max)
+OPPONENT_NAMES = ["Команда Alpha", "Команда Beta", "Команда Gamma", "Команда Delta"]
 
 # Зарплаты по редкости игроков
 SALARY_BY_RARITY = {
@@ -18,23 +83,24 @@ SALARY_BY_RARITY = {
     "Легендарный": 12000,
     }
 
-# Словари талисманов и их эффектов
+# Словари талисманов и их эффектов.
+# modifiers — прибавки к характеристикам каждого игрока в матче (см. modifiers.py)
 MASCOTS = {
     "Волк": {
         "bonus": "Сыгранность +10% (Aim +5, Reaction +5)",
-        "effect": lambda aim, reaction, morale: {"aim": aim + 5, "reaction": reaction + 5, "morale": morale}
+        "modifiers": {"aim": 5, "reaction": 5}
     },
     "Орёл": {
         "bonus": "Реакция +5",
-        "effect": lambda aim, reaction, morale: {"aim": aim, "reaction": reaction + 5, "morale": morale}
+        "modifiers": {"reaction": 5}
     },
     "Дракон": {
         "bonus": "Мораль +15",
-        "effect": lambda aim, reaction, morale: {"aim": aim, "reaction": reaction, "morale": morale + 15}
+        "modifiers": {"morale": 15}
     },
     "Кот": {
         "bonus": "Удача +10% (шанс двойного выпадения кейса)",
-        "effect": lambda aim, reaction, morale: {"aim": aim, "reaction": reaction, "morale": morale}
+        "modifiers": {}
     }
 }
 
@@ -43,17 +109,20 @@ SPONSORS = {
     "Logitech": {
         "weekly_payment": 500,
         "condition": "3 победы подряд",
-        "penalty": 200  # штраф за невыполнение
+        "penalty": 200,  # штраф за невыполнение
+        "modifiers": {"aim": 2}  # девайсы спонсора
     },
     "Red Bull": {
         "weekly_payment": 2000,
         "condition": "5+ матчей в месяц",
-        "penalty": 500
+        "penalty": 500,
+        "modifiers": {"reaction": 2}
     },
     "Nike": {
         "weekly_payment": 1000,
         "condition": "рейтинг команды > 50",
-        "penalty": 300
+        "penalty": 300,
+        "modifiers": {"morale": 3}
     }
 }
 
@@ -68,7 +137,8 @@ MAPS = [
     "Ancient"
 ]
 
-# Пул случайных событий между матчами
+# Пул случайных событий между матчами.
+# События с duration действуют ещё столько матчей: их *_change становятся модификаторами команды
 RANDOM_EVENTS = [
     {
         "name": "Загул в клубе",
@@ -1,138 +1,231 @@
-import aiosqlite
-import json
 import random
 from datetime import datetime
 
+import config
+from storage import (StorageBackend, User, Player, Bet, MarketOffer, MatchRecord, TeamPower, TeamModifier, FSMRecord,
+                     LINEUP_SIZE, round_chance, starting_lineup)
+
+# 0. Выбор хранилища: SQLite в бою, память — для бенчмарков и отладки
+_backend = None
+
+def _get_backend() -> StorageBackend:
+    if _backend is None:
+        raise RuntimeError("База данных не инициализирована: сначала вызовите init_db()")
+    return _backend
+
+def _make_backend(name: str) -> StorageBackend:
+    if name == "sqlite":
+        from sqlite_backend import SQLiteBackend
+        return SQLiteBackend()
+    if name == "memory":
+        from memory_backend import MemoryBackend
+        return MemoryBackend()
+    raise ValueError(f"Неизвестное хранилище: {name}")
+
 # 1. Инициализация БД (создание таблиц)
-async def init_db():
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        # Таблица пользователей
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                balance INTEGER DEFAULT 1000,
-                fans INTEGER DEFAULT 0,
-                reputation INTEGER DEFAULT 50,
-                team_name TEXT
-            )
-        ''')
-        # Таблица игроков
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS players (
-                player_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                owner_id INTEGER,
-                nickname TEXT,
-                position TEXT,
-                rarity TEXT,
-                aim INTEGER,
-                reaction INTEGER,
-                tactics INTEGER,
-                stamina INTEGER DEFAULT 100,
-                morale INTEGER DEFAULT 100,
-                FOREIGN KEY (owner_id) REFERENCES users (user_id)
-            )
-        ''')
-        # Таблица ставок
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS bets (
-                bet_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                amount INTEGER,
-                is_active BOOLEAN DEFAULT 1
-            )
-        ''')
-        # Таблица рынка
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS market_players (
-                user_id INTEGER PRIMARY KEY,
-                data TEXT
-            )
-        ''')
-        await db.commit()
+async def init_db(backend: StorageBackend = None):
+    """
+    Открывает хранилище.
+    :param backend: готовый экземпляр StorageBackend; по умолчанию выбирается по config.STORAGE_BACKEND
+    """
+    global _backend
+    if _backend is not None:
+        return
+    backend = backend or _make_backend(config.STORAGE_BACKEND)
+    await backend.open()
+    _backend = backend
+
+async def close_db():
+    global _backend
+    if _backend is not None:
+        backend, _backend = _backend, None
+        await backend.close()
+
+def transaction():
+    """
+    Единица работы: все записи внутри коммитятся один раз на выходе.
+    Любые функции записи, вызванные внутри, присоединяются к ней, а не коммитят сами.
+    При исключении всё откатывается.
+
+    Пример:
+        async with database.transaction():
+            await database.update_user_balance(user_id, -price)
+            await database.create_player(user_id, ...)
+    """
+    return _get_backend().transaction()
+
+def cache_stats() -> dict:
+    """Счётчики кэша, чтобы подбирать его размер."""
+    return _get_backend().cache_stats()
+
+async def flush_pending():
+    """Принудительно записывает накопленные приращения (если буфер включён)."""
+    await _get_backend().flush_pending()
+
+async def check_query_plans() -> list:
+    """
+    Проверяет, что горячие запросы идут по индексам.
+    :return: список описаний проблем (пустой, если всё в порядке)
+    """
+    return await _get_backend().check_query_plans()
 
 # 2. Функции пользователя
 async def create_user(user_id: int, team_name: str):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        await db.execute(
-            "INSERT OR IGNORE INTO users (user_id, team_name, balance) VALUES (?, ?, ?)",
-            (user_id, team_name, 1000)
-        )
-        await db.commit()
+    await _get_backend().create_user(user_id, team_name)
 
 async def get_user(user_id: int):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        async with db.execute("SELECT * FROM users WHERE user_id = ?", (user_id,)) as cursor:
-            return await cursor.fetchone()
+    return await _get_backend().get_user(user_id)
 
 async def update_user_balance(user_id: int, amount: int):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        await db.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, user_id))
-        await db.commit()
+    await _get_backend().update_user_balance(user_id, amount)
+
+async def add_user_fans(user_id: int, amount: int):
+    await _get_backend().add_user_fans(user_id, amount)
 
 # 3. Функции игроков
 async def add_player(owner_id, nickname, position, rarity):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        await db.execute(
-            "INSERT INTO players (owner_id, nickname, position, rarity, aim, reaction, tactics, stamina, morale) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (owner_id, nickname, position, rarity, 50, 50, 50, 100, 100)
-        )
-        await db.commit()
+    await create_player(owner_id, nickname, position, rarity, 50, 50, 50)
+
+async def create_player(owner_id, nickname, position, rarity, aim, reaction, tactics, stamina=100, morale=100) -> int:
+    """
+    Создаёт игрока сразу со всеми характеристиками одним запросом.
+    :return: player_id нового игрока
+    """
+    return await _get_backend().create_player(owner_id, nickname, position, rarity, aim, reaction, tactics,
+                                              stamina, morale)
+
+async def create_players(owner_id, players: list) -> list:
+    """
+    Массовая выдача игроков (например, «Кейс новичка») одним INSERT.
+    :param players: список словарей с ключами nickname, position, rarity, aim, reaction, tactics
+                    и необязательными stamina, morale
+    :return: список player_id в том же порядке, что и players
+    """
+    return await _get_backend().create_players(owner_id, players)
 
 async def get_team_players(owner_id: int):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        async with db.execute("SELECT * FROM players WHERE owner_id = ?", (owner_id,)) as cursor:
-            return await cursor.fetchall()
+    return await _get_backend().get_team_players(owner_id)
 
 async def get_player(player_id: int):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        async with db.execute("SELECT * FROM players WHERE player_id = ?", (player_id,)) as cursor:
-            return await cursor.fetchone()
+    return await _get_backend().get_player(player_id)
+
+async def get_team_power(owner_id: int) -> TeamPower:
+    """
+    Материализованная сила стартовой пятёрки (storage.starting_lineup): хранилище обновляет её
+    при каждом изменении игроков, поэтому чтение не обходит состав (см. game_logic.team_power_value).
+    """
+    return await _get_backend().get_team_power(owner_id)
+
+async def get_top_teams(limit: int = 10) -> list:
+    """Самые сильные стартовые пятёрки (TeamPower) по базовой силе без тактики и талисмана."""
+    return await _get_backend().get_top_teams(limit)
 
 async def update_player_stats(player_id, **kwargs):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        for key, value in kwargs.items():
-            if isinstance(value, str) and value.startswith('+'):
-                await db.execute(f"UPDATE players SET {key} = {key} + ? WHERE player_id = ?", (int(value[1:]), player_id))
-            elif isinstance(value, str) and value.startswith('-'):
-                await db.execute(f"UPDATE players SET {key} = {key} - ? WHERE player_id = ?", (int(value[1:]), player_id))
-            else:
-                await db.execute(f"UPDATE players SET {key} = ? WHERE player_id = ?", (value, player_id))
-        await db.commit()
+    await _get_backend().update_player_stats(player_id, **kwargs)
 
 async def reduce_player_stamina(owner_id: int, amount: int):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        await db.execute("UPDATE players SET stamina = MAX(0, stamina - ?) WHERE owner_id = ?", (amount, owner_id))
-        await db.commit()
-
-# 4. Рынок и ставки
-async def set_market_players(user_id: int, players: list):
-    data_json = json.dumps(players)
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        await db.execute("INSERT OR REPLACE INTO market_players (user_id, data) VALUES (?, ?)", (user_id, data_json))
-        await db.commit()
-
-async def get_market_players(user_id: int):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        async with db.execute("SELECT data FROM market_players WHERE user_id = ?", (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            return json.loads(row[0]) if row else []
-
-async def create_bet(user_id: int, amount: int):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        await db.execute("INSERT INTO bets (user_id, amount) VALUES (?, ?)", (user_id, amount))
-        await db.update_user_balance(user_id, -amount) # Сразу списываем ставку
-        await db.commit()
+    await _get_backend().reduce_player_stamina(owner_id, amount)
+
+async def adjust_team_stats(owner_id: int, low: int = 0, high: int = 100, **deltas):
+    """
+    Одним UPDATE прибавляет дельты ко всем игрокам владельца с ограничением [low, high].
+    Пример: adjust_team_stats(user_id, stamina=-12, morale=5)
+    """
+    await _get_backend().adjust_team_stats(owner_id, low, high, **deltas)
+
+async def adjust_players_stats(player_ids: list, low: int = 0, high: int = 100, **deltas):
+    """
+    То же, что adjust_team_stats, но для выбранных игроков: один executemany и один коммит.
+    """
+    await _get_backend().adjust_players_stats(player_ids, low, high, **deltas)
+
+# 4. Модификаторы команды
+async def get_team_modifiers(user_id: int) -> tuple:
+    """Источники модификаторов команды (TeamModifier): талисман, спонсор, эффекты событий."""
+    return await _get_backend().get_team_modifiers(user_id)
+
+async def set_team_modifier(user_id: int, source: str, name: str = None):
+    """
+    Ставит бессрочный модификатор: талисман (source="mascot") или спонсора (source="sponsor").
+    :param name: ключ в config.MASCOTS / config.SPONSORS; None — снять
+    """
+    await _get_backend().set_team_modifier(user_id, source, name)
+
+async def add_team_effect(user_id: int, name: str, matches: int):
+    """Эффект случайного события (ключ — name из config.RANDOM_EVENTS) на matches матчей."""
+    await _get_backend().add_team_effect(user_id, name, matches)
+
+async def tick_team_effects(user_id: int):
+    """Списывает сыгранный матч со всех эффектов событий."""
+    await _get_backend().tick_team_effects(user_id)
+
+# 5. Рынок
+async def set_market_players(user_id: int, players: list) -> list:
+    """
+    Заменяет предложения рынка пользователя новыми.
+    :param players: список словарей с ключами nickname, position, rarity, aim, reaction, tactics, price
+    :return: список MarketOffer с присвоенными offer_id
+    """
+    return await _get_backend().set_market_players(user_id, players)
+
+async def get_market_players(user_id: int) -> list:
+    """Активные (не купленные и не просроченные) предложения рынка пользователя."""
+    return await _get_backend().get_market_players(user_id)
+
+async def get_market_offer(user_id: int, offer_id: int):
+    return await _get_backend().get_market_offer(user_id, offer_id)
+
+async def claim_market_offer(user_id: int, offer_id: int):
+    """
+    Атомарно помечает предложение купленным.
+    :return: MarketOffer, если предложение было доступно, иначе None (уже куплено или истекло)
+    """
+    return await _get_backend().claim_market_offer(user_id, offer_id)
+
+# 6. Ставки
+async def create_bet(user_id: int, amount: int, odds: float = 2.0, tactic: str = None):
+    """
+    Принимает ставку на победу и сразу списывает её с баланса.
+    :param odds: коэффициент, по которому ставка будет выплачена при победе
+    :param tactic: тактика, по которой посчитан коэффициент; матч по ставке играется только ею
+    """
+    await _get_backend().create_bet(user_id, amount, odds, tactic)
 
 async def get_active_bet(user_id: int):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        async with db.execute("SELECT amount FROM bets WHERE user_id = ? AND is_active = 1", (user_id,)) as cursor:
-            row = await cursor.fetchone()
-            return {"amount": row[0]} if row else None
+    return await _get_backend().get_active_bet(user_id)
 
 async def clear_bet(user_id: int):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        await db.execute("UPDATE bets SET is_active = 0 WHERE user_id = ?", (user_id,))
-        await db.commit()
+    await _get_backend().clear_bet(user_id)
+
+# 7. Матчи
+async def save_match(record: MatchRecord) -> int:
+    """
+    Сохраняет компактную запись матча.
+    :return: match_id
+    """
+    return await _get_backend().save_match(record)
+
+async def get_match(match_id: int):
+    return await _get_backend().get_match(match_id)
+
+async def get_user_matches(user_id: int, limit: int = 10) -> list:
+    """Последние матчи пользователя, новые первыми."""
+    return await _get_backend().get_user_matches(user_id, limit)
+
+# 8. Состояния FSM (хранилище aiogram из fsm_storage.py)
+async def get_fsm_record(key: str):
+    return await _get_backend().get_fsm_record(key)
+
+async def save_fsm_records(records: list):
+    """
+    Записывает пачку состояний одной транзакцией.
+    :param records: записи FSMRecord; запись без state и data удаляет сценарий
+    """
+    await _get_backend().save_fsm_records(records)
+
+async def delete_expired_fsm_records(before: float) -> int:
+    """Удаляет брошенные сценарии, не менявшиеся с момента before (time.time())."""
+    return await _get_backend().delete_expired_fsm_records(before)
 
 async def log_random_event(user_id, name, desc):
     # Заглушка для логов событий (можно расширить)
@@ -144,9 +237,7 @@ async def add_sticker_to_collection(user_id, item, rarity):
 
 # Теперь следующая функция будет работать правильно
 async def update_user_field(user_id, field, value):
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        await db.execute(f"UPDATE users SET {field} = ? WHERE user_id = ?", (value, user_id))
-        await db.commit()
+    await _get_backend().update_user_field(user_id, field, value)
 
 async def add_skin(owner_id, nickname, position, rarity):
     await add_player(owner_id, nickname, position, rarity)
@@ -156,4 +247,3 @@ async def get_skins(owner_id):
 
 async def add_suggestion(user_id, text):
     pass # Заглушка, чтобы не было ошибки
-
@@ -0,0 +1,181 @@
+import asyncio
+import contextvars
+import json
+import time
+from collections import OrderedDict
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+import config
+import database
+from storage import FSMRecord
+
+# Состояния FSM aiogram в базе игры: после перезапуска пользователь продолжает с того же шага.
+# Перед базой стоит LRU-кэш в памяти, изменения пишутся в неё пачками по таймеру
+# (одна транзакция на пачку, а не коммит на каждый переход), брошенные сценарии удаляются по TTL.
+_KEY_BUILDER = DefaultKeyBuilder(with_bot_id=True, with_business_connection_id=True, with_destiny=True)
+
+class DatabaseStorage(BaseStorage):
+    """
+    Хранилище FSM поверх database.py (SQLite или память — как настроено в config.STORAGE_BACKEND).
+
+    Чтение: ещё не записанные изменения → LRU-кэш → база. Кэш помнит и отсутствие сценария,
+    поэтому обычные обновления без состояния не ходят в базу повторно.
+    Запись: новое значение сразу попадает в кэш и в очередь на запись, которую фоновая задача
+    сбрасывает раз в flush_interval секунд или раньше, если набралось max_pending изменений.
+    Сценарий, не менявшийся дольше ttl секунд, считается брошенным: он читается как пустой
+    и периодически удаляется из кэша и базы.
+    """
+
+    def __init__(self, maxsize: int = None, ttl: float = None, flush_interval: float = None,
+                 max_pending: int = None, sweep_interval: float = None):
+        self.maxsize = maxsize or config.FSM_CACHE_SIZE
+        self.ttl = ttl or config.FSM_TTL
+        self.flush_interval = flush_interval or config.FSM_FLUSH_INTERVAL
+        self.max_pending = max_pending or config.FSM_FLUSH_MAX_PENDING
+        self.sweep_interval = sweep_interval or config.FSM_SWEEP_INTERVAL
+        self._entries = OrderedDict()  # ключ -> FSMRecord, от давно использованных к недавним
+        self._pending = {}  # изменения, которые ещё не начали записывать
+        self._inflight = {}  # изменения, которые записываются прямо сейчас
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._loop_task = None
+        self._next_sweep = time.monotonic() + self.sweep_interval
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.expired = 0
+
+    # Чтение и запись
+    def _recent(self, key: str):
+        record = self._pending.get(key) or self._inflight.get(key)
+        if record is None:
+            record = self._entries.get(key)
+            if record is not None:
+                self._entries.move_to_end(key)
+        return record
+
+    def _remember(self, record: FSMRecord):
+        self._entries[record.key] = record
+        self._entries.move_to_end(record.key)
+        while len(self._entries) > self.maxsize:
+            # Вытесняем только из кэша: незаписанные изменения лежат в _pending
+            self._entries.popitem(last=False)
+
+    async def _lookup(self, key) -> FSMRecord:
+        key = _KEY_BUILDER.build(key)
+        record = self._recent(key)
+        if record is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            stored = await database.get_fsm_record(key) or FSMRecord(key, None, None, time.time())
+            # Пока читали базу, состояние могли изменить — свежее значение важнее
+            record = self._recent(key)
+            if record is None:
+                record = stored
+                self._remember(record)
+        if record.updated_at < time.time() - self.ttl:
+            return FSMRecord(key, None, None, record.updated_at)
+        return record
+
+    def _write(self, key: str, state, data):
+        record = FSMRecord(key, state, data, time.time())
+        self._pending[key] = record
+        self._remember(record)
+        self._schedule()
+
+    async def set_state(self, key, state=None) -> None:
+        current = await self._lookup(key)
+        self._write(current.key, state.state if isinstance(state, State) else state, current.data)
+
+    async def get_state(self, key):
+        return (await self._lookup(key)).state
+
+    async def set_data(self, key, data) -> None:
+        # Сериализуем сразу: несериализуемые данные должны упасть в обработчике, а не при фоновой записи
+        current = await self._lookup(key)
+        self._write(current.key, current.state, json.dumps(dict(data), ensure_ascii=False) if data else None)
+
+    async def get_data(self, key) -> dict:
+        data = (await self._lookup(key)).data
+        return json.loads(data) if data else {}
+
+    # Фоновая запись
+    def _schedule(self):
+        # Свежий контекст: фоновые задачи не должны присоединиться к открытой транзакции обработчика
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._run(), context=contextvars.Context())
+        if len(self._pending) >= self.max_pending and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_now(), context=contextvars.Context())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() >= self._next_sweep:
+                    await self.sweep()
+            except Exception as e:
+                print(f"Ошибка записи состояний FSM: {e}")
+
+    async def _flush_now(self):
+        try:
+            await self.flush()
+        finally:
+            self._flush_task = None
+
+    async def flush(self):
+        """Записывает накопленные изменения одной транзакцией."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+            try:
+                await database.save_fsm_records(list(batch.values()))
+                self.flushes += 1
+            except Exception:
+                # Возвращаем в очередь всё, что с тех пор не изменили заново
+                for key, record in batch.items():
+                    self._pending.setdefault(key, record)
+                raise
+            finally:
+                self._inflight = {}
+
+    async def sweep(self) -> int:
+        """
+        Удаляет брошенные сценарии из кэша и базы.
+        :return: сколько записей удалено из базы
+        """
+        self._next_sweep = time.monotonic() + self.sweep_interval
+        before = time.time() - self.ttl
+        for key in [key for key, record in self._entries.items() if record.updated_at < before]:
+            del self._entries[key]
+        removed = await database.delete_expired_fsm_records(before)
+        self.expired += removed
+        return removed
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись и сбрасывает всё накопленное. После close хранилищем можно пользоваться снова."""
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+        if self._flush_task is not None:
+            await self._flush_task
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._entries),
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushes": self.flushes,
+            "expired": self.expired,
+        }
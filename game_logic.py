@@ -1,133 +1,683 @@
+import bisect
+import math
 import random
+import secrets
+import time
 from datetime import datetime
+import numpy as np
 import config
-from database import reduce_player_stamina, update_player_stats, log_random_event, add_sticker_to_collection
+import modifiers
+from database import (MatchRecord, TeamPower, LINEUP_SIZE, round_chance, starting_lineup, adjust_team_stats,
+                      log_random_event, add_sticker_to_collection)
 
-def calculate_team_power(players: list, tactic: str, mascot_bonus: dict) -> float:
+def calculate_team_power(players: list, vector: tuple = modifiers.NEUTRAL) -> float:
     """
     Рассчитывает общую силу команды с учётом характеристик игроков, их усталости и бонусов.
-    :param players: список игроков (из БД)
-    :param tactic: выбранная тактика матча
-    :param mascot_bonus: бонус от талисмана (словарь с изменениями характеристик)
+    :param players: список игроков (database.Player)
+    :param vector: вектор модификаторов команды с тактикой (см. modifiers.py)
     :return: общая сила команды (float)
     """
-    total_power = 0.0
-
-    for player in players:
-        # player[5] — aim, [6] — reaction, [7] — tactics, [8] — stamina
-        aim = player[5]
-        reaction = player[6]
-        tactics = player[7]
-        stamina = player[8]
-
-        # Применяем бонус талисмана к характеристикам игрока
-        if 'aim' in mascot_bonus:
-            aim += mascot_bonus['aim']
-        if 'reaction' in mascot_bonus:
-            reaction += mascot_bonus['reaction']
-        if 'morale' in mascot_bonus:
-            tactics += mascot_bonus['morale']  # мораль косвенно влияет на тактику
-
-        # Корректировка силы с учётом усталости
-        if stamina < 50:
-            fatigue_multiplier = stamina / 50.0  # при 50 % — множитель 1.0, ниже — падает
-        else:
-            fatigue_multiplier = 1.0
+    return team_power_value(TeamPower.of(None, players), vector)
 
-        # Базовая сила игрока: среднее характеристик, взвешенное по важности
-        player_power = (aim * 0.4 + reaction * 0.3 + tactics * 0.3) * fatigue_multiplier
-        total_power += player_power
+def team_power_value(power: TeamPower, vector: tuple = modifiers.NEUTRAL) -> float:
+    """
+    Сила команды из материализованных сумм состава (database.get_team_power) за O(1).
+    Прибавки вектора получает каждый игрок, поэтому с учётом усталости
+    они входят в сумму, умноженные на сумму множителей усталости.
+    :param power: TeamPower состава
+    :param vector: вектор модификаторов команды с тактикой (см. modifiers.py)
+    :return: общая сила команды (float)
+    """
+    aim, reaction, tactics, multiplier = vector
 
-    # Применяем множитель тактики
-    tactic_multiplier = config.TACTICS[tactic]["reward_multiplier"]
-    total_power *= tactic_multiplier
+    # Базовая сила: характеристики, взвешенные по важности, и общий множитель
+    total_power = TeamPower(power.owner_id, power.players,
+                            power.aim + aim * power.fatigue,
+                            power.reaction + reaction * power.fatigue,
+                            power.tactics + tactics * power.fatigue,
+                            power.fatigue).power
+    total_power *= multiplier
 
     return round(total_power, 2)
 
-async def simulate_match_pro(user_team: list, tactic: str, mascot_name: str) -> dict:
+# Пакетная симуляция матчей MR12
+MAX_ROUNDS = 25  # 13:12 — самый длинный матч
+ROUNDS_TO_WIN = 13
+MATCH_EVENT_TYPES = tuple(config.MATCH_EVENTS_PROBABILITIES)  # код события — индекс в этом кортеже
+_MATCH_EVENT_PROBS = np.array([config.MATCH_EVENTS_PROBABILITIES[t] for t in MATCH_EVENT_TYPES])
+BATCH_CHUNK = 65536  # матчей за один проход, чтобы массивы случайных чисел не раздувались
+EVENT_SKIP_MIN_MATCHES = 256  # с какого размера пакета пропуски быстрее попытки в каждом раунде
+
+_rng = np.random.default_rng()
+
+def _sample_events(rounds, rng, codes=None):
     """
-    Симулирует матч по правилам MR12 (до 13 побед).
-    :param user_team: список игроков пользователя
-    :param tactic: выбранная тактика
-    :param mascot_name: имя талисмана
-    :return: словарь с результатом матча, счётом, логом и событиями
+    Разыгрывает редкие события матчей. На малых пакетах (одиночный матч) одна попытка
+    на раунд дешевле: пропуски окупаются только от EVENT_SKIP_MIN_MATCHES матчей.
+    :param rounds: число сыгранных раундов в каждом матче
+    :param codes: какие типы событий разыгрывать (по умолчанию все)
+    :return: (номер матча, номер раунда с 1, код события), упорядочено по матчу, раунду и коду
     """
-    # Получаем бонус от талисмана
-    mascot_bonus = config.MASCOTS[mascot_name]["effect"](0, 0, 0)  # передаём нули, берём только структуру
+    if len(rounds) < EVENT_SKIP_MIN_MATCHES:
+        return _sample_events_per_round(rounds, rng, codes)
+    return _sample_events_skip(rounds, rng, codes)
 
-    # Сила нашей команды
-    user_power = calculate_team_power(user_team, tactic, mascot_bonus)
+def _sample_events_skip(rounds, rng, codes=None):
+    """
+    Разыгрывает редкие события матча пропусками: для каждой пары (матч, тип события)
+    тянем расстояние до следующего события из геометрического распределения,
+    пока не выйдем за последний сыгранный раунд. Распределение то же, что у независимой
+    попытки в каждом раунде, но случайных чисел нужно в разы меньше.
+    :param rounds: число сыгранных раундов в каждом матче
+    :param codes: какие типы событий разыгрывать (по умолчанию все)
+    :return: (номер матча, номер раунда с 1, код события), упорядочено по матчу, раунду и коду
+    """
+    codes = np.arange(len(_MATCH_EVENT_PROBS)) if codes is None else np.asarray(codes)
+    match_idx = np.repeat(np.arange(len(rounds)), len(codes))
+    code = np.tile(codes, len(rounds))
+    limit = np.repeat(rounds, len(codes))
+    position = np.zeros(len(match_idx), dtype=np.int64)
+    parts = [(match_idx[:0], position[:0], code[:0])]
+    while len(match_idx):
+        position = position + rng.geometric(_MATCH_EVENT_PROBS[code])
+        alive = position <= limit
+        match_idx, code, limit, position = match_idx[alive], code[alive], limit[alive], position[alive]
+        parts.append((match_idx, position, code))
+    match_idx, round_no, code = (np.concatenate(part) for part in zip(*parts))
+    order = np.lexsort((code, round_no, match_idx))
+    return match_idx[order], round_no[order], code[order]
+
+def _sample_events_per_round(rounds, rng, codes=None):
+    # Отдельная попытка на каждый раунд и тип события; она же эталон в статистическом тесте пропусков (tests/test_game_logic.py)
+    codes = np.arange(len(_MATCH_EVENT_PROBS)) if codes is None else np.asarray(codes)
+    played = np.arange(MAX_ROUNDS) < np.asarray(rounds)[:, None]
+    hits = rng.random((len(rounds), MAX_ROUNDS, len(codes))) < _MATCH_EVENT_PROBS[codes]
+    match_idx, round_idx, column = np.nonzero(hits & played[:, :, None])
+    return match_idx, round_idx + 1, codes[column]
+
+def _match_end(wins):
+    """
+    Находит конец каждого матча по матрице исходов раундов (матчи × 25).
+    :return: (last, user_score, enemy_score, played): индекс последнего раунда, счёт
+             и маска сыгранных раундов
+    """
+    user_cum = np.cumsum(wins, axis=1, dtype=np.int8)
+    enemy_cum = np.arange(1, MAX_ROUNDS + 1, dtype=np.int8) - user_cum
+    # Последний сыгранный раунд — первый, где кто-то набрал 13
+    last = np.argmax((user_cum == ROUNDS_TO_WIN) | (enemy_cum == ROUNDS_TO_WIN), axis=1)
+    rows = np.arange(len(wins))
+    played = np.arange(MAX_ROUNDS) <= last[:, None]
+    return last, user_cum[rows, last], enemy_cum[rows, last], played
+
+def simulate_matches_batch(user_powers, enemy_powers, rng=None) -> dict:
+    """
+    Симулирует сразу N матчей MR12: все раунды и события разыгрываются массивами NumPy.
+    :param user_powers: силы команд пользователя, массив длины N
+    :param enemy_powers: силы противников, массив длины N
+    :param rng: numpy.random.Generator или seed (для воспроизводимости); по умолчанию общий генератор модуля
+    :return: словарь массивов:
+             user_score, enemy_score (int8, N) — итоговый счёт;
+             user_won (bool, N) — победил ли пользователь;
+             round_wins (bool, N×25) — кто взял каждый раунд, после конца матча False;
+             event_match, event_round, event_code — события: номер матча,
+             номер раунда (с 1) и индекс в MATCH_EVENT_TYPES
+    """
+    rng = np.random.default_rng(rng) if rng is not None else _rng
+    user_powers = np.asarray(user_powers, dtype=np.float64)
+    enemy_powers = np.asarray(enemy_powers, dtype=np.float64)
+    win_probability = user_powers / (user_powers + enemy_powers)
+    total = len(win_probability)
+
+    user_score = np.empty(total, dtype=np.int8)
+    enemy_score = np.empty(total, dtype=np.int8)
+    round_wins = np.empty((total, MAX_ROUNDS), dtype=bool)
+    event_parts = []
+
+    for lo in range(0, total, BATCH_CHUNK):
+        p = win_probability[lo:lo + BATCH_CHUNK]
+        n = len(p)
+        wins = rng.random((n, MAX_ROUNDS), dtype=np.float32) < p[:, None]
+        last, user_score[lo:lo + n], enemy_score[lo:lo + n], played = _match_end(wins)
+        round_wins[lo:lo + n] = wins & played
+
+        match_idx, round_no, code = _sample_events(last + 1, rng)
+        event_parts.append((match_idx + lo, round_no, code))
+
+    if event_parts:
+        event_match, event_round, event_code = (np.concatenate(part) for part in zip(*event_parts))
+    else:
+        event_match = event_round = event_code = np.empty(0, dtype=np.intp)
+
+    return {
+        "user_score": user_score,
+        "enemy_score": enemy_score,
+        "user_won": user_score > enemy_score,
+        "round_wins": round_wins,
+        "event_match": event_match,
+        "event_round": event_round,
+        "event_code": event_code,
+    }
 
+# Игроцкий движок: раунд 5 на 5 разыгрывается дуэлями (LINEUP_SIZE — из storage)
+PLAYER_BATCH_CHUNK = 4096  # матчей за проход: массивы здесь в 25 × 5 раз больше, чем у командного движка
+ACE_EVENT = "эйс_в_дыму"
+CLUTCH_EVENT = "клатч_1v5"
+CLUTCH_MIN_OPPONENTS = 3  # клатчем считаем победу одного против троих и больше
+ENEMY_SLOT = LINEUP_SIZE  # «слот» соперника в событиях
+NO_SLOT = 7  # событие не привязано к игроку
+_ACE_CODE = MATCH_EVENT_TYPES.index(ACE_EVENT)
+_CLUTCH_CODE = MATCH_EVENT_TYPES.index(CLUTCH_EVENT)
+# Эйсы и клатчи получаются из дуэлей, остальные события остаются случайными
+_RANDOM_EVENT_CODES = np.array([
+    code for code, event_type in enumerate(MATCH_EVENT_TYPES) if event_type not in (ACE_EVENT, CLUTCH_EVENT)
+], dtype=np.intp)
+
+def lineup_chances(players: list):
+    """
+    Выбирает стартовую пятёрку (лучшие по шансу в обычном раунде) и считает её шансы.
+    :param players: список игроков (database.Player)
+    :return: (lineup, normal, clutch): игроки пятёрки и массивы шансов длины LINEUP_SIZE
+             в обычном раунде и в клатче; пустые места — нули
+    """
+    lineup = starting_lineup(players)
+    empty = (0.0,) * (LINEUP_SIZE - len(lineup))
+    normal = tuple(calculate_player_round_chance(player) for player in lineup) + empty
+    clutch = tuple(calculate_player_round_chance(player, "clutch") for player in lineup) + empty
+    return lineup, normal, clutch
 
-    # Сила противника (случайная, но с учётом уровня пользователя)
-    avg_player_power = user_power / len(user_team)
-    enemy_power = random.uniform(
-        avg_player_power * 4.5,  # мин. сила противника
-        avg_player_power * 5.5   # макс. сила противника
-    )
+# Калибровка: раунд игроцкого движка выигрывается с той же вероятностью, что у командного
+_CALIBRATION_STEPS = 256
 
-    # Счёт матча
-    user_score = 0
-    enemy_score = 0
+def _round_win_by_duels(duel: float, deaths: int) -> float:
+    # P(выбить всех LINEUP_SIZE соперников раньше, чем погибнут deaths наших), если каждую дуэль берём с вероятностью duel
+    return sum(math.comb(LINEUP_SIZE - 1 + k, k) * duel ** LINEUP_SIZE * (1 - duel) ** k for k in range(deaths))
 
-    # Лог раундов и список событий
-    round_log = []
-    match_events = []
+_CALIBRATION_GRID = [i / _CALIBRATION_STEPS for i in range(_CALIBRATION_STEPS + 1)]
+_CALIBRATION = {deaths: [_round_win_by_duels(duel, deaths) for duel in _CALIBRATION_GRID]
+                for deaths in range(1, LINEUP_SIZE + 1)}
 
-    # Симуляция раундов (максимум 24 раунда, пока кто‑то не наберёт 13)
-    while user_score < 13 and enemy_score < 13:
-        round_number = user_score + enemy_score + 1
+def _duel_win_chance(p_round: float, deaths: int) -> float:
+    """
+    Обратная к _round_win_by_duels: с какой вероятностью брать дуэль, чтобы выигрывать раунд с вероятностью p_round.
+    Начальное приближение — по таблице, затем два шага Ньютона
+    (производная — плотность бета-распределения B(LINEUP_SIZE, deaths)).
+    """
+    table = _CALIBRATION[deaths]
+    i = min(max(bisect.bisect_left(table, p_round), 1), _CALIBRATION_STEPS)
+    low, high = table[i - 1], table[i]
+    if high <= low:
+        return _CALIBRATION_GRID[i]
+    duel = _CALIBRATION_GRID[i - 1] + (p_round - low) / (high - low) / _CALIBRATION_STEPS
+    density = math.comb(LINEUP_SIZE + deaths - 1, deaths - 1) * LINEUP_SIZE
+    for _ in range(2):
+        slope = density * duel ** (LINEUP_SIZE - 1) * (1 - duel) ** (deaths - 1)
+        if slope <= 0:
+            break
+        # Корень лежит в той же клетке таблицы: за её границы шаг не выпускаем
+        duel = min(max(duel - (_round_win_by_duels(duel, deaths) - p_round) / slope, _CALIBRATION_GRID[i - 1]),
+                   _CALIBRATION_GRID[i])
+    return duel
+
+def enemy_chance(normal, user_power: float, enemy_power: float) -> float:
+    """
+    Шанс игрока соперника (соперник — пятеро одинаковых игроков), откалиброванный по командной модели:
+    раунд выигрывается с вероятностью user_power / (user_power + enemy_power), как в simulate_matches_batch.
+    Для пятёрки с одинаковыми шансами (и тем же шансом в клатче) это точно: раунд — серия дуэлей
+    до пяти наших фрагов или гибели всей пятёрки, и вероятность дуэли обращается из вероятности раунда.
+    Для разных шансов берём средний — раунд выходит близким к командному, а точный шанс раунда
+    при этом соперника считает odds.round_win_probability.
+    Модификаторы команды входят в user_power, поэтому они ослабляют соперника относительно нас.
+    """
+    present = [chance for chance in normal if chance > 0]
+    if not present or enemy_power <= 0:
+        return 0.0
+    if user_power <= 0:
+        return math.inf
+    duel = _duel_win_chance(user_power / (user_power + enemy_power), len(present))
+    if duel <= 0:
+        return math.inf
+    return sum(present) / len(present) * (1 - duel) / duel
+
+def _play_duels(normal, clutch, enemy, rng) -> dict:
+    """
+    Разыгрывает раунды 5 на 5 как цепочку дуэлей. С каждой стороны выходит живой игрок
+    (наш — с вероятностью, пропорциональной его шансу, у соперника — любой из живых),
+    наш выигрывает дуэль с вероятностью c / (c + e). Последний живой наш игрок играет
+    с шансом для клатча. Все раунды идут одновременно: состояние — матрицы (игроки × раунды).
+    :param normal: шансы наших игроков (5×R), 0 — пустое место
+    :param clutch: шансы наших игроков в клатче (5×R)
+    :param enemy: шанс игрока соперника (R)
+    :return: словарь массивов: user_won (R); kills (5×R) — фраги наших игроков;
+             ace_slot, clutch_slot (R) — кто сделал эйс/клатч (0–4 наши, ENEMY_SLOT соперник, -1 никто);
+             clutch_versus (R) — против скольких был клатч
+    """
+    count = normal.shape[1]
+    columns = np.arange(count)
+    alive = normal > 0
+    weights = np.where(alive, normal, 0.0)
+    lineup_size = alive.sum(axis=0)
+    user_left = lineup_size.copy()
+    enemy_left = np.full(count, LINEUP_SIZE)
+    kills = np.zeros((LINEUP_SIZE, count), dtype=np.int8)
+    # Живые соперники всегда занимают первые enemy_left строк: выбывший меняется местами с последним
+    enemy_kills = np.zeros((LINEUP_SIZE, count), dtype=np.int8)
+    clutch_versus = np.zeros(count, dtype=np.int8)
+    enemy_clutch_versus = np.zeros(count, dtype=np.int8)
+
+    # Каждая дуэль выбивает одного игрока, поэтому раунд заканчивается не позже 9-й
+    for _ in range(2 * LINEUP_SIZE - 1):
+        active = (user_left > 0) & (enemy_left > 0)
+        if not active.any():
+            break
+        # Запоминаем, против скольких остался последний игрок стороны
+        solo = active & (user_left == 1)
+        starts = solo & (clutch_versus == 0)
+        clutch_versus[starts] = enemy_left[starts]
+        starts = active & (enemy_left == 1) & (enemy_clutch_versus == 0)
+        enemy_clutch_versus[starts] = user_left[starts]
+
+        chances = np.where(solo, clutch * alive, weights)
+        cumulative = np.cumsum(chances, axis=0)
+        draws = rng.random((3, count))
+        slot = np.minimum((cumulative <= draws[0] * cumulative[-1]).sum(axis=0), LINEUP_SIZE - 1)
+        enemy_slot = (draws[1] * enemy_left).astype(np.intp)
+        chance = chances[slot, columns]
+        won = draws[2] * (chance + enemy) < chance
+
+        hit = np.flatnonzero(active & won)
+        kills[slot[hit], hit] += 1
+        last = enemy_left[hit] - 1
+        enemy_kills[enemy_slot[hit], hit] = enemy_kills[last, hit]
+        enemy_kills[last, hit] = 0
+        enemy_left[hit] -= 1
+
+        miss = np.flatnonzero(active & ~won)
+        enemy_kills[enemy_slot[miss], miss] += 1
+        alive[slot[miss], miss] = False
+        weights[slot[miss], miss] = 0.0
+        user_left[miss] -= 1
+
+    user_won = user_left > 0
+
+    ace_slot = np.full(count, -1, dtype=np.int8)
+    aces = kills == LINEUP_SIZE
+    has_ace = aces.any(axis=0)
+    ace_slot[has_ace] = np.argmax(aces, axis=0)[has_ace]
+    # Эйс соперника: один его игрок выбил всю нашу пятёрку
+    ace_slot[(enemy_kills == lineup_size).any(axis=0) & (lineup_size > 0)] = ENEMY_SLOT
+
+    clutch_slot = np.full(count, -1, dtype=np.int8)
+    ours = user_won & (clutch_versus >= CLUTCH_MIN_OPPONENTS)
+    clutch_slot[ours] = np.argmax(alive, axis=0)[ours]
+    theirs = ~user_won & (enemy_clutch_versus >= CLUTCH_MIN_OPPONENTS)
+    clutch_slot[theirs] = ENEMY_SLOT
 
-        # Вероятность победы в раунде
-        total_power = user_power + enemy_power
-        win_probability = user_power / total_power
+    return {
+        "user_won": user_won,
+        "kills": kills,
+        "ace_slot": ace_slot,
+        "clutch_slot": clutch_slot,
+        "clutch_versus": np.where(user_won, clutch_versus, enemy_clutch_versus),
+    }
 
-        # Определяем победителя раунда
-        if random.random() < win_probability:
+def simulate_matches_players(normal, clutch, enemy, rng=None) -> dict:
+    """
+    Симулирует N матчей игроцким движком (см. _play_duels).
+    :param normal: шансы стартовых пятёрок в обычном раунде (N×5)
+    :param clutch: шансы стартовых пятёрок в клатче (N×5)
+    :param enemy: шанс игрока соперника в каждом матче (N)
+    :param rng: numpy.random.Generator или seed
+    :return: те же массивы, что у simulate_matches_batch, плюс kills (N×5) — фраги за матч,
+             event_slot и event_versus — кто сделал эйс или клатч и против скольких
+             (NO_SLOT и 0 у случайных событий)
+    """
+    rng = np.random.default_rng(rng) if rng is not None else _rng
+    normal = np.asarray(normal, dtype=np.float64).reshape(-1, LINEUP_SIZE)
+    clutch = np.asarray(clutch, dtype=np.float64).reshape(-1, LINEUP_SIZE)
+    enemy = np.asarray(enemy, dtype=np.float64).reshape(-1)
+    total = len(enemy)
+
+    user_score = np.empty(total, dtype=np.int8)
+    enemy_score = np.empty(total, dtype=np.int8)
+    round_wins = np.empty((total, MAX_ROUNDS), dtype=bool)
+    kills = np.empty((total, LINEUP_SIZE), dtype=np.int16)
+    event_parts = []
+
+    for lo in range(0, total, PLAYER_BATCH_CHUNK):
+        hi = min(lo + PLAYER_BATCH_CHUNK, total)
+        n = hi - lo
+        duels = _play_duels(
+            np.repeat(normal[lo:hi].T, MAX_ROUNDS, axis=1),
+            np.repeat(clutch[lo:hi].T, MAX_ROUNDS, axis=1),
+            np.repeat(enemy[lo:hi], MAX_ROUNDS),
+            rng
+        )
+        wins = duels["user_won"].reshape(n, MAX_ROUNDS)
+        last, user_score[lo:hi], enemy_score[lo:hi], played = _match_end(wins)
+        round_wins[lo:hi] = wins & played
+        kills[lo:hi] = (duels["kills"].reshape(LINEUP_SIZE, n, MAX_ROUNDS) * played).sum(axis=2).T
+
+        match_idx, round_no, code = _sample_events(last + 1, rng, _RANDOM_EVENT_CODES)
+        event_parts.append((match_idx + lo, round_no, code,
+                            np.full(len(code), NO_SLOT), np.zeros(len(code), dtype=np.int8)))
+        for code, slots, versus in ((_ACE_CODE, duels["ace_slot"], np.zeros_like(duels["clutch_versus"])),
+                                    (_CLUTCH_CODE, duels["clutch_slot"], duels["clutch_versus"])):
+            slots = slots.reshape(n, MAX_ROUNDS)
+            match_idx, round_idx = np.nonzero((slots >= 0) & played)
+            event_parts.append((match_idx + lo, round_idx + 1, np.full(len(match_idx), code),
+                                slots[match_idx, round_idx], versus.reshape(n, MAX_ROUNDS)[match_idx, round_idx]))
+
+    if event_parts:
+        columns = [np.concatenate(part) for part in zip(*event_parts)]
+        order = np.lexsort((columns[2], columns[1], columns[0]))
+        event_match, event_round, event_code, event_slot, event_versus = (column[order] for column in columns)
+    else:
+        event_match = event_round = event_code = event_slot = event_versus = np.empty(0, dtype=np.intp)
+
+    return {
+        "user_score": user_score,
+        "enemy_score": enemy_score,
+        "user_won": user_score > enemy_score,
+        "round_wins": round_wins,
+        "kills": kills,
+        "event_match": event_match,
+        "event_round": event_round,
+        "event_code": event_code,
+        "event_slot": event_slot,
+        "event_versus": event_versus,
+    }
+
+def simulate_league(normal, clutch, team_powers, legs: int = 1, rng=None) -> dict:
+    """
+    Турнир «каждый с каждым»: все матчи разыгрываются одним пакетом игроцкого движка
+    (simulate_matches_players). Хозяева играют своей пятёркой, гости — соперником
+    с шансом enemy_chance по отношению сил, так что раунд берётся с той же вероятностью,
+    что у командного движка. За победу 3 очка, ничьих в MR12 нет.
+    :param normal: шансы стартовых пятёрок в обычном раунде (T×5, см. lineup_chances)
+    :param clutch: шансы стартовых пятёрок в клатче (T×5)
+    :param team_powers: силы команд, массив длины T
+    :param legs: сколько раз каждая пара играет между собой
+    :param rng: numpy.random.Generator или seed
+    :return: словарь массивов длины T: points, wins, round_diff (разница выигранных и проигранных раундов)
+    """
+    normal = np.asarray(normal, dtype=np.float64).reshape(-1, LINEUP_SIZE)
+    clutch = np.asarray(clutch, dtype=np.float64).reshape(-1, LINEUP_SIZE)
+    powers = np.asarray(team_powers, dtype=np.float64)
+    home, away = np.triu_indices(len(powers), k=1)
+    # Шанс соперника зависит только от пары команд: считаем его один раз на пару
+    enemy = np.array([enemy_chance(normal[h], powers[h], powers[a]) for h, a in zip(home, away)])
+    home = np.tile(home, legs)
+    away = np.tile(away, legs)
+    batch = simulate_matches_players(normal[home], clutch[home], np.tile(enemy, legs), rng)
+
+    count = len(powers)
+    home_won = batch["user_won"]
+    diff = batch["user_score"].astype(np.int64) - batch["enemy_score"]
+    wins = np.bincount(home[home_won], minlength=count) + np.bincount(away[~home_won], minlength=count)
+    round_diff = np.bincount(home, weights=diff, minlength=count) - np.bincount(away, weights=diff, minlength=count)
+    return {"points": wins * 3, "wins": wins, "round_diff": round_diff.astype(np.int64)}
+
+# Код случайного события и log(1 − p): номер раунда до следующего события — log(u) / log(1 − p)
+_RANDOM_EVENT_SKIPS = tuple((code, math.log1p(-probability)) for code, probability in
+                            zip(_RANDOM_EVENT_CODES.tolist(), _MATCH_EVENT_PROBS[_RANDOM_EVENT_CODES].tolist()))
+
+def _play_match(normal, clutch, enemy: float, rng):
+    """
+    Один матч игроцким движком без массивов: та же модель, что у _play_duels,
+    но раунды идут по одному и матч заканчивается, как только кто-то набрал 13.
+    На одиночном матче это в разы быстрее пакета: там всё время уходит на накладные расходы NumPy.
+    На дуэль тянется одно случайное число: по нему выбирается наш игрок, а его остаток на отрезке
+    выбранного игрока снова равномерен — по нему решается дуэль, а по остатку от неё — игрок соперника.
+    Фраги по игрокам не копятся: для эйса достаточно знать, у одного ли игрока все фраги раунда.
+    :param normal: шансы стартовой пятёрки в обычном раунде (LINEUP_SIZE), 0 — пустое место
+    :param clutch: шансы стартовой пятёрки в клатче (LINEUP_SIZE)
+    :param enemy: шанс игрока соперника
+    :param rng: random.Random
+    :return: (rounds_mask, rounds, events): бит i маски — раунд i + 1 за пользователем;
+             events — кортежи (раунд с 1, код события, слот, соперники в клатче) по раунду и коду
+    """
+    draw = rng.random
+    lineup = [slot for slot, chance in enumerate(normal) if chance > 0]
+    lineup_total = sum(normal)
+    duel_chances = [chance / (chance + enemy) if chance > 0 else 0.0 for chance in normal]
+    clutch_chances = [chance / (chance + enemy) if chance > 0 else 0.0 for chance in clutch]
+
+    user_score = enemy_score = rounds_mask = 0
+    events = []
+    while user_score < ROUNDS_TO_WIN and enemy_score < ROUNDS_TO_WIN:
+        number = user_score + enemy_score
+        alive = list(lineup)
+        user_left = len(alive)
+        total = lineup_total  # сумма обычных шансов живых наших игроков
+        enemy_left = LINEUP_SIZE
+        killer = -1  # наш игрок со всеми фрагами раунда, NO_SLOT — фраги у разных
+        enemy_killer = 0  # 0 — соперник ещё никого не выбил, 1 — все фраги у одного живого игрока, 2 — нет
+        clutch_versus = enemy_clutch_versus = 0
+        while user_left and enemy_left:
+            if enemy_left == 1 and not enemy_clutch_versus:
+                enemy_clutch_versus = user_left
+            u = draw()
+            if user_left == 1:
+                slot = alive[0]
+                duel = clutch_chances[slot]
+                if not clutch_versus:
+                    clutch_versus = enemy_left
+            else:
+                # Если из-за округления никто не выбран, выходит последний живой с u ≥ 1 — он проигрывает
+                u *= total
+                for slot in alive:
+                    chance = normal[slot]
+                    if u < chance:
+                        break
+                    u -= chance
+                u /= chance
+                duel = duel_chances[slot]
+            if u < duel:
+                if killer != slot:
+                    killer = slot if killer < 0 else NO_SLOT
+                # Выбыл игрок соперника со всеми фрагами — с вероятностью 1 / enemy_left
+                if enemy_killer == 1 and u * enemy_left < duel:
+                    enemy_killer = 2
+                enemy_left -= 1
+            else:
+                # Фраг соперника: тот же игрок, что выбивал до этого, — с вероятностью 1 / enemy_left
+                if not enemy_killer:
+                    enemy_killer = 1
+                elif enemy_killer == 1 and (u - duel) * enemy_left >= 1 - duel:
+                    enemy_killer = 2
+                alive.remove(slot)
+                user_left -= 1
+                total -= normal[slot]
+
+        if user_left:
+            if killer != NO_SLOT:
+                events.append((number + 1, _ACE_CODE, killer, 0))
+            if clutch_versus >= CLUTCH_MIN_OPPONENTS:
+                events.append((number + 1, _CLUTCH_CODE, alive[0], clutch_versus))
             user_score += 1
-            round_winner = "user"
+            rounds_mask |= 1 << number
         else:
+            if enemy_killer == 1:
+                events.append((number + 1, _ACE_CODE, ENEMY_SLOT, 0))
+            if enemy_clutch_versus >= CLUTCH_MIN_OPPONENTS:
+                events.append((number + 1, _CLUTCH_CODE, ENEMY_SLOT, enemy_clutch_versus))
             enemy_score += 1
-            round_winner = "enemy"
 
-        # Проверяем спец‑события
-        for event_type, probability in config.MATCH_EVENTS_PROBABILITIES.items():
-            if random.random() < probability:
-                match_events.append({
-                    "type": event_type,
-            "round": round_number,
-            "winner": round_winner
-        })
+    # Остальные события — пропусками, как в _sample_events_skip: число на событие, а не на каждый раунд
+    rounds = user_score + enemy_score
+    for code, log_miss in _RANDOM_EVENT_SKIPS:
+        number = int(math.log(1.0 - draw()) / log_miss)
+        while number < rounds:
+            events.append((number + 1, code, NO_SLOT, 0))
+            number += 1 + int(math.log(1.0 - draw()) / log_miss)
+    events.sort()
+    return rounds_mask, rounds, events
+
+# Компактные воспроизводимые записи матчей
+# Событие — два байта: (раунд − 1) × число типов + код типа и соперники_в_клатче × 8 + слот игрока
+if MAX_ROUNDS * len(MATCH_EVENT_TYPES) > 256:
+    raise ValueError(f"Событие не помещается в байт: {MAX_ROUNDS} раундов × {len(MATCH_EVENT_TYPES)} типов")
+
+def new_match_seed() -> int:
+    return secrets.randbits(63)  # помещается в INTEGER SQLite
+
+def _match_stream(seed: int) -> random.Random:
+    # Один поток на матч: сначала соперник (_draw_opponent), затем раунды.
+    # random.Random заводится в разы быстрее генератора NumPy, а одиночному матчу хватает его скорости
+    return random.Random(seed)
+
+def _draw_opponent(rng: random.Random):
+    """
+    Соперник матча: имя и множитель силы из config.ENEMY_POWER_RANGE
+    (сила соперника — средняя базовая сила нашего игрока × множитель).
+    """
+    name = config.OPPONENT_NAMES[rng.randrange(len(config.OPPONENT_NAMES))]
+    return name, rng.uniform(*config.ENEMY_POWER_RANGE)
 
-        # Записываем раунд в лог
-        round_log.append(f"Раунд {round_number}: {'Победа' if round_winner == 'user' else 'Поражение'}")
+def _pack_chances(normal, clutch) -> bytes:
+    # Шансы округлены до сотых, поэтому байт на шанс хранит их без потерь
+    return bytes(min(255, round(chance * 100)) for chance in (*normal, *clutch))
 
-    # Определяем результат матча
-    result = "WIN" if user_score > enemy_score else "LOSS"
+def _unpack_chances(chances: bytes):
+    values = [value / 100 for value in chances]
+    return values[:LINEUP_SIZE], values[LINEUP_SIZE:]
 
-    score = f"{user_score}:{enemy_score}"
+def _play_rounds(rng: random.Random, chances: bytes, user_power: float, enemy_power: float):
+    """
+    Разыгрывает раунды матча.
+    :param rng: поток матча из _match_stream(seed), из которого уже вытянут соперник
+    :return: (rounds_mask, rounds, events): бит i маски — раунд i + 1 за пользователем
+    """
+    normal, clutch = _unpack_chances(chances)
+    enemy = enemy_chance(normal, user_power, enemy_power)
+    rounds_mask, rounds, match_events = _play_match(normal, clutch, enemy, rng)
+    events = bytearray()
+    for number, code, slot, versus in match_events:
+        events.append((number - 1) * len(MATCH_EVENT_TYPES) + code)
+        events.append(versus * 8 + slot)
+    return rounds_mask, rounds, bytes(events)
+
+class MatchResult(dict):
+    """
+    Результат матча в виде словаря. Основа — компактная запись MatchRecord;
+    round_log и match_events собираются из неё при первом обращении.
+    """
 
-    return {
-        "result": result,
-        "score": score,
-        "round_log": round_log,
-        "match_events": match_events,
-        "user_power": user_power,
-        "enemy_power": enemy_power
-    }
+    def __missing__(self, key):
+        if key not in ("round_log", "match_events"):
+            raise KeyError(key)
+        record = self["record"]
+        if key == "round_log":
+            value = [
+                f"Раунд {number}: {'Победа' if record.rounds_mask >> (number - 1) & 1 else 'Поражение'}"
+                for number in range(1, record.rounds + 1)
+            ]
+        elif key == "match_events":
+            lineup = [int(player_id) for player_id in record.lineup.split(",") if player_id]
+            value = []
+            for i in range(0, len(record.events), 2):
+                number, code = divmod(record.events[i], len(MATCH_EVENT_TYPES))
+                versus, slot = divmod(record.events[i + 1], 8)
+                if slot == NO_SLOT:
+                    winner = "user" if record.rounds_mask >> number & 1 else "enemy"
+                else:
+                    winner = "enemy" if slot == ENEMY_SLOT else "user"
+                event = {
+                    "type": MATCH_EVENT_TYPES[code],
+                    "round": number + 1,
+                    "winner": winner,
+                    "player_id": lineup[slot] if slot < len(lineup) else None
+                }
+                if versus:
+                    event["versus"] = versus
+                value.append(event)
+        self[key] = value
+        return value
+
+def match_result(record: MatchRecord, opponent_name: str = None) -> MatchResult:
+    """
+    Собирает результат матча из записи (свежей или загруженной из БД).
+    :param record: MatchRecord
+    :param opponent_name: имя соперника, если уже вытянуто из seed; по умолчанию выводится заново
+    :return: MatchResult с ключами result, score, user_power, enemy_power, opponent_name, record
+             и ленивыми round_log, match_events
+    """
+    user_score = bin(record.rounds_mask).count("1")
+    enemy_score = record.rounds - user_score
+    if opponent_name is None:
+        opponent_name, _ = _draw_opponent(_match_stream(record.seed))
+    return MatchResult(
+        result="WIN" if user_score > enemy_score else "LOSS",
+        score=f"{user_score}:{enemy_score}",
+        user_power=record.user_power,
+        enemy_power=record.enemy_power,
+        opponent_name=opponent_name,
+        record=record
+    )
 
-async def post_match_processing(user_id: int, result: str, players: list):
+def replay_match(record: MatchRecord) -> MatchRecord:
+    """
+    Заново разыгрывает матч из seed и входных данных записи.
+    Совпадение с исходной записью (==) подтверждает, что матч воспроизводим.
     """
-    Обрабатывает последствия матча: деньги, фанаты, усталость, мораль.
+    rng = _match_stream(record.seed)
+    _draw_opponent(rng)
+    rounds_mask, rounds, events = _play_rounds(rng, record.chances, record.user_power, record.enemy_power)
+    return MatchRecord(record.match_id, record.user_id, record.seed, record.tactic, record.lineup, record.chances,
+                       record.user_power, record.enemy_power, rounds_mask, rounds, events, record.played_at)
+
+async def simulate_match_pro(user_team: list, tactic: str, team_modifiers: tuple = modifiers.NEUTRAL,
+                             seed: int = None, team_power: TeamPower = None) -> MatchResult:
+    """
+    Симулирует матч по правилам MR12 (до 13 побед): стартовая пятёрка разыгрывает
+    каждый раунд дуэлями (см. _play_match).
+    Всё случайное в матче (соперник, раунды, события) выводится из seed.
+    :param user_team: список игроков пользователя
+    :param tactic: выбранная тактика
+    :param team_modifiers: вектор модификаторов команды без тактики (modifiers.get_team_vector)
+    :param seed: seed матча; по умолчанию новый случайный
+    :param team_power: материализованная сила стартовой пятёрки (database.get_team_power); без неё считается заново
+    :return: MatchResult с результатом матча, счётом, логом, событиями и записью record для сохранения
+    """
+    if seed is None:
+        seed = new_match_seed()
+
+    # Талисман, спонсор и эффекты событий вместе с тактикой — одним вектором
+    vector = modifiers.combine(team_modifiers, modifiers.tactic_vector(tactic))
+
+    # Сила стартовой пятёрки: базовая и с модификаторами
+    lineup, normal, clutch = lineup_chances(user_team)
+    if team_power is None or team_power.players != len(lineup):
+        team_power = TeamPower.of(None, lineup)
+    base_power = team_power_value(team_power)
+    user_power = team_power_value(team_power, vector)
+
+    # Соперник: имя и сила (случайная, но с учётом уровня пользователя).
+    # Уровень берём по базовой силе: соперник, подобранный по силе с модификаторами,
+    # сводил бы их на нет (см. enemy_chance)
+    rng = _match_stream(seed)
+    opponent_name, factor = _draw_opponent(rng)
+    enemy_power = base_power / len(lineup) * factor
+
+    chances = _pack_chances(normal, clutch)
+    rounds_mask, rounds, events = _play_rounds(rng, chances, user_power, enemy_power)
+    owner_id = user_team[0].owner_id if user_team else None
+    record = MatchRecord(None, owner_id, seed, tactic, ",".join(str(player.player_id) for player in lineup), chances,
+                         user_power, enemy_power, rounds_mask, rounds, events, time.time())
+    return match_result(record, opponent_name)
+
+async def post_match_processing(user_id: int, result: str, players: list, match_record: MatchRecord = None) -> dict:
+    """
+    Обрабатывает последствия матча: деньги, фанаты, усталость, мораль и ставку.
+    Все изменения записываются одной транзакцией с одним коммитом.
     :param user_id: ID пользователя
     :param result: результат матча (WIN/LOSS)
     :param players: список игроков команды
+    :param match_record: запись матча; если передана, сохраняется в той же транзакции
+    :return: словарь с итогами расчёта (награды, усталость, выигрыш по ставке, match_id)
     """
-    from database import update_user_balance, get_user
-
-    user = await get_user(user_id)
-    current_balance = user[1]  # balance
-    current_fans = user[2]  # fans
+    from database import (transaction, update_user_balance, add_user_fans, get_active_bet, clear_bet, save_match,
+                          tick_team_effects, add_team_effect)
 
     # Начисление денег и фанатов
     if result == "WIN":
@@ -139,162 +689,65 @@ async def post_match_processing(user_id: int, result: str, players: list):
         fans_reward = 10
         morale_change = -10
 
-    await update_user_balance(user_id, money_reward)
+    stamina_reduction = random.randint(10, 15)
+    bet_win = 0
+    match_id = None
 
-    async with aiosqlite.connect("cs2_manager.db") as db:
-        await db.execute(
-            "UPDATE users SET fans = fans + ? WHERE user_id = ?",
-            (fans_reward, user_id)
-        )
-        await db.commit()
+    async with transaction():
+        if match_record is not None:
+            match_id = await save_match(match_record)
 
-    # Снижение стамины у всех игроков
-    stamina_reduction = random.randint(10, 15)
-    await reduce_player_stamina(user_id, stamina_reduction)
+        await update_user_balance(user_id, money_reward)
+        await add_user_fans(user_id, fans_reward)
+
+        # Снижение стамины и изменение морали у всех игроков одним запросом
+        await adjust_team_stats(user_id, stamina=-stamina_reduction, morale=morale_change)
 
-    # Обновление морали игроков (только в таблице players)
-    for player in players:
-        player_id = player[0]
-        current_morale = player[9]  # morale
-        new_morale = max(0, min(100, current_morale + morale_change))
-        await update_player_stats(player_id, morale=new_morale)
+        # Матч сыгран — эффекты событий действуют на один матч меньше
+        await tick_team_effects(user_id)
+
+        # Расчёт ставки: при победе выплачиваем по зафиксированному коэффициенту, в любом случае закрываем ставку
+        bet = await get_active_bet(user_id)
+        if bet:
+            if result == "WIN":
+                bet_win = round(bet.amount * bet.odds)
+                await update_user_balance(user_id, bet_win)
+            await clear_bet(user_id)
 
     # Случайное событие после матча
     if random.random() < 0.2:  # 20 % шанс
         event = random.choice(config.RANDOM_EVENTS)
         await log_random_event(user_id, event["name"], event["description"])
 
+        # Долгие события (травмы и т. п.) действуют как модификаторы команды ближайшие матчи
+        if "duration" in event:
+            await add_team_effect(user_id, event["name"], event["duration"])
+
 
         # Если событие — «Встреча с фанатами», добавляем стикер
         if event["name"] == "Встреча с фанатами":
             await add_sticker_to_collection(user_id, "Автограф команды", "обычная")
 
-async def generate_highlights(match_events: list) -> list:
-    """
-    Генерирует красивые текстовые описания для хайлайтов матча.
-    :param match_events: список событий матча
-    :return: список текстовых описаний хайлайтов
-    """
-    highlights = []
-
-    event_descriptions = {
-        "нож_раунд": "🔥 В раунде {round} вся команда сражалась только ножами! Это было эпично!",
-        "эйс_в_дыму": "💥 Игрок {winner} сделал ЭЙС в дыму на раунде {round}! Невероятно!",
-        "клатч_1v5": "👑 На раунде {round} игрок {winner} вытащил КЛАТЧ 1v5! Триумф воли!",
-        "проклятый_смок": "🌪 На раунде {round} противник использовал ПРОКЛЯТЫЙ СМОК — видимость упала до нуля!"
-        }
-
-    for event in match_events:
-        winner_name = "нашей команды" if event["winner"] == "user" else "противника"
-        text = event_descriptions.get(
-            event["type"],
-            "Необычное событие на раунде {round}: {type}!"
-        )
-        # Подставляем параметры в текст
-        text = text.format(
-            round=event["round"],
-            winner=winner_name,
-            type=event["type"].replace("_", " ")
-        )
-        highlights.append(text)
-
-    # Если нет событий, генерируем общий хайлайт
-    if not highlights:
-        highlights.append("Матч прошёл без особых хайлайтов, но команда показала достойную игру!")
-
-    return highlights
-
-async def generate_match_report(match_result: dict, user_team: list, opponent_name: str) -> str:
-    """
-    Генерирует полный текстовый отчёт о матче с хайлайтами и статистикой.
-    :param match_result: результат матча из simulate_match_pro
-    :param user_team: список игроков команды пользователя
-    :param opponent_name: имя противника
-    :return: текст отчёта
-    """
-    report_lines = []
-
-    # Заголовок
-    result_emoji = "🎉 ПОБЕДА!" if match_result["result"] == "WIN" else "😢 ПОРАЖЕНИЕ"
-    report_lines.append(f"📊 ОТЧЁТ О МАТЧЕ\n")
-    report_lines.append(f"Команда: {match_result['score']} против {opponent_name}")
-    report_lines.append(f"Результат: {result_emoji}\n")
-
-    # Статистика сил
-    report_lines.append(f"💪 Сила вашей команды: {match_result['user_power']:.1f}")
-    report_lines.append(f"💪 Сила противника: {match_result['enemy_power']:.1f}\n")
-
-    # Хайлайты
-    highlights = await generate_highlights(match_result["match_events"])
-    if highlights:
-        report_lines.append("🌟 ХАЙЛАЙТЫ МАТЧА:")
-        for highlight in highlights:
-            report_lines.append(f"• {highlight}")
-        report_lines.append("")
-
-    # Лог раундов (первые 10 и последние 5 для краткости)
-    round_log = match_result["round_log"]
-    if len(round_log) <= 15:
-        display_rounds = round_log
-    else:
-        display_rounds = round_log[:10] + ["..."] + round_log[-5:]
-
-    report_lines.append("📋 ЛОГ РАУНДОВ:")
-    for round_info in display_rounds:
-        report_lines.append(round_info)
-
-    # Итоговая сводка
-    report_lines.append("\n🏁 ИТОГИ:")
-    if match_result["result"] == "WIN":
-        report_lines.append("✅ Команда показала отличную сыгранность!")
-        report_lines.append("💰 Начислено: 3 000 кредитов")
-        report_lines.append("👥 Прирост фанатов: +50")
-        report_lines.append("💪 Мораль игроков повысилась на +5")
-    else:
-        report_lines.append("❌ Нужно проанализировать ошибки")
-        report_lines.append("💰 Начислено: 1 000 кредитов")
-        report_lines.append("👥 Прирост фанатов: +10")
-        report_lines.append("😔 Мораль игроков снизилась на −10")
-
-    # Информация об усталости
-    stamina_reduction = random.randint(10, 15)
-    report_lines.append(f"🏃 Усталость игроков: −{stamina_reduction}% у всех")
-
-    return "\n".join(report_lines)
+    return {
+        "money_reward": money_reward,
+        "fans_reward": fans_reward,
+        "morale_change": morale_change,
+        "stamina_reduction": stamina_reduction,
+        "bet_win": bet_win,
+        "match_id": match_id
+    }
 
 # Вспомогательная функция для расчёта индивидуальных шансов игрока в раунде
-def calculate_player_round_chance(player: tuple, round_type: str = "normal") -> float:
+def calculate_player_round_chance(player, round_type: str = "normal") -> float:
     """
     Рассчитывает шанс игрока повлиять на раунд с учётом специализации.
-    :param player: данные игрока
+    :param player: данные игрока (database.Player)
     :param round_type: тип раунда (normal, knife, clutch и т. д.)
     :return: шанс влияния (0.0–1.0)
     """
-    aim = player[5]
-    reaction = player[6]
-    tactics = player[7]
-    stamina = player[8]
-    position = player[3]  # позиция
-
-    # Базовая формула
-    base_chance = (aim * 0.4 + reaction * 0.3 + tactics * 0.2) / 100
-
-    # Бонусы по позициям
-    position_bonuses = {
-        "AWPer": 0.15 if round_type != "knife" else -0.2,
-        "Entry Fragger": 0.1 if round_type == "normal" else 0.05,
-        "Lurker": 0.12 if round_type == "clutch" else 0.0,
-        "IGL": 0.1 if round_type in ["normal", "clutch"] else 0.0
-    }
-
-    bonus = position_bonuses.get(position, 0)
-
-    # Корректировка на усталость
-    fatigue_penalty = max(0, (100 - stamina) / 200)  # при 100 % — 0, при 0 % — −0.5
-
-    final_chance = max(0.1, base_chance + bonus - fatigue_penalty)  # минимум 10 %
-
-    return round(final_chance, 2)
+    # Базовая формула, бонус позиции и усталость — в storage.round_chance:
+    # по той же формуле хранилище выбирает пятёрку, силу которой материализует
+    return round(round_chance(player, round_type), 2)
 
 # Функция для симуляции ключевых моментов раунда (для более глубокой проработки)
 async def simulate_key_moment(player_id: int, moment_type: str) -> dict:
@@ -304,10 +757,9 @@ async def simulate_key_moment(player_id: int, moment_type: str) -> dict:
     :param moment_type: тип момента
     :return: словарь с результатом и описанием
     """
-    from database import get_team_players
+    from database import get_player
 
-    players = await get_team_players(player_id)
-    player = next((p for p in players if p[0] == player_id), None)
+    player = await get_player(player_id)
 
     if not player:
         return {"success": False, "description": "Игрок не найден"}
@@ -331,13 +783,13 @@ async def simulate_key_moment(player_id: int, moment_type: str) -> dict:
 
     if success and moment_type in descriptions:
         desc_list = descriptions[moment_type]
-        description = random.choice(desc_list).format(nickname=player[2])  # player[2] — nickname
+        description = random.choice(desc_list).format(nickname=player.nickname)
     else:
-        description = f"{player[2]} пытался сделать {moment_type}, но не получилось."
+        description = f"{player.nickname} пытался сделать {moment_type}, но не получилось."
 
     return {
         "success": success,
         "description": description,
         "chance": chance
     }
-    
\ No newline at end of file
+    
\ No newline at end of file
@@ -1,5 +1,5 @@
 from aiogram.types import ReplyKeyboardMarkup, InlineKeyboardMarkup, InlineKeyboardButton, KeyboardButton
-from config import TRAINING_TYPES, TACTICS
+from config import TRAINING_TYPES, TACTICS, MASCOTS
 
 # Функция для генерации прогресс‑бара
 def get_progress_bar(value: int, max_value: int = 100, width: int = 10) -> str:
@@ -30,7 +30,7 @@ main_menu = ReplyKeyboardMarkup(
 def get_player_list_kb(players: list) -> InlineKeyboardMarkup:
     """
     Генерирует инлайн‑кнопки для списка игроков с отображением стамины и редкости
-    :param players: список игроков из БД (каждая запись — кортеж)
+    :param players: список игроков из БД (database.Player)
     :return: InlineKeyboardMarkup с кнопками игроков
     """
     keyboard = []
@@ -44,11 +44,10 @@ def get_player_list_kb(players: list) -> InlineKeyboardMarkup:
     }
 
     for player in players:
-        # player[0] — id, [2] — nickname, [4] — rarity, [8] — stamina
-        player_id = player[0]
-        nickname = player[2]
-        rarity = player[4]
-        stamina = player[8]
+        player_id = player.player_id
+        nickname = player.nickname
+        rarity = player.rarity
+        stamina = player.stamina
 
         # Получаем эмодзи редкости
         rarity_emoji = rarity_emojis.get(rarity, "❓")
@@ -75,6 +74,26 @@ def get_player_list_kb(players: list) -> InlineKeyboardMarkup:
 
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+# Клавиатура трансферного рынка
+def create_market_keyboard(offers: list) -> InlineKeyboardMarkup:
+    """
+    Генерирует кнопки покупки для предложений рынка
+    :param offers: список предложений рынка (database.MarketOffer)
+    :return: InlineKeyboardMarkup с кнопками покупки
+    """
+    keyboard = []
+
+    for i, offer in enumerate(offers, 1):
+        keyboard.append([
+            InlineKeyboardButton(
+                text=f"🛒 {i}. {offer.nickname} — {offer.price} кредитов",
+                callback_data=f"buy_player_{offer.offer_id}"
+            )
+        ])
+
+    keyboard.append([InlineKeyboardButton(text="⬅️ Назад", callback_data="main_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
 def team_management_kb() -> InlineKeyboardMarkup:
     """Меню управления командой с основными действиями"""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -134,11 +153,14 @@ def match_menu_kb() -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
-def tactic_selection_kb() -> InlineKeyboardMarkup:
-    """Клавиатура для выбора тактики матча"""
+def tactic_selection_kb(tactics=None) -> InlineKeyboardMarkup:
+    """
+    Клавиатура для выбора тактики матча
+    :param tactics: доступные тактики; по умолчанию все (при ставке — только тактика ставки)
+    """
     keyboard = []
 
-    for tactic_name in TACTICS.keys():
+    for tactic_name in tactics or TACTICS.keys():
         risk_level = TACTICS[tactic_name]["risk"]
         multiplier = TACTICS[tactic_name]["reward_multiplier"]
 
@@ -161,6 +183,15 @@ def tactic_selection_kb() -> InlineKeyboardMarkup:
     keyboard.append([InlineKeyboardButton(text="⬅️ Назад к матчам", callback_data="match_menu")])
     return InlineKeyboardMarkup(inline_keyboard=keyboard)
 
+def mascot_selection_kb() -> InlineKeyboardMarkup:
+    """Клавиатура для выбора талисмана команды"""
+    keyboard = [
+        [InlineKeyboardButton(text=f"{mascot_name} — {data['bonus']}", callback_data=f"mascot_{mascot_name}")]
+        for mascot_name, data in MASCOTS.items()
+    ]
+    keyboard.append([InlineKeyboardButton(text="⬅️ Назад к команде", callback_data="team_list")])
+    return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
 def bet_menu_kb() -> InlineKeyboardMarkup:
     """Меню ставок с вариантами ставок"""
     keyboard = [
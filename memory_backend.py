@@ -0,0 +1,395 @@
+import asyncio
+import bisect
+import contextvars
+import time
+from contextlib import asynccontextmanager
+
+import config
+from storage import (StorageBackend, User, Player, Bet, MarketOffer, MatchRecord, TeamPower, TeamModifier,
+                     FSMRecord, check_stat_columns, starting_lineup)
+
+_MISSING = object()
+_APPENDED = object()  # в журнале отмены: к списку table[key] добавлен элемент
+
+class _PowerIndex(dict):
+    """
+    Словарь владелец -> TeamPower с упорядоченным индексом по силе (как idx_team_power в SQLite):
+    список (-сила, владелец) держится отсортированным, поэтому рейтинг — срез, а не обход всех команд.
+    Пустые составы в индекс не попадают.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ranking = []
+
+    def __setitem__(self, owner_id, power):
+        self._unrank(owner_id)
+        super().__setitem__(owner_id, power)
+        if power.players:
+            bisect.insort(self.ranking, (-power.power, owner_id))
+
+    def __delitem__(self, owner_id):
+        self._unrank(owner_id)
+        super().__delitem__(owner_id)
+
+    def pop(self, owner_id, *default):
+        self._unrank(owner_id)
+        return super().pop(owner_id, *default)
+
+    def _unrank(self, owner_id):
+        power = self.get(owner_id)
+        if power is not None and power.players:
+            del self.ranking[bisect.bisect_left(self.ranking, (-power.power, owner_id))]
+
+    def top(self, limit: int) -> list:
+        return [self[owner_id] for _, owner_id in self.ranking[:limit]]
+
+class MemoryBackend(StorageBackend):
+    """
+    Хранилище целиком в памяти процесса: словари записей и индексы по владельцу.
+    Нужно для бенчмарков игровой логики без диска и для локальной отладки.
+
+    Записи не изменяются на месте — каждое изменение кладёт новый объект,
+    поэтому выданные наружу записи остаются снимками.
+    Записи выполняются под одной блокировкой, транзакция откатывается по журналу отмены.
+    Чтения не изолированы: параллельный читатель может увидеть
+    незакоммиченные изменения открытой транзакции.
+    """
+
+    def __init__(self):
+        self.users = {}
+        self.players = {}
+        self.bets = {}
+        self.offers = {}
+        self.matches = {}
+        # Индексы: владелец -> список id; растут через _append, без копирования
+        self.rosters = {}
+        self.active_bets = {}
+        self.user_offers = {}
+        self.user_matches = {}
+        # Материализованная сила стартовых пятёрок: владелец -> TeamPower
+        self.team_powers = _PowerIndex()
+        # Модификаторы команды: владелец -> список TeamModifier
+        self.team_modifiers = {}
+        # Состояния FSM: ключ -> FSMRecord
+        self.fsm_records = {}
+        self._next_id = {"players": 1, "bets": 1, "offers": 1, "matches": 1}
+        self._lock = asyncio.Lock()
+        self._undo = contextvars.ContextVar(f"undo_{id(self)}", default=None)
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        self.__init__()
+
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Берёт блокировку записи и копит журнал отмены.
+        Вложенные вызовы присоединяются к уже открытой транзакции.
+        """
+        if self._undo.get() is not None:
+            yield self
+            return
+        async with self._lock:
+            undo = []
+            token = self._undo.set(undo)
+            try:
+                yield self
+            except BaseException:
+                for table, key, old in reversed(undo):
+                    if old is _APPENDED:
+                        table[key].pop()
+                    elif old is _MISSING:
+                        table.pop(key, None)
+                    else:
+                        table[key] = old
+                raise
+            finally:
+                self._undo.reset(token)
+
+    # Все изменения проходят через _put/_pop/_append, чтобы попасть в журнал отмены
+    def _put(self, table: dict, key, value):
+        self._undo.get().append((table, key, table.get(key, _MISSING)))
+        table[key] = value
+
+    def _append(self, table: dict, key, value):
+        items = table.get(key)
+        if items is None:
+            items = []
+            self._put(table, key, items)
+        self._undo.get().append((table, key, _APPENDED))
+        items.append(value)
+
+    def _pop(self, table: dict, key):
+        if key in table:
+            self._undo.get().append((table, key, table[key]))
+            del table[key]
+
+    def _new_id(self, name: str) -> int:
+        value = self._next_id[name]
+        self._next_id[name] = value + 1
+        return value
+
+    @staticmethod
+    def _replace(record, **changes):
+        values = [changes.get(name, getattr(record, name)) for name in record.__slots__]
+        return type(record)(*values)
+
+    # Пользователи
+    async def create_user(self, user_id: int, team_name: str):
+        async with self.transaction():
+            if user_id not in self.users:
+                self._put(self.users, user_id, User(user_id, 1000, 0, 50, team_name))
+
+    async def get_user(self, user_id: int):
+        return self.users.get(user_id)
+
+    async def _change_user(self, user_id: int, **changes):
+        async with self.transaction():
+            user = self.users.get(user_id)
+            if user is not None:
+                self._put(self.users, user_id, self._replace(user, **changes))
+
+    async def update_user_balance(self, user_id: int, amount: int):
+        async with self.transaction():
+            user = self.users.get(user_id)
+            if user is not None:
+                self._put(self.users, user_id, self._replace(user, balance=user.balance + amount))
+
+    async def add_user_fans(self, user_id: int, amount: int):
+        async with self.transaction():
+            user = self.users.get(user_id)
+            if user is not None:
+                self._put(self.users, user_id, self._replace(user, fans=user.fans + amount))
+
+    async def update_user_field(self, user_id, field, value):
+        if field not in User.__slots__ or field == "user_id":
+            raise ValueError(f"Неизвестное поле пользователя: {field}")
+        await self._change_user(user_id, **{field: value})
+
+    # Игроки
+    def _insert_player(self, owner_id, nickname, position, rarity, aim, reaction, tactics,
+                       stamina=100, morale=100) -> int:
+        player_id = self._new_id("players")
+        player = Player(player_id, owner_id, nickname, position, rarity, aim, reaction, tactics, stamina, morale)
+        self._put(self.players, player_id, player)
+        self._append(self.rosters, owner_id, player_id)
+        return player_id
+
+    def _set_players(self, players):
+        owners = set()
+        for player in players:
+            self._put(self.players, player.player_id, player)
+            owners.add(player.owner_id)
+        for owner_id in owners:
+            self._refresh_power(owner_id)
+
+    def _refresh_power(self, owner_id):
+        # Любое изменение игрока может сменить стартовую пятёрку, поэтому её сила пересчитывается целиком
+        lineup = starting_lineup(self.players[player_id] for player_id in self.rosters.get(owner_id, ()))
+        self._put(self.team_powers, owner_id, TeamPower.of(owner_id, lineup))
+
+    async def create_player(self, owner_id, nickname, position, rarity, aim, reaction, tactics,
+                            stamina=100, morale=100) -> int:
+        async with self.transaction():
+            player_id = self._insert_player(owner_id, nickname, position, rarity, aim, reaction, tactics,
+                                            stamina, morale)
+            self._refresh_power(owner_id)
+            return player_id
+
+    async def create_players(self, owner_id, players: list) -> list:
+        async with self.transaction():
+            player_ids = [
+                self._insert_player(owner_id, p["nickname"], p["position"], p["rarity"],
+                                    p["aim"], p["reaction"], p["tactics"],
+                                    p.get("stamina", 100), p.get("morale", 100))
+                for p in players
+            ]
+            self._refresh_power(owner_id)
+            return player_ids
+
+    async def get_team_players(self, owner_id: int) -> list:
+        return [self.players[player_id] for player_id in self.rosters.get(owner_id, ())]
+
+    async def get_player(self, player_id: int):
+        return self.players.get(player_id)
+
+    async def update_player_stats(self, player_id, **kwargs):
+        async with self.transaction():
+            player = self.players.get(player_id)
+            if player is None:
+                return
+            changes = {}
+            for key, value in kwargs.items():
+                if key not in Player.__slots__:
+                    raise ValueError(f"Неизвестная характеристика игрока: {key}")
+                if isinstance(value, str) and value[:1] in ("+", "-"):
+                    value = changes.get(key, getattr(player, key)) + int(value)
+                changes[key] = value
+            updated = self._replace(player, **changes)
+            if updated.owner_id != player.owner_id:
+                # Переход в другую команду: переносим id между составами (новыми списками — ради журнала
+                # отмены) и пересчитываем силу прежнего владельца; нового пересчитает _set_players
+                self._put(self.rosters, player.owner_id,
+                          [other for other in self.rosters.get(player.owner_id, ()) if other != player_id])
+                self._put(self.rosters, updated.owner_id,
+                          sorted([*self.rosters.get(updated.owner_id, ()), player_id]))
+                self._put(self.players, player_id, updated)
+                self._refresh_power(player.owner_id)
+            self._set_players([updated])
+
+    async def get_team_power(self, owner_id: int):
+        return self.team_powers.get(owner_id) or TeamPower.empty(owner_id)
+
+    async def get_top_teams(self, limit: int = 10) -> list:
+        return self.team_powers.top(limit)
+
+    async def reduce_player_stamina(self, owner_id: int, amount: int):
+        async with self.transaction():
+            self._set_players([
+                self._replace(player, stamina=max(0, player.stamina - amount))
+                for player in (self.players[player_id] for player_id in self.rosters.get(owner_id, ()))
+            ])
+
+    def _clamped(self, player, deltas: dict, low: int, high: int):
+        return self._replace(player, **{
+            column: max(low, min(high, getattr(player, column) + delta))
+            for column, delta in deltas.items()
+        })
+
+    async def adjust_team_stats(self, owner_id: int, low: int = 0, high: int = 100, **deltas):
+        if not deltas:
+            return
+        check_stat_columns(deltas)
+        async with self.transaction():
+            self._set_players([self._clamped(self.players[player_id], deltas, low, high)
+                               for player_id in self.rosters.get(owner_id, ())])
+
+    async def adjust_players_stats(self, player_ids: list, low: int = 0, high: int = 100, **deltas):
+        if not deltas or not player_ids:
+            return
+        check_stat_columns(deltas)
+        async with self.transaction():
+            self._set_players([self._clamped(self.players[player_id], deltas, low, high)
+                               for player_id in player_ids if player_id in self.players])
+
+    # Модификаторы команды
+    async def get_team_modifiers(self, user_id: int) -> tuple:
+        return tuple(self.team_modifiers.get(user_id, ()))
+
+    async def set_team_modifier(self, user_id: int, source: str, name: str = None):
+        async with self.transaction():
+            modifiers = [m for m in self.team_modifiers.get(user_id, ()) if m.source != source]
+            if name is not None:
+                modifiers.append(TeamModifier(user_id, source, name, None))
+            self._put(self.team_modifiers, user_id, modifiers)
+
+    async def add_team_effect(self, user_id: int, name: str, matches: int):
+        async with self.transaction():
+            effect = TeamModifier(user_id, "event", name, matches)
+            self._append(self.team_modifiers, user_id, effect)
+
+    async def tick_team_effects(self, user_id: int):
+        async with self.transaction():
+            modifiers = self.team_modifiers.get(user_id, ())
+            if not any(m.matches_left is not None for m in modifiers):
+                return
+            ticked = (m if m.matches_left is None else self._replace(m, matches_left=m.matches_left - 1)
+                      for m in modifiers)
+            self._put(self.team_modifiers, user_id,
+                      [m for m in ticked if m.matches_left is None or m.matches_left > 0])
+
+    # Рынок
+    def _offer_is_live(self, offer, user_id: int, now: float) -> bool:
+        return offer.user_id == user_id and not offer.purchased and offer.expires_at > now
+
+    async def set_market_players(self, user_id: int, players: list) -> list:
+        expires_at = time.time() + config.MARKET_OFFER_TTL
+        async with self.transaction():
+            for offer_id in self.user_offers.get(user_id, ()):
+                self._pop(self.offers, offer_id)
+            offers = []
+            for p in players:
+                offer = MarketOffer(self._new_id("offers"), user_id, p["nickname"], p["position"], p["rarity"],
+                                    p["aim"], p["reaction"], p["tactics"], p["price"], expires_at, 0)
+                self._put(self.offers, offer.offer_id, offer)
+                offers.append(offer)
+            self._put(self.user_offers, user_id, [offer.offer_id for offer in offers])
+            return offers
+
+    async def get_market_players(self, user_id: int) -> list:
+        now = time.time()
+        offers = (self.offers.get(offer_id) for offer_id in self.user_offers.get(user_id, ()))
+        return [offer for offer in offers if offer is not None and self._offer_is_live(offer, user_id, now)]
+
+    async def get_market_offer(self, user_id: int, offer_id: int):
+        offer = self.offers.get(offer_id)
+        if offer is not None and self._offer_is_live(offer, user_id, time.time()):
+            return offer
+        return None
+
+    async def claim_market_offer(self, user_id: int, offer_id: int):
+        async with self.transaction():
+            offer = self.offers.get(offer_id)
+            if offer is None or not self._offer_is_live(offer, user_id, time.time()):
+                return None
+            offer = self._replace(offer, purchased=1)
+            self._put(self.offers, offer_id, offer)
+            return offer
+
+    # Ставки
+    async def create_bet(self, user_id: int, amount: int, odds: float = 2.0, tactic: str = None):
+        async with self.transaction():
+            bet = Bet(self._new_id("bets"), user_id, amount, 1, odds, tactic)
+            self._put(self.bets, bet.bet_id, bet)
+            self._append(self.active_bets, user_id, bet.bet_id)
+            await self.update_user_balance(user_id, -amount)
+
+    async def get_active_bet(self, user_id: int):
+        bet_ids = self.active_bets.get(user_id)
+        return self.bets[bet_ids[0]] if bet_ids else None
+
+    async def clear_bet(self, user_id: int):
+        async with self.transaction():
+            for bet_id in self.active_bets.get(user_id, ()):
+                self._put(self.bets, bet_id, self._replace(self.bets[bet_id], is_active=0))
+            self._pop(self.active_bets, user_id)
+
+    # Матчи
+    async def save_match(self, record) -> int:
+        async with self.transaction():
+            match_id = self._new_id("matches")
+            self._put(self.matches, match_id, self._replace(record, match_id=match_id))
+            self._append(self.user_matches, record.user_id, match_id)
+            return match_id
+
+    async def get_match(self, match_id: int):
+        return self.matches.get(match_id)
+
+    async def get_user_matches(self, user_id: int, limit: int = 10) -> list:
+        if limit <= 0:
+            return []
+        match_ids = self.user_matches.get(user_id, ())[-limit:]
+        return [self.matches[match_id] for match_id in reversed(match_ids)]
+
+    # Состояния FSM
+    async def get_fsm_record(self, key: str):
+        return self.fsm_records.get(key)
+
+    async def save_fsm_records(self, records: list):
+        async with self.transaction():
+            for record in records:
+                if record.state is None and record.data is None:
+                    self._pop(self.fsm_records, record.key)
+                else:
+                    self._put(self.fsm_records, record.key, FSMRecord(record.key, record.state, record.data,
+                                                                      record.updated_at))
+
+    async def delete_expired_fsm_records(self, before: float) -> int:
+        async with self.transaction():
+            expired = [key for key, record in self.fsm_records.items() if record.updated_at < before]
+            for key in expired:
+                self._pop(self.fsm_records, key)
+            return len(expired)
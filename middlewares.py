@@ -0,0 +1,207 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.fsm.storage.base import BaseEventIsolation
+from aiogram.types import Update
+
+import config
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Ограничивает частоту обновлений: общее ведро токенов на пользователя
+    и отдельные вёдра на дорогие действия (config.THROTTLE_ACTION_RATES).
+    Лишние нажатия кнопок получают короткий callback.answer, лишние сообщения молча отбрасываются.
+
+    Ведро хранится одним числом — моментом, когда оно снова будет полным
+    (GCRA: то же, что ведро токенов, без отдельного счётчика и отметки времени).
+    Полные вёдра ничего не значат, поэтому периодически удаляются.
+    """
+
+    def __init__(self, user_rate: tuple = None, action_rates: dict = None, sweep_interval: float = None):
+        self.user_rate = user_rate or config.THROTTLE_USER_RATE
+        self.action_rates = config.THROTTLE_ACTION_RATES if action_rates is None else action_rates
+        self.sweep_interval = sweep_interval or config.THROTTLE_SWEEP_INTERVAL
+        self._full_at = {}  # (user_id, действие) -> момент, когда ведро снова полное
+        self._next_sweep = time.monotonic() + self.sweep_interval
+        self.rejected = 0
+
+    def _action(self, event: Update):
+        if event.callback_query is not None:
+            key = event.callback_query.data or ""
+        elif event.message is not None and (event.message.text or "").startswith("/"):
+            key = event.message.text[1:].partition(" ")[0].partition("@")[0]
+        else:
+            return None
+        return next((action for action in self.action_rates if key.startswith(action)), None)
+
+    def _after_take(self, key, rate: tuple, now: float):
+        """Момент заполнения ведра после взятия токена или None, если токенов нет."""
+        per_second, burst = rate
+        interval = 1.0 / per_second
+        full_at = max(self._full_at.get(key, now), now)
+        # В ведре есть токен, пока до заполнения осталось не больше burst - 1 интервалов
+        if full_at - now > (burst - 1) * interval:
+            return None
+        return full_at + interval
+
+    def _sweep(self, now: float):
+        self._full_at = {key: full_at for key, full_at in self._full_at.items() if full_at > now}
+        self._next_sweep = now + self.sweep_interval
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or not isinstance(event, Update):
+            return await handler(event, data)
+
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self._sweep(now)
+
+        # Токены берём из общего ведра и из ведра действия только вместе
+        takes = [((user.id, None), self.user_rate)]
+        action = self._action(event)
+        if action is not None:
+            takes.append(((user.id, action), self.action_rates[action]))
+        updates = [(key, self._after_take(key, rate, now)) for key, rate in takes]
+        if all(full_at is not None for _, full_at in updates):
+            self._full_at.update(updates)
+            return await handler(event, data)
+
+        self.rejected += 1
+        if event.callback_query is not None:
+            await event.callback_query.answer("⏳ Слишком часто, подождите немного")
+        return None
+
+    def stats(self) -> dict:
+        return {"buckets": len(self._full_at), "rejected": self.rejected}
+
+class _UserQueue:
+    __slots__ = ("lock", "updates", "waiting", "keys")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.updates = 0  # обновлений пользователя в обработке, включая ждущие
+        self.waiting = 0  # сколько обновлений ждут своей очереди
+        self.keys = set()  # кнопки, нажатия которых ждут в очереди или уже обрабатываются
+
+class _UserIsolation(BaseEventIsolation):
+    """
+    Изоляция событий FSM (events_isolation диспетчера): FSMContextMiddleware берёт эту блокировку
+    до чтения состояния, поэтому следующее обновление пользователя видит состояние,
+    уже изменённое предыдущим.
+    """
+
+    def __init__(self, serial: "UserSerialMiddleware"):
+        self._serial = serial
+
+    @asynccontextmanager
+    async def lock(self, key):
+        serial = self._serial
+        queue = serial._enter(key.user_id)
+        try:
+            queue.waiting += 1
+            serial.max_depth = max(serial.max_depth, queue.waiting + queue.lock.locked())
+            try:
+                await queue.lock.acquire()
+            finally:
+                queue.waiting -= 1
+            try:
+                yield
+            finally:
+                serial.processed += 1
+                queue.lock.release()
+        finally:
+            serial._leave(key.user_id, queue)
+
+    async def close(self):
+        self._serial._queues.clear()
+
+class UserSerialMiddleware(BaseMiddleware):
+    """
+    Обрабатывает обновления одного пользователя строго по очереди,
+    а обновления разных пользователей — параллельно.
+    Так обработчики вида «проверить баланс → списать» не пересекаются,
+    если пользователь быстро жмёт одну кнопку несколько раз.
+
+    Саму очередь держит isolation — её нужно передать диспетчеру (см. create_dispatcher),
+    чтобы состояние FSM читалось уже под блокировкой.
+    Повторное нажатие той же кнопки того же сообщения, пока предыдущее ждёт в очереди
+    или ещё обрабатывается, не ставится в очередь: на него сразу отвечаем пустым answer(),
+    чтобы погасить «часики».
+    """
+
+    def __init__(self):
+        self._queues = {}
+        self.isolation = _UserIsolation(self)
+        self.processed = 0
+        self.coalesced = 0
+        self.max_depth = 0
+
+    @staticmethod
+    def _button_key(event: Update):
+        callback = event.callback_query
+        if callback is None or callback.message is None:
+            return None
+        return callback.message.chat.id, callback.message.message_id, callback.data
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        queue = self._enter(user.id)
+        try:
+            key = self._button_key(event) if isinstance(event, Update) else None
+            if key is not None and key in queue.keys:
+                self.coalesced += 1
+                await event.callback_query.answer()
+                return None
+            if key is None:
+                return await handler(event, data)
+            queue.keys.add(key)
+            try:
+                return await handler(event, data)
+            finally:
+                queue.keys.discard(key)
+        finally:
+            self._leave(user.id, queue)
+
+    def _enter(self, user_id: int) -> _UserQueue:
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = _UserQueue()
+        queue.updates += 1
+        return queue
+
+    def _leave(self, user_id: int, queue: _UserQueue):
+        # Очередь без обновлений в обработке больше не нужна
+        queue.updates -= 1
+        if queue.updates == 0:
+            self._queues.pop(user_id, None)
+
+    def stats(self) -> dict:
+        """Глубина очередей: сколько пользователей сейчас в работе и сколько обновлений ждут."""
+        depths = [queue.waiting for queue in self._queues.values()]
+        return {
+            "active_users": len(depths),
+            "waiting": sum(depths),
+            "deepest": max(depths, default=0),
+            "max_depth": self.max_depth,
+            "processed": self.processed,
+            "coalesced": self.coalesced,
+        }
+
+def create_dispatcher(storage, throttling: ThrottlingMiddleware, user_serial: UserSerialMiddleware) -> Dispatcher:
+    """
+    Диспетчер с middleware в нужном порядке: троттлинг и склейка нажатий — до FSMContextMiddleware,
+    который под блокировкой пользователя (user_serial.isolation) читает состояние и вызывает обработчик.
+    Встроенную регистрацию FSM отключаем только ради порядка: dp.fsm регистрируется последним.
+    """
+    dp = Dispatcher(storage=storage, events_isolation=user_serial.isolation, disable_fsm=True)
+    # Сначала отсекаем слишком частые обновления, чтобы они не занимали очередь пользователя
+    dp.update.outer_middleware(throttling)
+    dp.update.outer_middleware(user_serial)
+    dp.update.outer_middleware(dp.fsm)
+    return dp
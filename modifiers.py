@@ -0,0 +1,79 @@
+from functools import lru_cache
+
+import config
+import database
+
+# Модификаторы силы команды: талисман, спонсор, эффекты случайных событий и тактика.
+# Все источники сводятся к одному вектору (aim, reaction, tactics, multiplier):
+# прибавки к характеристикам каждого игрока и множитель силы команды.
+# Описания источников из config переводятся в векторы один раз при импорте,
+# а вектор команды кэшируется по набору её источников — сменился источник, сменился и ключ.
+NEUTRAL = (0.0, 0.0, 0.0, 1.0)
+
+def _vector(effects: dict) -> tuple:
+    """
+    Вектор из описания эффекта: {"aim": 5, "reaction": 5, "tactics": 0, "morale": 15, "power": 1.2}.
+    Мораль косвенно влияет на тактику, поэтому складывается с ней.
+    """
+    return (
+        float(effects.get("aim", 0)),
+        float(effects.get("reaction", 0)),
+        float(effects.get("tactics", 0) + effects.get("morale", 0)),
+        float(effects.get("power", 1.0)),
+    )
+
+def combine(first: tuple, second: tuple) -> tuple:
+    """Складывает прибавки и перемножает множители двух векторов."""
+    return (first[0] + second[0], first[1] + second[1], first[2] + second[2], first[3] * second[3])
+
+def _event_effects(event: dict) -> dict:
+    # Долгие события описаны приращениями: aim_change, reaction_change, ...
+    return {key[:-len("_change")]: value for key, value in event.items() if key.endswith("_change")}
+
+_SOURCES = {
+    "mascot": {name: _vector(mascot.get("modifiers", {})) for name, mascot in config.MASCOTS.items()},
+    "sponsor": {name: _vector(sponsor.get("modifiers", {})) for name, sponsor in config.SPONSORS.items()},
+    "event": {event["name"]: _vector(_event_effects(event)) for event in config.RANDOM_EVENTS if "duration" in event},
+}
+_TACTICS = {name: _vector({"power": tactic["reward_multiplier"]}) for name, tactic in config.TACTICS.items()}
+
+def source_vector(source: str, name: str) -> tuple:
+    """Вектор одного источника; неизвестный (например, удалённый из config) ничего не меняет."""
+    return _SOURCES.get(source, {}).get(name, NEUTRAL)
+
+def tactic_vector(tactic: str) -> tuple:
+    return _TACTICS[tactic]
+
+def parse_tactic(value: str):
+    """
+    Тактика из данных кнопки (tactic_<название>).
+    :return: ключ config.TACTICS или None, если такой тактики нет
+    """
+    name = value.removeprefix("tactic_")
+    return name if name in _TACTICS else None
+
+@lru_cache(maxsize=4096)
+def _compile(sources: tuple) -> tuple:
+    vector = NEUTRAL
+    for source, name in sources:
+        vector = combine(vector, source_vector(source, name))
+    return vector
+
+def compile_modifiers(team_modifiers) -> tuple:
+    """
+    Сводит источники команды в один вектор.
+    :param team_modifiers: записи database.TeamModifier
+    :return: вектор (aim, reaction, tactics, multiplier)
+    """
+    return _compile(tuple(sorted((modifier.source, modifier.name) for modifier in team_modifiers)))
+
+async def get_team_vector(user_id: int, tactic: str = None) -> tuple:
+    """
+    Вектор модификаторов команды на матч.
+    Источники читаются через кэш хранилища, который сбрасывается при каждом их изменении.
+    :param tactic: тактика матча; None — без неё
+    """
+    vector = compile_modifiers(await database.get_team_modifiers(user_id))
+    if tactic is not None:
+        vector = combine(vector, tactic_vector(tactic))
+    return vector
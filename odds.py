@@ -0,0 +1,243 @@
+from functools import lru_cache
+from math import comb
+
+import config
+import modifiers
+from game_logic import (ROUNDS_TO_WIN, MATCH_EVENT_TYPES, LINEUP_SIZE, ACE_EVENT, CLUTCH_EVENT, CLUTCH_MIN_OPPONENTS,
+                        lineup_chances, enemy_chance, calculate_team_power)
+
+# Точные шансы матча MR12 без симуляции.
+# Каждый раунд — независимое испытание Бернулли с вероятностью p (у командного движка
+# p = user_power / (user_power + enemy_power), у игроцкого — round_win_probability),
+# матч идёт до 13 побед, ничьих нет (максимум 13:12).
+# P(события) в match_odds считается для модели с постоянной вероятностью события в раунде —
+# так события разыгрывает командный движок. В игроцком эйсы и клатчи получаются из дуэлей
+# и связаны с исходом раунда; для него события считает player_match_odds.
+ODDS_QUANT = 10000  # шаг квантования p для мемоизации: 1/10000
+_ENEMY_NODES = 32  # узлов квадратуры по силе соперника
+
+def _quantize(p_round: float) -> int:
+    return min(max(round(p_round * ODDS_QUANT), 0), ODDS_QUANT)
+
+@lru_cache(maxsize=ODDS_QUANT + 1)
+def _match_odds(q: int) -> dict:
+    p = q / ODDS_QUANT
+    r = 1.0 - p
+    scores = {}
+    for k in range(ROUNDS_TO_WIN):
+        # Последний раунд выигран победителем, остальные 12 + k раундов — в любом порядке
+        ways = comb(ROUNDS_TO_WIN - 1 + k, k)
+        scores[(ROUNDS_TO_WIN, k)] = ways * p ** ROUNDS_TO_WIN * r ** k
+        scores[(k, ROUNDS_TO_WIN)] = ways * r ** ROUNDS_TO_WIN * p ** k
+    win = sum(scores[(ROUNDS_TO_WIN, k)] for k in range(ROUNDS_TO_WIN))
+
+    # Событие не случилось ни разу = не случилось в каждом из сыгранных раундов
+    events = {}
+    for event_type in MATCH_EVENT_TYPES:
+        miss = 1.0 - config.MATCH_EVENTS_PROBABILITIES[event_type]
+        events[event_type] = 1.0 - sum(prob * miss ** (u + e) for (u, e), prob in scores.items())
+
+    return {"p_round": p, "win": win, "scores": scores, "events": events}
+
+def match_odds(p_round: float) -> dict:
+    """
+    Точное распределение исхода матча при вероятности выиграть раунд p_round.
+    Результат кэшируется по p, округлённому до 1/ODDS_QUANT, — не изменяйте его.
+    :param p_round: вероятность выиграть один раунд
+    :return: словарь: win — P(победы), scores — {(наш счёт, счёт соперника): вероятность},
+             events — {тип события: P(хотя бы одно за матч)}
+    """
+    return _match_odds(_quantize(p_round))
+
+def odds_table(p_values) -> list:
+    """P(победы) для каждой вероятности раунда из p_values."""
+    return [match_odds(p)["win"] for p in p_values]
+
+def win_probability(user_power: float, enemy_power: float) -> float:
+    return match_odds(user_power / (user_power + enemy_power))["win"]
+
+def round_win_probability(normal, clutch, enemy: float) -> float:
+    """
+    Точная вероятность выиграть раунд в игроцком движке (game_logic._play_duels).
+    Раунды независимы и одинаково распределены, поэтому шансы матча — match_odds от неё.
+    :param normal: шансы стартовой пятёрки в обычном раунде
+    :param clutch: шансы стартовой пятёрки в клатче
+    :param enemy: шанс игрока соперника
+    """
+    return _round_win(tuple(round(float(c), 2) for c in normal), tuple(round(float(c), 2) for c in clutch),
+                      round(enemy, 4))
+
+@lru_cache(maxsize=65536)
+def _round_win(normal: tuple, clutch: tuple, enemy: float) -> float:
+    # Состояние раунда: маска живых наших игроков и число живых соперников
+    @lru_cache(maxsize=None)
+    def win(alive: int, enemies: int) -> float:
+        if enemies == 0:
+            return 1.0
+        if alive == 0:
+            return 0.0
+        slots = [slot for slot in range(len(normal)) if alive >> slot & 1]
+        chances = clutch if len(slots) == 1 else normal
+        total = sum(chances[slot] for slot in slots)
+        result = 0.0
+        for slot in slots:
+            chance = chances[slot]
+            duel = chance / (chance + enemy)
+            result += chance / total * (duel * win(alive, enemies - 1) + (1 - duel) * win(alive & ~(1 << slot), enemies))
+        return result
+
+    return win(sum(1 << slot for slot, chance in enumerate(normal) if chance > 0), LINEUP_SIZE)
+
+def _no_event_in_match(no_event_win: float, no_event_loss: float) -> float:
+    # Раунды независимы: P(ни одного события) по всем счетам, где каждый выигранный раунд
+    # прошёл без события с вероятностью no_event_win, а проигранный — no_event_loss
+    total = 0.0
+    for k in range(ROUNDS_TO_WIN):
+        ways = comb(ROUNDS_TO_WIN - 1 + k, k)
+        total += ways * (no_event_win ** ROUNDS_TO_WIN * no_event_loss ** k
+                         + no_event_loss ** ROUNDS_TO_WIN * no_event_win ** k)
+    return total
+
+def player_match_odds(normal, clutch, enemy: float) -> dict:
+    """
+    Точное распределение исхода матча в игроцком движке (game_logic._play_match).
+    Победа и счёт — match_odds от round_win_probability; эйсы и клатчи считаются из тех же дуэлей,
+    что их порождают, с учётом того, что эйс и клатч бывают только у стороны, взявшей раунд.
+    Остальные события случайны и от раунда не зависят.
+    :param normal: шансы стартовой пятёрки в обычном раунде
+    :param clutch: шансы стартовой пятёрки в клатче
+    :param enemy: шанс игрока соперника
+    :return: словарь как у match_odds
+    """
+    normal = tuple(round(float(c), 2) for c in normal)
+    clutch = tuple(round(float(c), 2) for c in clutch)
+    enemy = round(enemy, 4)
+    # Копии: словари match_odds лежат в кэше
+    result = dict(match_odds(_round_win(normal, clutch, enemy)))
+    events = dict(result["events"])
+    for event_type, (no_event_win, no_event_loss) in _round_events(normal, clutch, enemy).items():
+        events[event_type] = 1.0 - _no_event_in_match(no_event_win, no_event_loss)
+    result["events"] = events
+    return result
+
+@lru_cache(maxsize=65536)
+def _round_events(normal: tuple, clutch: tuple, enemy: float) -> dict:
+    """
+    Для эйса и клатча — (P(раунд выигран и события нет), P(раунд проигран и события нет)).
+    Разбор раунда тот же, что в _round_win, плюс то, что нужно для события.
+    """
+    def duels(alive: int, enemies: int):
+        # (слот, вероятность выбрать его и выиграть дуэль, вероятность выбрать и проиграть)
+        slots = [slot for slot in range(len(normal)) if alive >> slot & 1]
+        chances = clutch if len(slots) == 1 else normal
+        total = sum(chances[slot] for slot in slots)
+        for slot in slots:
+            chance = chances[slot]
+            pick = chance / total
+            duel = chance / (chance + enemy)
+            yield slot, pick * duel, pick * (1 - duel)
+
+    # Эйс: killer — наш игрок со всеми фрагами раунда (-1 — фрагов ещё нет, LINEUP_SIZE — разные игроки);
+    # enemy_killer — у соперника все фраги у одного живого игрока (0 — фрагов нет, 1 — да, 2 — нет)
+    lineup_size = sum(1 for chance in normal if chance > 0)
+
+    @lru_cache(maxsize=None)
+    def ace(alive: int, enemies: int, killer: int, enemy_killer: int):
+        if enemies == 0:
+            return (0.0 if 0 <= killer < LINEUP_SIZE else 1.0), 0.0
+        if alive == 0:
+            return 0.0, (0.0 if enemy_killer == 1 and lineup_size else 1.0)
+        win = loss = 0.0
+        for slot, p_kill, p_death in duels(alive, enemies):
+            next_killer = slot if killer in (-1, slot) else LINEUP_SIZE
+            if enemy_killer == 1:
+                # Выбывает обладатель всех фрагов соперника с вероятностью 1 / enemies
+                outcomes = ((1 - 1 / enemies, ace(alive, enemies - 1, next_killer, 1)),
+                            (1 / enemies, ace(alive, enemies - 1, next_killer, 2)))
+            else:
+                outcomes = ((1.0, ace(alive, enemies - 1, next_killer, enemy_killer)),)
+            for weight, (w, l) in outcomes:
+                win += p_kill * weight * w
+                loss += p_kill * weight * l
+            survivors = alive & ~(1 << slot)
+            if enemy_killer == 0:
+                outcomes = ((1.0, ace(survivors, enemies, killer, 1)),)
+            elif enemy_killer == 1:
+                outcomes = ((1 / enemies, ace(survivors, enemies, killer, 1)),
+                            (1 - 1 / enemies, ace(survivors, enemies, killer, 2)))
+            else:
+                outcomes = ((1.0, ace(survivors, enemies, killer, 2)),)
+            for weight, (w, l) in outcomes:
+                win += p_death * weight * w
+                loss += p_death * weight * l
+        return win, loss
+
+    # Клатч: ours/theirs — против скольких остался последний игрок стороны (0 — ещё не остался)
+    @lru_cache(maxsize=None)
+    def clutch_round(alive: int, enemies: int, ours: int, theirs: int):
+        if enemies == 0:
+            return (0.0 if ours >= CLUTCH_MIN_OPPONENTS else 1.0), 0.0
+        if alive == 0:
+            return 0.0, (0.0 if theirs >= CLUTCH_MIN_OPPONENTS else 1.0)
+        count = bin(alive).count("1")
+        if count == 1 and not ours:
+            ours = enemies
+        if enemies == 1 and not theirs:
+            theirs = count
+        win = loss = 0.0
+        for slot, p_kill, p_death in duels(alive, enemies):
+            for p, (w, l) in ((p_kill, clutch_round(alive, enemies - 1, ours, theirs)),
+                              (p_death, clutch_round(alive & ~(1 << slot), enemies, ours, theirs))):
+                win += p * w
+                loss += p * l
+        return win, loss
+
+    start = sum(1 << slot for slot, chance in enumerate(normal) if chance > 0)
+    return {ACE_EVENT: ace(start, LINEUP_SIZE, -1, 0), CLUTCH_EVENT: clutch_round(start, LINEUP_SIZE, 0, 0)}
+
+def pre_match_win_probability(players: list, vector: tuple = modifiers.NEUTRAL) -> float:
+    """
+    P(победы) до того, как выбран соперник.
+    Сила соперника — средняя базовая сила нашего игрока × U(ENEMY_POWER_RANGE), поэтому при множителе f
+    силы относятся как strength × n к f, где n — размер пятёрки, а strength — во сколько раз модификаторы
+    усилили пятёрку; шанс игрока соперника — game_logic.enemy_chance от этого отношения.
+    Усредняем точные шансы по f квадратурой средних точек.
+    :param players: игроки команды (стартовая пятёрка выбирается как в матче)
+    :param vector: вектор модификаторов команды с тактикой (см. modifiers.py)
+    """
+    lineup, normal, clutch = lineup_chances(players)
+    base_power = calculate_team_power(lineup)
+    strength = calculate_team_power(lineup, vector) / base_power if base_power > 0 else 1.0
+    return _pre_match_win_probability(tuple(normal), tuple(clutch), round(strength, 4))
+
+@lru_cache(maxsize=4096)
+def _pre_match_win_probability(normal: tuple, clutch: tuple, strength: float = 1.0) -> float:
+    present = [chance for chance in normal if chance > 0]
+    if not present or strength <= 0:
+        return 0.0
+    low, high = config.ENEMY_POWER_RANGE
+    total = 0.0
+    for i in range(_ENEMY_NODES):
+        f = low + (high - low) * (i + 0.5) / _ENEMY_NODES
+        enemy = enemy_chance(normal, strength * len(present), f)
+        total += match_odds(round_win_probability(normal, clutch, enemy))["win"]
+    return total / _ENEMY_NODES
+
+def bet_win_probability(players: list, vector: tuple, tactic: str) -> float:
+    """
+    P(победы), по которой принимается ставка: ставка фиксирует тактику, и матч по ней играется ею же.
+    :param vector: вектор модификаторов команды без тактики (modifiers.get_team_vector)
+    :param tactic: ключ config.TACTICS
+    """
+    return pre_match_win_probability(players, modifiers.combine(vector, modifiers.tactic_vector(tactic)))
+
+def bet_odds(players: list, vector: tuple, tactic: str):
+    """
+    Коэффициент ставки на победу тактикой tactic с учётом маржи букмекера.
+    :return: коэффициент или None, если он ниже config.BET_MIN_ODDS — такую ставку не принимаем
+    """
+    win = bet_win_probability(players, vector, tactic)
+    if win <= 0:
+        return config.BET_MAX_ODDS
+    bet = round(min((1 - config.BOOKMAKER_MARGIN) / win, config.BET_MAX_ODDS), 2)
+    return bet if bet >= config.BET_MIN_ODDS else None
@@ -0,0 +1,156 @@
+from itertools import chain
+
+from game_logic import ACE_EVENT, CLUTCH_EVENT
+
+# Отчёт о матче для Telegram.
+# Шаблоны разобраны один раз при импорте (готовые методы format), отчёт собирается лениво:
+# форматируются только показываемые разделы, а страницы набираются по строкам,
+# не склеивая весь текст целиком.
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+SECTIONS = ("header", "power", "highlights", "rounds", "summary")
+
+_HEADER = "Команда: {score} против {opponent}".format
+_RESULTS = {"WIN": "Результат: 🎉 ПОБЕДА!\n", "LOSS": "Результат: 😢 ПОРАЖЕНИЕ\n"}
+_USER_POWER = "💪 Сила вашей команды: {:.1f}".format
+_ENEMY_POWER = "💪 Сила противника: {:.1f}\n".format
+
+_HIGHLIGHTS = {
+    "нож_раунд": "• 🔥 В раунде {round} вся команда сражалась только ножами! Это было эпично!".format,
+    ACE_EVENT: "• 💥 Игрок {winner} сделал ЭЙС в дыму на раунде {round}! Невероятно!".format,
+    CLUTCH_EVENT: "• 👑 На раунде {round} игрок {winner} вытащил КЛАТЧ 1v{versus}! Триумф воли!".format,
+    "проклятый_смок": "• 🌪 На раунде {round} противник использовал ПРОКЛЯТЫЙ СМОК — видимость упала до нуля!".format,
+}
+_HIGHLIGHT_DEFAULT = "• Необычное событие на раунде {round}: {type}!".format
+_NO_HIGHLIGHTS = "• Матч прошёл без особых хайлайтов, но команда показала достойную игру!"
+_WINNER_TEAMS = {"user": "нашей команды", "enemy": "противника"}
+
+# Лог раундов: первые 10 и последние 5 для краткости
+_ROUNDS_HEAD = 10
+_ROUNDS_TAIL = 5
+_ROUND = ("Раунд {}: Поражение".format, "Раунд {}: Победа".format)
+
+_SUMMARY = {
+    "WIN": ("✅ Команда показала отличную сыгранность!", "💪 Мораль игроков повысилась на +{}".format),
+    "LOSS": ("❌ Нужно проанализировать ошибки", "😔 Мораль игроков снизилась на −{}".format),
+}
+_MONEY = "💰 Начислено: {} кредитов".format
+_FANS = "👥 Прирост фанатов: +{}".format
+_STAMINA = "🏃 Усталость игроков: −{}% у всех".format
+
+# Служебные символы разметки Markdown (parse_mode="Markdown"): «Игрок_1» без экранирования
+# открывает курсив, который не закрывается, и Telegram отклоняет всё сообщение
+_MARKDOWN_ESCAPES = str.maketrans({char: "\\" + char for char in "_*`["})
+
+def escape_markdown(text: str) -> str:
+    """Экранирует текст пользователя для parse_mode="Markdown"."""
+    return str(text).translate(_MARKDOWN_ESCAPES)
+
+def _credits(amount: int) -> str:
+    return f"{amount:,}".replace(",", " ")
+
+def render_highlights(match_events: list, players: list = None):
+    """
+    Строки хайлайтов матча.
+    :param match_events: список событий матча
+    :param players: игроки команды, чтобы назвать авторов эйсов и клатчей по никнейму
+    """
+    nicknames = {player.player_id: escape_markdown(player.nickname) for player in players or []}
+    if not match_events:
+        yield _NO_HIGHLIGHTS
+        return
+    for event in match_events:
+        template = _HIGHLIGHTS.get(event["type"])
+        if template is None:
+            yield _HIGHLIGHT_DEFAULT(round=event["round"], type=event["type"].replace("_", " "))
+            continue
+        winner = nicknames.get(event.get("player_id")) or _WINNER_TEAMS[event["winner"]]
+        yield template(round=event["round"], winner=winner, versus=event.get("versus", 5))
+
+def _header(match_result, user_team, opponent_name):
+    yield "📊 ОТЧЁТ О МАТЧЕ\n"
+    yield _HEADER(score=match_result["score"], opponent=escape_markdown(opponent_name))
+    yield _RESULTS[match_result["result"]]
+
+def _power(match_result, user_team, opponent_name):
+    yield _USER_POWER(match_result["user_power"])
+    yield _ENEMY_POWER(match_result["enemy_power"])
+
+def _highlights(match_result, user_team, opponent_name):
+    yield "🌟 ХАЙЛАЙТЫ МАТЧА:"
+    yield from render_highlights(match_result["match_events"], user_team)
+    yield ""
+
+def _rounds(match_result, user_team, opponent_name):
+    # Строки берём прямо из маски раундов: полный round_log не нужен
+    record = match_result["record"]
+    mask = record.rounds_mask
+    if record.rounds <= _ROUNDS_HEAD + _ROUNDS_TAIL:
+        numbers = range(1, record.rounds + 1)
+    else:
+        numbers = chain(range(1, _ROUNDS_HEAD + 1), (None,), range(record.rounds - _ROUNDS_TAIL + 1, record.rounds + 1))
+    yield "📋 ЛОГ РАУНДОВ:"
+    for number in numbers:
+        yield "..." if number is None else _ROUND[mask >> (number - 1) & 1](number)
+
+def _summary(match_result, user_team, opponent_name):
+    # Итоги показываем только по реальным числам расчёта (post_match_processing)
+    settlement = match_result.get("settlement")
+    if settlement is None:
+        return
+    verdict, morale = _SUMMARY[match_result["result"]]
+    yield "\n🏁 ИТОГИ:"
+    yield verdict
+    yield _MONEY(_credits(settlement["money_reward"]))
+    yield _FANS(settlement["fans_reward"])
+    yield morale(abs(settlement["morale_change"]))
+    yield _STAMINA(settlement["stamina_reduction"])
+
+_RENDERERS = {
+    "header": _header,
+    "power": _power,
+    "highlights": _highlights,
+    "rounds": _rounds,
+    "summary": _summary,
+}
+
+def report_lines(match_result: dict, user_team: list, opponent_name: str, sections=SECTIONS):
+    """
+    Строки отчёта о матче. Разделы, которых нет в sections, не форматируются вовсе.
+    :param match_result: результат матча из simulate_match_pro; итоги — из match_result["settlement"]
+    :param user_team: список игроков команды пользователя
+    :param opponent_name: имя противника
+    :param sections: показываемые разделы (см. SECTIONS)
+    """
+    for section in sections:
+        yield from _RENDERERS[section](match_result, user_team, opponent_name)
+
+def paginate(lines, limit: int = TELEGRAM_MESSAGE_LIMIT):
+    """
+    Набирает страницы не длиннее limit из строк, разрывая только между строками.
+    Строку длиннее limit режет на куски.
+    """
+    page = []
+    size = -1  # перевод строки нужен только между строками
+    for line in lines:
+        while len(line) > limit:
+            if page:
+                yield "\n".join(page)
+                page, size = [], -1
+            yield line[:limit]
+            line = line[limit:]
+        if size + 1 + len(line) > limit:
+            yield "\n".join(page)
+            page, size = [], -1
+        page.append(line)
+        size += 1 + len(line)
+    if page:
+        yield "\n".join(page)
+
+def render_match_report(match_result: dict, user_team: list, opponent_name: str, sections=SECTIONS,
+                        limit: int = TELEGRAM_MESSAGE_LIMIT):
+    """
+    Отчёт о матче, разбитый на сообщения не длиннее limit.
+    :return: генератор страниц; каждая — готовый текст одного сообщения
+    """
+    return paginate(report_lines(match_result, user_team, opponent_name, sections), limit)
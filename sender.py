@@ -0,0 +1,267 @@
+import asyncio
+import contextvars
+import heapq
+import time
+from collections import deque
+from itertools import count
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+import config
+from reports import TELEGRAM_MESSAGE_LIMIT
+
+# Исходящие сообщения идут через очередь: обработчик ставит сообщение и сразу возвращается,
+# а планировщик отправляет его, соблюдая лимиты Telegram — общий на бота и отдельный на каждый чат.
+# Сообщения одного чата уходят строго по порядку; между чатами первым идёт самый приоритетный.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+class _Bucket:
+    """Ведро токенов в виде GCRA (как в middlewares.ThrottlingMiddleware): момент, когда оно снова полное."""
+    __slots__ = ("interval", "tolerance", "full_at")
+
+    def __init__(self, rate: tuple):
+        per_second, burst = rate
+        self.interval = 1.0 / per_second
+        self.tolerance = (burst - 1) * self.interval
+        self.full_at = 0.0
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до следующего токена (0 — можно сейчас)."""
+        return max(0.0, self.full_at - now - self.tolerance)
+
+    def take(self, now: float):
+        self.full_at = max(self.full_at, now) + self.interval
+
+    def pause(self, until: float):
+        # Ни одного токена до until, как бы ни был полон запас
+        self.full_at = max(self.full_at, until + self.tolerance)
+
+class _Message:
+    __slots__ = ("text", "priority", "seq", "kwargs", "attempts")
+
+    def __init__(self, text: str, priority: int, seq: int, kwargs: dict):
+        self.text = text
+        self.priority = priority
+        self.seq = seq
+        self.kwargs = kwargs
+        self.attempts = 0
+
+class _Chat:
+    __slots__ = ("messages", "bucket", "busy", "entry")
+
+    def __init__(self, rate: tuple):
+        self.messages = deque()
+        self.bucket = _Bucket(rate)
+        self.busy = False  # сообщение этого чата сейчас отправляется
+        self.entry = None  # действующая запись чата в куче планировщика; прочие его записи устарели
+
+def _without_markup(kwargs: dict) -> dict:
+    return {key: value for key, value in kwargs.items() if key != "reply_markup"}
+
+class SendScheduler:
+    """
+    Планировщик исходящих сообщений.
+
+    Подряд идущие сообщения в один чат, которые ещё ждут отправки, склеиваются в одно,
+    если у них одинаковая разметка, у первого нет клавиатуры и вместе они не длиннее лимита Telegram.
+    Ответ 429 возвращает сообщение в начало очереди чата, и чат молчит столько, сколько сказал Telegram.
+    Сетевые ошибки и ошибки сервера повторяются до max_attempts раз, остальные (бот заблокирован,
+    неверная разметка) — нет: сообщение отбрасывается.
+    """
+
+    def __init__(self, bot, global_rate: tuple = None, chat_rate: tuple = None, group_rate: tuple = None,
+                 max_attempts: int = None, drain_timeout: float = None, merge_limit: int = TELEGRAM_MESSAGE_LIMIT):
+        self.bot = bot
+        self.chat_rate = chat_rate or config.OUTBOX_CHAT_RATE
+        self.group_rate = group_rate or config.OUTBOX_GROUP_RATE
+        self.max_attempts = max_attempts or config.OUTBOX_MAX_ATTEMPTS
+        self.drain_timeout = config.OUTBOX_DRAIN_TIMEOUT if drain_timeout is None else drain_timeout
+        self.merge_limit = merge_limit
+        self._global = _Bucket(global_rate or config.OUTBOX_GLOBAL_RATE)
+        self._chats = {}  # chat_id -> _Chat, пока в чате есть очередь или его ведро не восстановилось
+        # Кучи вместо обхода всех чатов: готовые к отправке — по (приоритет, seq, chat_id),
+        # ждущие лимита чата (или удаления, если очередь пуста) — по (момент, chat_id)
+        self._ready = []
+        self._timers = []
+        self._seq = count()
+        self._queued = 0  # сообщений в очереди и в отправке
+        self._wake = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._worker = None
+        self._sending = set()
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.failed = 0
+
+    # Постановка в очередь
+    def send(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL, **kwargs):
+        """
+        Ставит сообщение в очередь и сразу возвращается.
+        :param kwargs: параметры send_message (parse_mode, reply_markup, ...)
+        """
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(self.group_rate if chat_id < 0 else self.chat_rate)
+        tail = chat.messages[-1] if chat.messages else None
+        if tail is not None and self._mergeable(tail, text, kwargs):
+            tail.text = f"{tail.text}\n\n{text}"
+            tail.kwargs = kwargs
+            tail.priority = min(tail.priority, priority)
+            self.merged += 1
+        else:
+            chat.messages.append(_Message(text, priority, next(self._seq), kwargs))
+            self._queued += 1
+            self._idle.clear()
+        self._schedule(chat_id, chat, time.monotonic())
+        if self._worker is None:
+            # Свежий контекст: планировщик не должен унаследовать открытую транзакцию обработчика
+            self._worker = asyncio.create_task(self._run(), context=contextvars.Context())
+        self._wake.set()
+
+    def answer(self, message, text: str, priority: int = PRIORITY_NORMAL, **kwargs):
+        """То же, что message.answer, но через очередь."""
+        self.send(message.chat.id, text, priority, **kwargs)
+
+    def _mergeable(self, tail: _Message, text: str, kwargs: dict) -> bool:
+        # Клавиатура бывает только у последнего сообщения, прочие параметры должны совпасть
+        if tail.kwargs.get("reply_markup") is not None:
+            return False
+        if _without_markup(kwargs) != _without_markup(tail.kwargs):
+            return False
+        return len(tail.text) + 2 + len(text) <= self.merge_limit
+
+    # Отправка
+    def _schedule(self, chat_id: int, chat: _Chat, now: float):
+        """Кладёт чат в нужную кучу после любого изменения его очереди, ведра или занятости."""
+        if chat.busy:
+            chat.entry = None  # вернётся в кучу, когда _deliver закончит
+            return
+        # Момент следующего токена чата (см. _Bucket.wait_time); с ним же сравнивает _dispatch
+        ready_at = chat.bucket.full_at - chat.bucket.tolerance
+        if not chat.messages:
+            entry, heap = (chat.bucket.full_at, chat_id), self._timers
+        elif ready_at > now:
+            entry, heap = (ready_at, chat_id), self._timers
+        else:
+            # Приоритет чата — лучший среди его сообщений: они всё равно уходят по порядку
+            entry = (min(message.priority for message in chat.messages), chat.messages[0].seq, chat_id)
+            heap = self._ready
+        if entry != chat.entry:
+            chat.entry = entry
+            heapq.heappush(heap, entry)
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            delay = self._dispatch(time.monotonic())
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _dispatch(self, now: float):
+        """
+        Запускает отправку всего, что лимиты разрешают прямо сейчас.
+        :return: через сколько секунд проверить снова; None — ждать новых сообщений
+        """
+        # Наступившие моменты: чат либо готов к отправке, либо пуст и его ведро полное — тогда он удаляется
+        while self._timers and self._timers[0][0] <= now:
+            entry = heapq.heappop(self._timers)
+            chat = self._live(entry)
+            if chat is None:
+                continue
+            chat.entry = None
+            if chat.messages:
+                self._schedule(entry[-1], chat, now)
+            else:
+                del self._chats[entry[-1]]
+
+        while self._ready:
+            chat = self._live(self._ready[0])
+            if chat is None:
+                heapq.heappop(self._ready)
+                continue
+            if self._global.wait_time(now) > 0:
+                break
+            chat_id = heapq.heappop(self._ready)[-1]
+            self._global.take(now)
+            chat.bucket.take(now)
+            chat.busy = True
+            chat.entry = None
+            task = asyncio.create_task(self._deliver(chat_id, chat, chat.messages.popleft()),
+                                       context=contextvars.Context())
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+        delays = []
+        if self._ready:
+            delays.append(self._global.wait_time(now))
+        if self._timers:
+            delays.append(self._timers[0][0] - now)
+        return min(delays) if delays else None
+
+    def _live(self, entry: tuple):
+        """Чат записи кучи, если запись ещё действует, иначе None."""
+        chat = self._chats.get(entry[-1])
+        return chat if chat is not None and chat.entry is entry else None
+
+    async def _deliver(self, chat_id: int, chat: _Chat, message: _Message):
+        done = True
+        try:
+            await self.bot.send_message(chat_id, message.text, **message.kwargs)
+            self.sent += 1
+        except TelegramRetryAfter as e:
+            # Telegram сам сказал, сколько ждать: повторяем без ограничения попыток
+            self.retried += 1
+            chat.messages.appendleft(message)
+            chat.bucket.pause(time.monotonic() + e.retry_after)
+            done = False
+        except (TelegramNetworkError, TelegramServerError) as e:
+            message.attempts += 1
+            if message.attempts < self.max_attempts:
+                self.retried += 1
+                chat.messages.appendleft(message)
+                chat.bucket.pause(time.monotonic() + message.attempts)
+                done = False
+            else:
+                self.failed += 1
+                print(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+        except Exception as e:
+            self.failed += 1
+            print(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+        finally:
+            chat.busy = False
+            self._schedule(chat_id, chat, time.monotonic())
+            if done:
+                self._queued -= 1
+                if self._queued == 0:
+                    self._idle.set()
+            self._wake.set()
+
+    async def close(self):
+        """Дожидается отправки очереди (не дольше drain_timeout) и останавливает планировщик."""
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"Не отправлено сообщений: {self._queued}")
+        self._worker.cancel()
+        for task in list(self._sending):
+            task.cancel()
+        await asyncio.gather(self._worker, *self._sending, return_exceptions=True)
+        self._worker = None
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queued,
+            "chats": len(self._chats),
+            "sent": self.sent,
+            "merged": self.merged,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
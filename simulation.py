@@ -0,0 +1,97 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import config
+import game_logic
+import odds
+
+class SimulationBusy(Exception):
+    """Очередь симуляций заполнена, а ждать места вызывающий не захотел."""
+
+class SimulationExecutor:
+    """
+    Выполняет тяжёлые расчёты (пакеты матчей, турниры, таблицы коэффициентов)
+    в пуле процессов, чтобы они не останавливали цикл событий бота.
+    Одновременно в работе и в очереди не больше max_pending задач:
+    остальные вызовы ждут свободного места (или сразу получают SimulationBusy).
+    """
+
+    def __init__(self, workers: int, max_pending: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(max_pending)
+        self._pool = None
+        self.pending = 0
+        self.completed = 0
+
+    def start(self):
+        if self.workers > 0 and self._pool is None:
+            # spawn: дочерние процессы не наследуют потоки aiosqlite и открытые соединения
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def stop(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.get_running_loop().run_in_executor(None, pool.shutdown)
+
+    async def run(self, fn, *args, wait: bool = True, **kwargs):
+        """
+        Выполняет fn(*args, **kwargs) в пуле процессов.
+        fn и аргументы должны сериализоваться pickle (функции уровня модуля).
+        :param wait: ждать места в очереди; при False и полной очереди — SimulationBusy
+        :return: результат fn
+        """
+        if not wait and self._slots.locked():
+            raise SimulationBusy(f"В очереди уже {self.pending} задач")
+        async with self._slots:
+            self.pending += 1
+            try:
+                if self._pool is None:
+                    # Пул не запущен (или выключен в настройках) — считаем на месте
+                    return fn(*args, **kwargs)
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._pool, partial(fn, *args, **kwargs))
+            finally:
+                self.pending -= 1
+                self.completed += 1
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "pending": self.pending, "completed": self.completed}
+
+_executor = None
+
+def get_executor() -> SimulationExecutor:
+    global _executor
+    if _executor is None:
+        _executor = SimulationExecutor(config.SIM_WORKERS, config.SIM_MAX_PENDING)
+    return _executor
+
+def start():
+    get_executor().start()
+
+async def stop():
+    global _executor
+    if _executor is not None:
+        await _executor.stop()
+        _executor = None
+
+# Задачи
+async def simulate_matches(normal, clutch, enemy, seed: int = None, wait: bool = True) -> dict:
+    """
+    Пакет матчей игроцким движком (см. game_logic.simulate_matches_players):
+    шансы стартовых пятёрок и шанс соперника (game_logic.enemy_chance) в каждом матче.
+    Небольшие пакеты считаются прямо в цикле событий: пересылка в процесс дороже самого расчёта.
+    """
+    if len(enemy) <= config.SIM_INLINE_MAX_MATCHES:
+        return game_logic.simulate_matches_players(normal, clutch, enemy, seed)
+    return await get_executor().run(game_logic.simulate_matches_players, normal, clutch, enemy, seed, wait=wait)
+
+async def simulate_league(normal, clutch, team_powers, legs: int = 1, seed: int = None, wait: bool = True) -> dict:
+    """Турнир «каждый с каждым» (см. game_logic.simulate_league)."""
+    return await get_executor().run(game_logic.simulate_league, normal, clutch, team_powers, legs, seed, wait=wait)
+
+async def odds_table(p_values, wait: bool = True) -> list:
+    """Точные P(победы) для списка вероятностей раунда (см. odds.odds_table)."""
+    return await get_executor().run(odds.odds_table, p_values, wait=wait)
@@ -0,0 +1,953 @@
+import asyncio
+import aiosqlite
+import contextvars
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import config
+from storage import (StorageBackend, User, Player, Bet, MarketOffer, MatchRecord, TeamPower, TeamModifier,
+                     FSMRecord, check_stat_columns, POWER_WEIGHTS, FATIGUE_STAMINA, LINEUP_SIZE,
+                     ROUND_CHANCE_WEIGHTS, MIN_ROUND_CHANCE, position_bonuses)
+
+# 0. Пул соединений
+_CONNECTION_PRAGMAS = [
+    "PRAGMA synchronous = NORMAL",  # в режиме WAL это безопасно и без fsync на каждый коммит
+    f"PRAGMA cache_size = -{config.DB_CACHE_SIZE_KB}",
+    f"PRAGMA mmap_size = {config.DB_MMAP_SIZE}",
+    "PRAGMA temp_store = MEMORY",
+]
+
+# Материализованная сила стартовых пятёрок (storage.TeamPower). Её поддерживают триггеры на players,
+# поэтому она видит все пути записи, включая массовые UPDATE по владельцу.
+# Триггер не сдвигает суммы на разницу, а пересчитывает пятёрку владельца заново: изменение одного игрока
+# может ввести в пятёрку запасного. Это выборка по idx_players_owner из десятка строк его состава
+_TEAM_POWER_SQL = " + ".join(f"{weight} * {stat}" for stat, weight in POWER_WEIGHTS)
+
+def _fatigue_sql(row: str) -> str:
+    return f"(MIN({row}.stamina, {FATIGUE_STAMINA}) / {float(FATIGUE_STAMINA)})"
+
+def _round_chance_sql() -> str:
+    """
+    storage.round_chance для обычного раунда на SQL: те же операции в том же порядке,
+    поэтому пятёрка в базе совпадает с пятёркой, которую выбирает game_logic.
+    """
+    base = " + ".join(f"{stat} * {weight}" for stat, weight in ROUND_CHANCE_WEIGHTS)
+    bonus = " ".join(f"WHEN '{position}' THEN {value}" for position, value in position_bonuses().items())
+    return (f"MAX({MIN_ROUND_CHANCE}, ({base}) / 100.0 + (CASE position {bonus} ELSE 0 END) "
+            f"- MAX(0, (100 - stamina) / 200.0))")
+
+_LINEUP_ORDER_SQL = f"{_round_chance_sql()} DESC, player_id"
+_TEAM_POWER_COLUMNS = ("(owner_id, players, aim, reaction, tactics, fatigue) SELECT {owner}, COUNT(*), "
+                       + ", ".join(f"TOTAL({_fatigue_sql('lineup')} * {stat})" for stat, _ in POWER_WEIGHTS)
+                       + f", TOTAL({_fatigue_sql('lineup')})")
+
+def _team_power_refresh_sql(row: str) -> str:
+    """Пересчитывает силу пятёрки владельца игрока row (NEW/OLD): любое изменение может сменить пятёрку."""
+    return (f"INSERT OR REPLACE INTO team_power {_TEAM_POWER_COLUMNS.format(owner=f'{row}.owner_id')} "
+            f"FROM (SELECT stamina, aim, reaction, tactics FROM players WHERE owner_id = {row}.owner_id "
+            f"ORDER BY {_LINEUP_ORDER_SQL} LIMIT {LINEUP_SIZE}) AS lineup;")
+
+_TEAM_POWER_TRIGGERS = {
+    "team_power_insert": f"AFTER INSERT ON players BEGIN {_team_power_refresh_sql('NEW')} END",
+    "team_power_update": f"AFTER UPDATE OF owner_id, position, aim, reaction, tactics, stamina ON players BEGIN "
+                         f"{_team_power_refresh_sql('NEW')} END",
+    # Игрок ушёл к другому владельцу: пятёрку прежнего тоже пересчитываем
+    "team_power_move": f"AFTER UPDATE OF owner_id ON players WHEN OLD.owner_id IS NOT NEW.owner_id BEGIN "
+                       f"{_team_power_refresh_sql('OLD')} END",
+    "team_power_delete": f"AFTER DELETE ON players BEGIN {_team_power_refresh_sql('OLD')} END",
+}
+
+# Заполнение с нуля — миграция при открытии: для баз, где таблицы ещё не было (или она пуста),
+# и после смены формулы в триггерах. Дальше таблицу ведут только триггеры
+_TEAM_POWER_REBUILD_SQL = (
+    f"INSERT INTO team_power {_TEAM_POWER_COLUMNS.format(owner='owner_id')} "
+    f"FROM (SELECT owner_id, stamina, aim, reaction, tactics, "
+    f"ROW_NUMBER() OVER (PARTITION BY owner_id ORDER BY {_LINEUP_ORDER_SQL}) AS slot FROM players) AS lineup "
+    f"WHERE slot <= {LINEUP_SIZE} GROUP BY owner_id"
+)
+
+_TOP_TEAMS_SQL = (f"SELECT {TeamPower.columns()} FROM team_power WHERE players > 0 "
+                  f"ORDER BY {_TEAM_POWER_SQL} DESC LIMIT ?")
+
+# Индексы под горячие запросы: состав команды и активная ставка
+_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_players_owner ON players (owner_id)",
+    # Покрывающий: get_active_bet читает все столбцы ставки из индекса, не заходя в таблицу
+    "CREATE INDEX IF NOT EXISTS idx_bets_user_active_tactic ON bets (user_id, is_active, amount, odds, tactic)",
+    "CREATE INDEX IF NOT EXISTS idx_market_offers_user ON market_offers (user_id, purchased, expires_at)",
+    "CREATE INDEX IF NOT EXISTS idx_matches_user ON matches (user_id, match_id)",
+    f"CREATE INDEX IF NOT EXISTS idx_team_power ON team_power ({_TEAM_POWER_SQL})",
+    "CREATE INDEX IF NOT EXISTS idx_team_modifiers_user ON team_modifiers (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)",
+]
+
+# Индексы, которые заменены новыми и удаляются из старых баз
+_DROPPED_INDEXES = ["idx_bets_user_active", "idx_bets_user_active_odds"]
+
+# Запрос и индекс, который он обязан использовать; «COVERING INDEX» — ещё и без чтения таблицы
+_INDEXED_QUERIES = [
+    (f"SELECT {Player.columns()} FROM players WHERE owner_id = ?", "idx_players_owner"),
+    (f"SELECT {Bet.columns()} FROM bets WHERE user_id = ? AND is_active = 1", "COVERING INDEX idx_bets_user_active_tactic"),
+    ("UPDATE players SET stamina = MAX(0, stamina - ?) WHERE owner_id = ?", "idx_players_owner"),
+    (f"SELECT {MarketOffer.columns()} FROM market_offers WHERE user_id = ? AND purchased = 0 AND expires_at > ?",
+     "idx_market_offers_user"),
+    (f"SELECT {MatchRecord.columns()} FROM matches WHERE user_id = ? ORDER BY match_id DESC LIMIT ?",
+     "idx_matches_user"),
+    (_TOP_TEAMS_SQL, "idx_team_power"),
+    (f"SELECT {TeamModifier.columns()} FROM team_modifiers WHERE user_id = ?", "idx_team_modifiers_user"),
+    ("DELETE FROM fsm_states WHERE updated_at < ?", "idx_fsm_states_updated"),
+]
+
+class ConnectionPool:
+    """
+    Долгоживущие соединения с БД: несколько читателей и один писатель.
+    Все записи идут через единственное соединение под блокировкой,
+    поэтому они выполняются строго по очереди.
+    """
+
+    def __init__(self, path: str, readers: int):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self._readers = asyncio.Queue()
+        self._all_readers = []
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+
+    async def _connect(self):
+        conn = await aiosqlite.connect(self.path, timeout=config.DB_TIMEOUT)
+        # Прагмы действуют на соединение, поэтому задаём их каждому
+        for pragma in _CONNECTION_PRAGMAS:
+            async with conn.execute(pragma):
+                pass
+        return conn
+
+    async def open(self):
+        self._writer = await self._connect()
+        # WAL сохраняется в самом файле БД: читатели не блокируют писателя
+        async with self._writer.execute("PRAGMA journal_mode = WAL"):
+            pass
+        for _ in range(self.readers_count):
+            conn = await self._connect()
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self):
+        async with self._write_lock:
+            for conn in self._all_readers:
+                await conn.close()
+            self._all_readers.clear()
+            self._readers = asyncio.Queue()
+            if self._writer is not None:
+                async with self._writer.execute("PRAGMA optimize"):
+                    pass
+                await self._writer.close()
+                self._writer = None
+
+    @asynccontextmanager
+    async def reader(self):
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                # В том числе при отмене задачи: иначе незакоммиченные записи останутся
+                # на общем соединении и уйдут со следующим чужим коммитом
+                await self._writer.rollback()
+                raise
+
+# Кэш пользователей и составов
+_MISSING = object()
+
+class TTLCache:
+    """
+    LRU-кэш с ограничением по времени жизни записей и счётчиками попаданий.
+    Промах читается из БД между begin и finish: если ключ за это время инвалидировали,
+    прочитанное значение не кладётся. Версии ведутся по ключу и только пока его чтение идёт,
+    поэтому запись в одну команду не мешает кэшировать остальные.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._loading = {}  # key -> [версия, число идущих чтений]
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def begin(self, key) -> int:
+        """Начинает чтение key из БД; :return: версия, которую нужно передать в finish."""
+        loading = self._loading.setdefault(key, [0, 0])
+        loading[1] += 1
+        return loading[0]
+
+    def finish(self, key, version: int, value=_MISSING):
+        """Заканчивает чтение key: value кладётся, только если key не инвалидировали после begin."""
+        loading = self._loading[key]
+        loading[1] -= 1
+        if not loading[1]:
+            del self._loading[key]
+        if value is not _MISSING and loading[0] == version:
+            self.put(key, value)
+
+    def invalidate(self, key):
+        loading = self._loading.get(key)
+        if loading is not None:
+            loading[0] += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        for loading in self._loading.values():
+            loading[0] += 1
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+# Отложенная запись счётчиков баланса и фанатов
+class WriteBehindBuffer:
+    """
+    Копит мелкие приращения balance/fans по пользователям в памяти и сбрасывает их
+    пачкой одной транзакцией — по таймеру или когда набралось много пользователей.
+    get_user возвращает значение из БД плюс ещё не записанные приращения.
+    """
+
+    def __init__(self, backend, interval: float, max_pending: int):
+        self.backend = backend
+        self.interval = interval
+        self.max_pending = max_pending
+        self.epoch = 0  # растёт при начале каждого сброса
+        self._pending = {}  # user_id -> [balance, fans]
+        self._inflight = {}
+        self._flush_done = None
+        self._flush_task = None
+        self._loop_task = None
+
+    def start(self):
+        # Свежий контекст: фоновая задача не должна унаследовать открытую транзакцию
+        self._loop_task = asyncio.create_task(self._run(), context=contextvars.Context())
+
+    async def stop(self):
+        # Отменяем только ожидание таймера: начатый сброс защищён shield и дожидается ниже,
+        # иначе отмена посреди него потеряла бы уже забранную из буфера пачку
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+            self._loop_task = None
+        if self._flush_task is not None:
+            await self._flush_task
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush_now(), context=contextvars.Context())
+            try:
+                await asyncio.shield(self._flush_task)
+            except Exception as e:
+                print(f"Ошибка отложенной записи: {e}")
+
+    def add(self, user_id: int, balance: int = 0, fans: int = 0):
+        delta = self._pending.setdefault(user_id, [0, 0])
+        delta[0] += balance
+        delta[1] += fans
+        if len(self._pending) >= self.max_pending and self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_now(), context=contextvars.Context())
+
+    async def _flush_now(self):
+        try:
+            await self.flush()
+        finally:
+            self._flush_task = None
+
+    def discard(self, user_id: int, field: str):
+        # Поле перезаписали целиком — накопленное приращение больше не актуально
+        delta = self._pending.get(user_id)
+        if delta is not None and field in ("balance", "fans"):
+            delta[0 if field == "balance" else 1] = 0
+
+    def apply(self, user):
+        delta = self._pending.get(user.user_id) if user is not None else None
+        if not delta:
+            return user
+        return User(user.user_id, user.balance + delta[0], user.fans + delta[1], user.reputation, user.team_name)
+
+    async def wait_for(self, user_id: int):
+        # Проверяем в цикле: пока мы ждали, мог начаться следующий сброс
+        while self._flush_done is not None and user_id in self._inflight:
+            await self._flush_done.wait()
+
+    async def flush(self):
+        # Пачку забираем только под блокировкой писателя: пока её ждём,
+        # открытые транзакции продолжают видеть приращения в _pending
+        async with self.backend.pool.writer() as db:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._inflight = batch
+            self.epoch += 1
+            self._flush_done = asyncio.Event()
+            committing = False
+            try:
+                await db.executemany(
+                    "UPDATE users SET balance = balance + ?, fans = fans + ? WHERE user_id = ?",
+                    [(balance, fans, user_id) for user_id, (balance, fans) in batch.items()]
+                )
+                committing = True
+                await db.commit()
+                for user_id in batch:
+                    self.backend.user_cache.invalidate(user_id)
+            except BaseException as e:
+                # Отмена во время commit не останавливает его: aiosqlite уже поставил его в очередь
+                # соединения, и пачка будет записана — возвращать её нельзя
+                if committing and isinstance(e, asyncio.CancelledError):
+                    raise
+                # Иначе писатель откатит транзакцию: возвращаем приращения в буфер, чтобы не потерять их
+                for user_id, (balance, fans) in batch.items():
+                    delta = self._pending.setdefault(user_id, [0, 0])
+                    delta[0] += balance
+                    delta[1] += fans
+                raise
+            finally:
+                self._inflight = {}
+                self._flush_done.set()
+                self._flush_done = None
+
+    def stats(self) -> dict:
+        return {"pending_users": len(self._pending), "flushes": self.epoch}
+
+_PLAYER_COLUMNS = "owner_id, nickname, position, rarity, aim, reaction, tactics, stamina, morale"
+
+def _player_values(owner_id, player: dict) -> tuple:
+    return (
+        owner_id, player["nickname"], player["position"], player["rarity"],
+        player["aim"], player["reaction"], player["tactics"],
+        player.get("stamina", 100), player.get("morale", 100)
+    )
+
+def _clamped_deltas_sql(deltas: dict, low: int, high: int):
+    """Собирает SET-часть вида «morale = MAX(0, MIN(100, morale + ?))» и её параметры."""
+    check_stat_columns(deltas)
+    assignments = []
+    params = []
+    for column, delta in deltas.items():
+        assignments.append(f"{column} = MAX(?, MIN(?, {column} + ?))")
+        params.extend((low, high, delta))
+    return ", ".join(assignments), params
+
+class SQLiteBackend(StorageBackend):
+    """
+    Хранилище на SQLite: пул соединений, WAL, кэш пользователей и составов
+    и (по желанию) отложенная запись счётчиков.
+    """
+
+    def __init__(self, path: str = None, readers: int = None):
+        self.path = path or config.DB_PATH
+        self.readers = readers or config.DB_READERS
+        self.pool = None
+        self.buffer = None
+        self.user_cache = TTLCache(config.CACHE_SIZE, config.CACHE_TTL)
+        self.roster_cache = TTLCache(config.CACHE_SIZE, config.CACHE_TTL)
+        self.power_cache = TTLCache(config.CACHE_SIZE, config.CACHE_TTL)
+        self.modifier_cache = TTLCache(config.CACHE_SIZE, config.CACHE_TTL)
+        # Единица работы: все записи внутри transaction() идут одной транзакцией
+        self._current_tx = contextvars.ContextVar(f"current_tx_{id(self)}", default=None)
+        self._tx_dirty = contextvars.ContextVar(f"tx_dirty_{id(self)}", default=None)
+
+    # 1. Открытие и закрытие
+    async def open(self):
+        pool = ConnectionPool(self.path, self.readers)
+        await pool.open()
+        self.pool = pool
+
+        async with pool.writer() as db:
+            # Таблица пользователей
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    balance INTEGER DEFAULT 1000,
+                    fans INTEGER DEFAULT 0,
+                    reputation INTEGER DEFAULT 50,
+                    team_name TEXT
+                )
+            ''')
+            # Таблица игроков
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS players (
+                    player_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    owner_id INTEGER,
+                    nickname TEXT,
+                    position TEXT,
+                    rarity TEXT,
+                    aim INTEGER,
+                    reaction INTEGER,
+                    tactics INTEGER,
+                    stamina INTEGER DEFAULT 100,
+                    morale INTEGER DEFAULT 100,
+                    FOREIGN KEY (owner_id) REFERENCES users (user_id)
+                )
+            ''')
+            # Таблица ставок
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS bets (
+                    bet_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    amount INTEGER,
+                    is_active BOOLEAN DEFAULT 1,
+                    odds REAL DEFAULT 2.0,
+                    tactic TEXT
+                )
+            ''')
+            # Старые базы: коэффициент и тактика ставки появились позже таблицы
+            async with db.execute("PRAGMA table_info(bets)") as cursor:
+                bet_columns = [row[1] for row in await cursor.fetchall()]
+            if "odds" not in bet_columns:
+                await db.execute("ALTER TABLE bets ADD COLUMN odds REAL DEFAULT 2.0")
+            if "tactic" not in bet_columns:
+                await db.execute("ALTER TABLE bets ADD COLUMN tactic TEXT")
+            # Таблица рынка: одно предложение — одна строка
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS market_offers (
+                    offer_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    nickname TEXT,
+                    position TEXT,
+                    rarity TEXT,
+                    aim INTEGER,
+                    reaction INTEGER,
+                    tactics INTEGER,
+                    price INTEGER,
+                    expires_at REAL,
+                    purchased BOOLEAN DEFAULT 0
+                )
+            ''')
+            # Таблица матчей: seed, входные данные и сжатый итог
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS matches (
+                    match_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    seed INTEGER,
+                    tactic TEXT,
+                    lineup TEXT,
+                    chances BLOB,
+                    user_power REAL,
+                    enemy_power REAL,
+                    rounds_mask INTEGER,
+                    rounds INTEGER,
+                    events BLOB,
+                    played_at REAL
+                )
+            ''')
+            # Материализованная сила составов
+            async with db.execute("SELECT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                                  "AND name = 'team_power')") as cursor:
+                (had_team_power,) = await cursor.fetchone()
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS team_power (
+                    owner_id INTEGER PRIMARY KEY,
+                    players INTEGER DEFAULT 0,
+                    aim REAL DEFAULT 0,
+                    reaction REAL DEFAULT 0,
+                    tactics REAL DEFAULT 0,
+                    fatigue REAL DEFAULT 0
+                )
+            ''')
+            # Модификаторы команды: талисман, спонсор и действующие эффекты событий
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS team_modifiers (
+                    modifier_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER,
+                    source TEXT,
+                    name TEXT,
+                    matches_left INTEGER
+                )
+            ''')
+            # Состояния FSM aiogram (см. fsm_storage.py)
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT,
+                    updated_at REAL
+                )
+            ''')
+            for index_name in _DROPPED_INDEXES:
+                await db.execute(f"DROP INDEX IF EXISTS {index_name}")
+            for index_sql in _INDEXES:
+                await db.execute(index_sql)
+            # Сила составов: заполняем, только если таблица новая или пустая
+            backfill = not had_team_power
+            if not backfill:
+                async with db.execute("SELECT NOT EXISTS (SELECT 1 FROM team_power)") as cursor:
+                    (backfill,) = await cursor.fetchone()
+            # Триггер пересоздаём, только если его текст изменился: тогда изменилась и формула,
+            # а сохранённая по старой сила устарела
+            async with db.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger'") as cursor:
+                triggers = dict(await cursor.fetchall())
+            for name, body in _TEAM_POWER_TRIGGERS.items():
+                trigger_sql = f"CREATE TRIGGER {name} {body}"
+                if triggers.get(name) != trigger_sql:
+                    await db.execute(f"DROP TRIGGER IF EXISTS {name}")
+                    await db.execute(trigger_sql)
+                    backfill = True
+            if backfill:
+                await db.execute("DELETE FROM team_power")
+                await db.execute(_TEAM_POWER_REBUILD_SQL)
+            await db.commit()
+
+        problems = await self.check_query_plans()
+        for problem in problems:
+            print(f"Предупреждение БД: {problem}")
+
+        if config.WRITE_BEHIND:
+            self.buffer = WriteBehindBuffer(self, config.WRITE_BEHIND_INTERVAL, config.WRITE_BEHIND_MAX_PENDING)
+            self.buffer.start()
+
+    async def close(self):
+        if self.buffer is not None:
+            # Сбрасываем накопленные счётчики до закрытия соединений
+            await self.buffer.stop()
+            self.buffer = None
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+        self.user_cache.clear()
+        self.roster_cache.clear()
+        self.power_cache.clear()
+        self.modifier_cache.clear()
+
+    async def check_query_plans(self) -> list:
+        """
+        Проверяет через EXPLAIN QUERY PLAN, что горячие запросы идут по индексам.
+        :return: список описаний проблем (пустой, если всё в порядке)
+        """
+        problems = []
+        async with self.pool.reader() as db:
+            for query, index_name in _INDEXED_QUERIES:
+                params = (0,) * query.count("?")
+                async with db.execute(f"EXPLAIN QUERY PLAN {query}", params) as cursor:
+                    plan = " | ".join(row[3] for row in await cursor.fetchall())
+                if index_name not in plan:
+                    problems.append(f"запрос «{query}» не использует {index_name}: {plan}")
+        return problems
+
+    def cache_stats(self) -> dict:
+        """Счётчики кэша, чтобы подбирать его размер."""
+        return {"users": self.user_cache.stats(), "rosters": self.roster_cache.stats(),
+                "team_powers": self.power_cache.stats(), "modifiers": self.modifier_cache.stats()}
+
+    async def flush_pending(self):
+        if self.buffer is not None:
+            await self.buffer.flush()
+
+    # Транзакции, чтение и кэш
+    @asynccontextmanager
+    async def transaction(self):
+        """
+        Открывает транзакцию на соединении-писателе и коммитит её один раз на выходе.
+        Любые методы записи, вызванные внутри, присоединяются к ней, а не коммитят сами.
+        При исключении всё откатывается.
+        """
+        db = self._current_tx.get()
+        if db is not None:
+            # Вложенный вызов — используем уже открытую транзакцию
+            yield db
+            return
+        async with self.pool.writer() as db:
+            token = self._current_tx.set(db)
+            dirty = []
+            dirty_token = self._tx_dirty.set(dirty)
+            try:
+                yield db
+                await db.commit()
+            finally:
+                self._current_tx.reset(token)
+                self._tx_dirty.reset(dirty_token)
+                for cache, key in dirty:
+                    cache.invalidate(key)
+
+    @asynccontextmanager
+    async def _read(self):
+        # Внутри транзакции читаем через её соединение, чтобы видеть свои же записи
+        db = self._current_tx.get()
+        if db is not None:
+            yield db
+            return
+        async with self.pool.reader() as db:
+            yield db
+
+    async def _cached_read(self, cache: TTLCache, key, loader):
+        # Внутри транзакции кэш не используем: там могут быть незакоммиченные изменения
+        if self._current_tx.get() is not None:
+            return await loader()
+        value = cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        # Если пока мы читали, этот ключ инвалидировали, finish не положит устаревшее значение
+        version = cache.begin(key)
+        try:
+            value = await loader()
+        except BaseException:
+            cache.finish(key, version)
+            raise
+        cache.finish(key, version, value)
+        return value
+
+    def _invalidate_team(self, owner_id: int):
+        # Любое изменение игроков меняет и состав, и его силу
+        self._invalidate(self.roster_cache, owner_id)
+        self._invalidate(self.power_cache, owner_id)
+
+    def _invalidate(self, cache: TTLCache, key):
+        cache.invalidate(key)
+        dirty = self._tx_dirty.get()
+        if dirty is not None:
+            # Повторим после коммита, чтобы читатели не успели закэшировать старые данные
+            dirty.append((cache, key))
+
+    # 2. Пользователи
+    async def create_user(self, user_id: int, team_name: str):
+        async with self.transaction() as db:
+            await db.execute(
+                "INSERT OR IGNORE INTO users (user_id, team_name, balance) VALUES (?, ?, ?)",
+                (user_id, team_name, 1000)
+            )
+            self._invalidate(self.user_cache, user_id)
+
+    async def get_user(self, user_id: int):
+        buffer = self.buffer
+        if buffer is None or self._current_tx.get() is not None:
+            # Внутри транзакции сброс буфера идти не может: писатель занят нами
+            user = await self._cached_read(self.user_cache, user_id, lambda: self._load_user(user_id))
+            return buffer.apply(user) if buffer is not None else user
+        while True:
+            await buffer.wait_for(user_id)
+            epoch = buffer.epoch
+            user = await self._cached_read(self.user_cache, user_id, lambda: self._load_user(user_id))
+            # Если во время чтения начался сброс, значение из БД могло уже включать приращения
+            if buffer.epoch == epoch:
+                return buffer.apply(user)
+
+    async def _load_user(self, user_id: int):
+        async with self._read() as db:
+            async with db.execute(f"SELECT {User.columns()} FROM users WHERE user_id = ?", (user_id,)) as cursor:
+                row = await cursor.fetchone()
+                return User(*row) if row else None
+
+    async def update_user_balance(self, user_id: int, amount: int):
+        # Вне транзакции мелкие приращения копим в буфере отложенной записи
+        if self.buffer is not None and self._current_tx.get() is None:
+            self.buffer.add(user_id, balance=amount)
+            return
+        async with self.transaction() as db:
+            await db.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (amount, user_id))
+            self._invalidate(self.user_cache, user_id)
+
+    async def add_user_fans(self, user_id: int, amount: int):
+        if self.buffer is not None and self._current_tx.get() is None:
+            self.buffer.add(user_id, fans=amount)
+            return
+        async with self.transaction() as db:
+            await db.execute("UPDATE users SET fans = fans + ? WHERE user_id = ?", (amount, user_id))
+            self._invalidate(self.user_cache, user_id)
+
+    async def update_user_field(self, user_id, field, value):
+        if self.buffer is not None:
+            self.buffer.discard(user_id, field)
+        async with self.transaction() as db:
+            await db.execute(f"UPDATE users SET {field} = ? WHERE user_id = ?", (value, user_id))
+            self._invalidate(self.user_cache, user_id)
+
+    # 3. Игроки
+    async def create_player(self, owner_id, nickname, position, rarity, aim, reaction, tactics,
+                            stamina=100, morale=100) -> int:
+        async with self.transaction() as db:
+            async with db.execute(
+                f"INSERT INTO players ({_PLAYER_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING player_id",
+                (owner_id, nickname, position, rarity, aim, reaction, tactics, stamina, morale)
+            ) as cursor:
+                row = await cursor.fetchone()
+            self._invalidate_team(owner_id)
+            return row[0]
+
+    async def create_players(self, owner_id, players: list) -> list:
+        if not players:
+            return []
+        placeholders = ", ".join(["(?, ?, ?, ?, ?, ?, ?, ?, ?)"] * len(players))
+        params = [value for player in players for value in _player_values(owner_id, player)]
+        async with self.transaction() as db:
+            async with db.execute(
+                f"INSERT INTO players ({_PLAYER_COLUMNS}) VALUES {placeholders} RETURNING player_id",
+                params
+            ) as cursor:
+                rows = await cursor.fetchall()
+            self._invalidate_team(owner_id)
+        # AUTOINCREMENT выдаёт id по возрастанию в порядке вставки
+        return sorted(row[0] for row in rows)
+
+    async def get_team_players(self, owner_id: int) -> list:
+        players = await self._cached_read(self.roster_cache, owner_id, lambda: self._load_team_players(owner_id))
+        return list(players)  # копия, чтобы вызывающий код не испортил кэш
+
+    async def _load_team_players(self, owner_id: int):
+        async with self._read() as db:
+            async with db.execute(f"SELECT {Player.columns()} FROM players WHERE owner_id = ?", (owner_id,)) as cursor:
+                return tuple(Player(*row) for row in await cursor.fetchall())
+
+    async def get_player(self, player_id: int):
+        async with self._read() as db:
+            async with db.execute(f"SELECT {Player.columns()} FROM players WHERE player_id = ?", (player_id,)) as cursor:
+                row = await cursor.fetchone()
+                return Player(*row) if row else None
+
+    async def get_team_power(self, owner_id: int):
+        return await self._cached_read(self.power_cache, owner_id, lambda: self._load_team_power(owner_id))
+
+    async def _load_team_power(self, owner_id: int):
+        async with self._read() as db:
+            async with db.execute(f"SELECT {TeamPower.columns()} FROM team_power WHERE owner_id = ?", (owner_id,)) as cursor:
+                row = await cursor.fetchone()
+                return TeamPower(*row) if row else TeamPower.empty(owner_id)
+
+    async def get_top_teams(self, limit: int = 10) -> list:
+        async with self._read() as db:
+            async with db.execute(_TOP_TEAMS_SQL, (limit,)) as cursor:
+                return [TeamPower(*row) for row in await cursor.fetchall()]
+
+    async def _invalidate_owners_of(self, db, player_ids):
+        placeholders = ", ".join("?" * len(player_ids))
+        async with db.execute(
+            f"SELECT DISTINCT owner_id FROM players WHERE player_id IN ({placeholders})", tuple(player_ids)
+        ) as cursor:
+            for (owner_id,) in await cursor.fetchall():
+                self._invalidate_team(owner_id)
+
+    async def update_player_stats(self, player_id, **kwargs):
+        if not kwargs:
+            return
+        assignments, params = [], []
+        for key, value in kwargs.items():
+            if isinstance(value, str) and value.startswith('+'):
+                assignments.append(f"{key} = {key} + ?")
+                params.append(int(value[1:]))
+            elif isinstance(value, str) and value.startswith('-'):
+                assignments.append(f"{key} = {key} - ?")
+                params.append(int(value[1:]))
+            else:
+                assignments.append(f"{key} = ?")
+                params.append(value)
+        async with self.transaction() as db:
+            # Прежний владелец: при смене owner_id игрок уходит из его состава
+            async with db.execute("SELECT owner_id FROM players WHERE player_id = ?", (player_id,)) as cursor:
+                previous = await cursor.fetchone()
+            await db.execute(f"UPDATE players SET {', '.join(assignments)} WHERE player_id = ?", (*params, player_id))
+            # Сбрасываем кэш после записи: иначе чтение между сбросом и UPDATE закэширует старый состав
+            if previous is not None:
+                self._invalidate_team(previous[0])
+            await self._invalidate_owners_of(db, [player_id])
+
+    async def reduce_player_stamina(self, owner_id: int, amount: int):
+        async with self.transaction() as db:
+            await db.execute("UPDATE players SET stamina = MAX(0, stamina - ?) WHERE owner_id = ?", (amount, owner_id))
+            self._invalidate_team(owner_id)
+
+    async def adjust_team_stats(self, owner_id: int, low: int = 0, high: int = 100, **deltas):
+        if not deltas:
+            return
+        set_sql, params = _clamped_deltas_sql(deltas, low, high)
+        async with self.transaction() as db:
+            await db.execute(f"UPDATE players SET {set_sql} WHERE owner_id = ?", (*params, owner_id))
+            self._invalidate_team(owner_id)
+
+    async def adjust_players_stats(self, player_ids: list, low: int = 0, high: int = 100, **deltas):
+        if not deltas or not player_ids:
+            return
+        set_sql, params = _clamped_deltas_sql(deltas, low, high)
+        async with self.transaction() as db:
+            await db.executemany(
+                f"UPDATE players SET {set_sql} WHERE player_id = ?",
+                [(*params, player_id) for player_id in player_ids]
+            )
+            await self._invalidate_owners_of(db, player_ids)
+
+    # 4. Модификаторы команды
+    async def get_team_modifiers(self, user_id: int) -> tuple:
+        return await self._cached_read(self.modifier_cache, user_id, lambda: self._load_team_modifiers(user_id))
+
+    async def _load_team_modifiers(self, user_id: int):
+        async with self._read() as db:
+            async with db.execute(
+                f"SELECT {TeamModifier.columns()} FROM team_modifiers WHERE user_id = ? ORDER BY modifier_id", (user_id,)
+            ) as cursor:
+                return tuple(TeamModifier(*row) for row in await cursor.fetchall())
+
+    async def set_team_modifier(self, user_id: int, source: str, name: str = None):
+        async with self.transaction() as db:
+            await db.execute("DELETE FROM team_modifiers WHERE user_id = ? AND source = ?", (user_id, source))
+            if name is not None:
+                await db.execute("INSERT INTO team_modifiers (user_id, source, name) VALUES (?, ?, ?)",
+                                 (user_id, source, name))
+            self._invalidate(self.modifier_cache, user_id)
+
+    async def add_team_effect(self, user_id: int, name: str, matches: int):
+        async with self.transaction() as db:
+            await db.execute("INSERT INTO team_modifiers (user_id, source, name, matches_left) VALUES (?, 'event', ?, ?)",
+                             (user_id, name, matches))
+            self._invalidate(self.modifier_cache, user_id)
+
+    async def tick_team_effects(self, user_id: int):
+        async with self.transaction() as db:
+            async with db.execute(
+                "UPDATE team_modifiers SET matches_left = matches_left - 1 "
+                "WHERE user_id = ? AND matches_left IS NOT NULL RETURNING modifier_id", (user_id,)
+            ) as cursor:
+                ticked = await cursor.fetchall()
+            if not ticked:
+                return
+            await db.execute("DELETE FROM team_modifiers WHERE user_id = ? AND matches_left <= 0", (user_id,))
+            self._invalidate(self.modifier_cache, user_id)
+
+    # 5. Рынок
+    async def set_market_players(self, user_id: int, players: list) -> list:
+        expires_at = time.time() + config.MARKET_OFFER_TTL
+        async with self.transaction() as db:
+            await db.execute("DELETE FROM market_offers WHERE user_id = ?", (user_id,))
+            offers = []
+            for player in players:
+                async with db.execute(
+                    "INSERT INTO market_offers (user_id, nickname, position, rarity, aim, reaction, tactics, price, expires_at) "
+                    f"VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING {MarketOffer.columns()}",
+                    (user_id, player["nickname"], player["position"], player["rarity"],
+                     player["aim"], player["reaction"], player["tactics"], player["price"], expires_at)
+                ) as cursor:
+                    offers.append(MarketOffer(*await cursor.fetchone()))
+            return offers
+
+    async def get_market_players(self, user_id: int) -> list:
+        async with self._read() as db:
+            async with db.execute(
+                f"SELECT {MarketOffer.columns()} FROM market_offers WHERE user_id = ? AND purchased = 0 AND expires_at > ?",
+                (user_id, time.time())
+            ) as cursor:
+                return [MarketOffer(*row) for row in await cursor.fetchall()]
+
+    async def get_market_offer(self, user_id: int, offer_id: int):
+        async with self._read() as db:
+            async with db.execute(
+                f"SELECT {MarketOffer.columns()} FROM market_offers "
+                "WHERE offer_id = ? AND user_id = ? AND purchased = 0 AND expires_at > ?",
+                (offer_id, user_id, time.time())
+            ) as cursor:
+                row = await cursor.fetchone()
+                return MarketOffer(*row) if row else None
+
+    async def claim_market_offer(self, user_id: int, offer_id: int):
+        async with self.transaction() as db:
+            async with db.execute(
+                "UPDATE market_offers SET purchased = 1 "
+                "WHERE offer_id = ? AND user_id = ? AND purchased = 0 AND expires_at > ? "
+                f"RETURNING {MarketOffer.columns()}",
+                (offer_id, user_id, time.time())
+            ) as cursor:
+                row = await cursor.fetchone()
+            return MarketOffer(*row) if row else None
+
+    # 6. Ставки
+    async def create_bet(self, user_id: int, amount: int, odds: float = 2.0, tactic: str = None):
+        async with self.transaction() as db:
+            await db.execute("INSERT INTO bets (user_id, amount, odds, tactic) VALUES (?, ?, ?, ?)",
+                             (user_id, amount, odds, tactic))
+            # Сразу списываем ставку в той же транзакции
+            await db.execute("UPDATE users SET balance = balance - ? WHERE user_id = ?", (amount, user_id))
+            self._invalidate(self.user_cache, user_id)
+
+    async def get_active_bet(self, user_id: int):
+        async with self._read() as db:
+            async with db.execute(
+                f"SELECT {Bet.columns()} FROM bets WHERE user_id = ? AND is_active = 1", (user_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return Bet(*row) if row else None
+
+    async def clear_bet(self, user_id: int):
+        async with self.transaction() as db:
+            await db.execute("UPDATE bets SET is_active = 0 WHERE user_id = ?", (user_id,))
+
+    # 7. Матчи
+    async def save_match(self, record) -> int:
+        async with self.transaction() as db:
+            async with db.execute(
+                "INSERT INTO matches (user_id, seed, tactic, lineup, chances, user_power, enemy_power, "
+                "rounds_mask, rounds, events, played_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING match_id",
+                (record.user_id, record.seed, record.tactic, record.lineup, record.chances,
+                 record.user_power, record.enemy_power,
+                 record.rounds_mask, record.rounds, record.events, record.played_at)
+            ) as cursor:
+                row = await cursor.fetchone()
+            return row[0]
+
+    async def get_match(self, match_id: int):
+        async with self._read() as db:
+            async with db.execute(f"SELECT {MatchRecord.columns()} FROM matches WHERE match_id = ?", (match_id,)) as cursor:
+                row = await cursor.fetchone()
+                return MatchRecord(*row) if row else None
+
+    async def get_user_matches(self, user_id: int, limit: int = 10) -> list:
+        async with self._read() as db:
+            async with db.execute(
+                f"SELECT {MatchRecord.columns()} FROM matches WHERE user_id = ? ORDER BY match_id DESC LIMIT ?",
+                (user_id, limit)
+            ) as cursor:
+                return [MatchRecord(*row) for row in await cursor.fetchall()]
+
+    # 8. Состояния FSM
+    async def get_fsm_record(self, key: str):
+        async with self._read() as db:
+            async with db.execute(f"SELECT {FSMRecord.columns()} FROM fsm_states WHERE key = ?", (key,)) as cursor:
+                row = await cursor.fetchone()
+        return FSMRecord(*row) if row else None
+
+    async def save_fsm_records(self, records: list):
+        async with self.transaction() as db:
+            await db.executemany(
+                f"INSERT OR REPLACE INTO fsm_states ({FSMRecord.columns()}) VALUES (?, ?, ?, ?)",
+                [(r.key, r.state, r.data, r.updated_at) for r in records if r.state is not None or r.data is not None]
+            )
+            await db.executemany(
+                "DELETE FROM fsm_states WHERE key = ?",
+                [(r.key,) for r in records if r.state is None and r.data is None]
+            )
+
+    async def delete_expired_fsm_records(self, before: float) -> int:
+        async with self.transaction() as db:
+            async with db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (before,)) as cursor:
+                return cursor.rowcount
@@ -0,0 +1,305 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+
+# Типы записей: компактные объекты со __slots__ вместо позиционных кортежей
+class _Record:
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    @classmethod
+    def columns(cls) -> str:
+        return ", ".join(cls.__slots__)
+
+class User(_Record):
+    __slots__ = ("user_id", "balance", "fans", "reputation", "team_name")
+
+class Player(_Record):
+    __slots__ = ("player_id", "owner_id", "nickname", "position", "rarity",
+                 "aim", "reaction", "tactics", "stamina", "morale")
+
+class Bet(_Record):
+    # tactic — тактика, на которой построен коэффициент: матч по ставке играется только ею
+    __slots__ = ("bet_id", "user_id", "amount", "is_active", "odds", "tactic")
+
+class MarketOffer(_Record):
+    __slots__ = ("offer_id", "user_id", "nickname", "position", "rarity",
+                 "aim", "reaction", "tactics", "price", "expires_at", "purchased")
+
+class MatchRecord(_Record):
+    # Матч целиком восстанавливается из seed и сил команд; маска и события хранятся,
+    # чтобы показывать итог без повторной симуляции
+    __slots__ = ("match_id", "user_id", "seed", "tactic", "lineup", "chances", "user_power", "enemy_power",
+                 "rounds_mask", "rounds", "events", "played_at")
+
+# Сила игрока: взвешенная сумма характеристик, умноженная на множитель усталости
+POWER_WEIGHTS = (("aim", 0.4), ("reaction", 0.3), ("tactics", 0.3))
+FATIGUE_STAMINA = 50  # при стамине от 50 % множитель 1.0, ниже — падает линейно
+
+def fatigue_multiplier(stamina) -> float:
+    return min(stamina, FATIGUE_STAMINA) / FATIGUE_STAMINA
+
+# Стартовая пятёрка: лучшие игроки по шансу в обычном раунде (при равенстве — раньше нанятые).
+# Матчи играет она, поэтому и материализуется, и сравнивается в рейтинге именно её сила
+LINEUP_SIZE = 5
+ROUND_CHANCE_WEIGHTS = (("aim", 0.4), ("reaction", 0.3), ("tactics", 0.2))
+MIN_ROUND_CHANCE = 0.1
+
+def position_bonuses(round_type: str = "normal") -> dict:
+    """Бонусы к шансу по позициям для типа раунда (normal, knife, clutch и т. д.)."""
+    return {
+        "AWPer": 0.15 if round_type != "knife" else -0.2,
+        "Entry Fragger": 0.1 if round_type == "normal" else 0.05,
+        "Lurker": 0.12 if round_type == "clutch" else 0.0,
+        "IGL": 0.1 if round_type in ["normal", "clutch"] else 0.0
+    }
+
+def round_chance(player, round_type: str = "normal") -> float:
+    """Шанс игрока повлиять на раунд без округления (см. game_logic.calculate_player_round_chance)."""
+    return _round_chance(player.aim, player.reaction, player.tactics, player.position, player.stamina, round_type)
+
+@lru_cache(maxsize=65536)
+def _round_chance(aim, reaction, tactics, position, stamina, round_type) -> float:
+    # Шанс зависит только от характеристик, а их сочетаний немного: каждый матч и выбор пятёрки
+    # берут готовое значение вместо пересчёта бонусов
+    stats = {"aim": aim, "reaction": reaction, "tactics": tactics}
+    base_chance = sum(stats[stat] * weight for stat, weight in ROUND_CHANCE_WEIGHTS) / 100
+    bonus = position_bonuses(round_type).get(position, 0)
+    fatigue_penalty = max(0, (100 - stamina) / 200)  # при 100 % — 0, при 0 % — −0.5
+    return max(MIN_ROUND_CHANCE, base_chance + bonus - fatigue_penalty)
+
+def starting_lineup(players) -> list:
+    """Стартовая пятёрка из игроков состава, сильнейшие первыми."""
+    return sorted(players, key=lambda player: (-round_chance(player), player.player_id))[:LINEUP_SIZE]
+
+class TeamPower(_Record):
+    # Материализованная сила стартовой пятёрки: суммы характеристик, умноженных на множитель усталости,
+    # и сумма самих множителей (к ней масштабируются бонусы талисмана); players — сколько игроков в пятёрке.
+    # Бэкенд поддерживает её при каждом изменении игроков, поэтому чтение — O(1)
+    __slots__ = ("owner_id", "players", "aim", "reaction", "tactics", "fatigue")
+
+    @classmethod
+    def empty(cls, owner_id):
+        return cls(owner_id, 0, 0.0, 0.0, 0.0, 0.0)
+
+    @classmethod
+    def of(cls, owner_id, players):
+        """Сила, сложенная из игроков players."""
+        power = cls.empty(owner_id)
+        for player in players:
+            power = power.with_player(player)
+        return power
+
+    @property
+    def power(self) -> float:
+        """Базовая сила состава без тактики и талисмана."""
+        return sum(weight * getattr(self, stat) for stat, weight in POWER_WEIGHTS)
+
+    def with_player(self, player, sign: int = 1):
+        """Новая запись с добавленным (sign=1) или убранным (sign=-1) игроком."""
+        factor = sign * fatigue_multiplier(player.stamina)
+        return TeamPower(self.owner_id, self.players + sign,
+                         self.aim + factor * player.aim,
+                         self.reaction + factor * player.reaction,
+                         self.tactics + factor * player.tactics,
+                         self.fatigue + factor)
+
+class TeamModifier(_Record):
+    # Источник модификаторов команды: source — mascot, sponsor или event, name — ключ в config.
+    # matches_left — сколько матчей ещё действует эффект события (None — бессрочно)
+    __slots__ = ("user_id", "source", "name", "matches_left")
+
+class FSMRecord(_Record):
+    # Состояние FSM aiogram: key — ключ StorageKey одной строкой, data — словарь данных в JSON.
+    # Запись без состояния и данных (state и data — None) означает, что сценария нет
+    __slots__ = ("key", "state", "data", "updated_at")
+
+# Характеристики игрока, которые можно менять массовыми операциями
+PLAYER_STAT_COLUMNS = ("aim", "reaction", "tactics", "stamina", "morale")
+
+def check_stat_columns(columns):
+    for column in columns:
+        if column not in PLAYER_STAT_COLUMNS:
+            raise ValueError(f"Неизвестная характеристика игрока: {column}")
+
+class StorageBackend(ABC):
+    """
+    Интерфейс хранилища: пользователи, игроки, ставки и рынок.
+    database.py вызывает только эти методы, поэтому движок можно заменить,
+    не трогая bot.py и game_logic.py.
+    Методы без реализации по умолчанию абстрактные: неполный бэкенд не создастся.
+    """
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    def transaction(self):
+        """Единица работы (async with): все записи внутри применяются атомарно."""
+        raise NotImplementedError
+
+    async def check_query_plans(self) -> list:
+        return []
+
+    def cache_stats(self) -> dict:
+        return {}
+
+    async def flush_pending(self):
+        pass
+
+    # Пользователи
+    @abstractmethod
+    async def create_user(self, user_id: int, team_name: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_user(self, user_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_user_balance(self, user_id: int, amount: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_user_fans(self, user_id: int, amount: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_user_field(self, user_id, field, value):
+        raise NotImplementedError
+
+    # Игроки
+    @abstractmethod
+    async def create_player(self, owner_id, nickname, position, rarity, aim, reaction, tactics,
+                            stamina=100, morale=100) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def create_players(self, owner_id, players: list) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_team_players(self, owner_id: int) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_player(self, player_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def update_player_stats(self, player_id, **kwargs):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_team_power(self, owner_id: int):
+        """Материализованная сила стартовой пятёрки (TeamPower); для команды без игроков — пустая."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_top_teams(self, limit: int = 10) -> list:
+        """Самые сильные стартовые пятёрки по базовой силе, сильные первыми."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def reduce_player_stamina(self, owner_id: int, amount: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def adjust_team_stats(self, owner_id: int, low: int = 0, high: int = 100, **deltas):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def adjust_players_stats(self, player_ids: list, low: int = 0, high: int = 100, **deltas):
+        raise NotImplementedError
+
+    # Модификаторы команды
+    @abstractmethod
+    async def get_team_modifiers(self, user_id: int) -> tuple:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_team_modifier(self, user_id: int, source: str, name: str = None):
+        """Заменяет бессрочный модификатор источника source (талисман, спонсор); name=None — снимает его."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_team_effect(self, user_id: int, name: str, matches: int):
+        """Добавляет эффект события на matches матчей."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def tick_team_effects(self, user_id: int):
+        """Списывает один матч со всех эффектов событий и удаляет закончившиеся."""
+        raise NotImplementedError
+
+    # Рынок
+    @abstractmethod
+    async def set_market_players(self, user_id: int, players: list) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_market_players(self, user_id: int) -> list:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_market_offer(self, user_id: int, offer_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def claim_market_offer(self, user_id: int, offer_id: int):
+        raise NotImplementedError
+
+    # Ставки
+    @abstractmethod
+    async def create_bet(self, user_id: int, amount: int, odds: float = 2.0, tactic: str = None):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_active_bet(self, user_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def clear_bet(self, user_id: int):
+        raise NotImplementedError
+
+    # Матчи
+    @abstractmethod
+    async def save_match(self, record) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_match(self, match_id: int):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_user_matches(self, user_id: int, limit: int = 10) -> list:
+        raise NotImplementedError
+
+    # Состояния FSM
+    @abstractmethod
+    async def get_fsm_record(self, key: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    async def save_fsm_records(self, records: list):
+        """Записывает пачку FSMRecord одной транзакцией; пустые записи удаляются."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def delete_expired_fsm_records(self, before: float) -> int:
+        """Удаляет записи, не менявшиеся с момента before. :return: сколько удалено"""
+        raise NotImplementedError
@@ -0,0 +1,98 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+import database
+import fsm_storage
+from sqlite_backend import SQLiteBackend
+
+def _key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=42, chat_id=user_id, user_id=user_id)
+
+async def _stored_state(user_id: int):
+    record = await database.get_fsm_record(fsm_storage._KEY_BUILDER.build(_key(user_id)))
+    return None if record is None else record.state
+
+def test_changes_are_flushed_in_batches(tmp_path, monkeypatch):
+    batches = []
+    save_fsm_records = database.save_fsm_records
+
+    async def counting_save(records):
+        batches.append(sorted(record.state for record in records))
+        await save_fsm_records(records)
+
+    monkeypatch.setattr(database, "save_fsm_records", counting_save)
+
+    async def main():
+        await database.init_db(SQLiteBackend(str(tmp_path / "test.db"), readers=1))
+        storage = fsm_storage.DatabaseStorage(flush_interval=0.05, max_pending=3)
+        try:
+            # Переходы копятся в памяти и читаются оттуда, пока таймер не сбросит их одной транзакцией
+            await storage.set_state(_key(1), "a")
+            await storage.set_state(_key(1), "b")
+            await storage.set_state(_key(2), "c")
+            assert await storage.get_state(_key(1)) == "b"
+            assert await _stored_state(1) is None and batches == []
+            await asyncio.sleep(0.1)
+            assert batches == [["b", "c"]]
+            assert await _stored_state(1) == "b"
+
+            # Набралось max_pending изменений — пачка уходит, не дожидаясь таймера
+            for user_id in (3, 4, 5):
+                await storage.set_state(_key(user_id), f"s{user_id}")
+            assert storage._flush_task is not None
+            await storage._flush_task
+            assert batches[1:] == [["s3", "s4", "s5"]]
+            assert storage.stats()["pending"] == 0
+        finally:
+            await storage.close()
+            await database.close_db()
+
+    asyncio.run(main())
+
+def test_abandoned_states_expire(tmp_path):
+    async def main():
+        await database.init_db(SQLiteBackend(str(tmp_path / "test.db"), readers=1))
+        storage = fsm_storage.DatabaseStorage(ttl=0.05, flush_interval=60)
+        try:
+            await storage.set_state(_key(1), "waiting")
+            await storage.flush()
+            await asyncio.sleep(0.1)
+            await storage.set_state(_key(2), "fresh")
+            await storage.flush()
+
+            # Брошенный сценарий читается пустым, а очистка удаляет его из кэша и базы
+            assert await storage.get_state(_key(1)) is None
+            assert await storage.sweep() == 1
+            assert await _stored_state(1) is None
+            assert await storage.get_state(_key(2)) == "fresh"
+            assert storage.stats()["expired"] == 1
+        finally:
+            await storage.close()
+            await database.close_db()
+
+    asyncio.run(main())
+
+def test_state_survives_restart(tmp_path):
+    path = str(tmp_path / "test.db")
+
+    async def main():
+        await database.init_db(SQLiteBackend(path, readers=1))
+        storage = fsm_storage.DatabaseStorage(flush_interval=60)
+        await storage.set_state(_key(1), "selecting_tactic")
+        await storage.set_data(_key(1), {"opponent": "Команда 2", "bet": 100})
+        # close сбрасывает несохранённые изменения
+        await storage.close()
+        await database.close_db()
+
+        await database.init_db(SQLiteBackend(path, readers=1))
+        storage = fsm_storage.DatabaseStorage()
+        try:
+            assert await storage.get_state(_key(1)) == "selecting_tactic"
+            assert await storage.get_data(_key(1)) == {"opponent": "Команда 2", "bet": 100}
+            assert storage.stats()["misses"] == 1
+        finally:
+            await storage.close()
+            await database.close_db()
+
+    asyncio.run(main())
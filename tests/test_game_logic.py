@@ -0,0 +1,201 @@
+import asyncio
+import math
+import random
+
+import numpy as np
+
+import config
+import game_logic
+import modifiers
+import odds
+from storage import Player
+
+TACTIC = "Оборонительная игра"
+
+def _team(stat: int = 60):
+    return [Player(i, 1, f"Игрок_{i}", "Rifle", "Опытный", stat, stat, stat, 100, 100) for i in range(1, 6)]
+
+def _win_rate(team, vector, matches: int = 400) -> float:
+    async def play():
+        wins = 0
+        for seed in range(matches):
+            result = await game_logic.simulate_match_pro(team, TACTIC, vector, seed=seed)
+            wins += result["result"] == "WIN"
+        return wins / matches
+    return asyncio.run(play())
+
+def test_positive_modifier_raises_win_rate():
+    team = _team()
+    mascot = modifiers.source_vector("mascot", "Волк")
+    assert mascot != modifiers.NEUTRAL
+    assert _win_rate(team, mascot) > _win_rate(team, modifiers.NEUTRAL) + 0.03
+
+def test_positive_modifier_raises_pre_match_odds():
+    team = _team()
+    tactic = modifiers.tactic_vector(TACTIC)
+    neutral = odds.pre_match_win_probability(team, tactic)
+    boosted = odds.pre_match_win_probability(team, modifiers.combine(modifiers.source_vector("mascot", "Волк"), tactic))
+    assert boosted > neutral
+
+def test_bet_odds_are_priced_on_the_bet_tactic(monkeypatch):
+    team = _team()
+    monkeypatch.setattr(config, "BET_MIN_ODDS", 0.0)
+    prices = {}
+    for tactic in config.TACTICS:
+        win = odds.pre_match_win_probability(team, modifiers.tactic_vector(tactic))
+        prices[tactic] = odds.bet_odds(team, modifiers.NEUTRAL, tactic)
+        assert prices[tactic] == round(min((1 - config.BOOKMAKER_MARGIN) / win, config.BET_MAX_ODDS), 2)
+    # Коэффициент зависит от тактики: самая сильная не задаёт цену остальным
+    assert len(set(prices.values())) > 1
+
+    # Ниже пола ставку не принимаем, а не платим меньше поставленного
+    monkeypatch.setattr(config, "BET_MIN_ODDS", max(prices.values()) + 0.01)
+    assert all(odds.bet_odds(team, modifiers.NEUTRAL, tactic) is None for tactic in config.TACTICS)
+
+def test_match_replays_from_seed():
+    team = _team()
+    for seed in range(20):
+        result = asyncio.run(game_logic.simulate_match_pro(team, TACTIC, seed=seed))
+        record = result["record"]
+        assert game_logic.replay_match(record) == record
+        assert game_logic.match_result(record)["opponent_name"] == result["opponent_name"]
+
+def _chi2_sf(statistic: float, dof: int) -> float:
+    # Хвост распределения хи-квадрат (приближение Уилсона — Хилферти)
+    if dof <= 0:
+        return 1.0
+    z = ((statistic / dof) ** (1 / 3) - (1 - 2 / (9 * dof))) / math.sqrt(2 / (9 * dof))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def _homogeneity_p_value(a, b) -> float:
+    """p-value критерия хи-квадрат: две гистограммы взяты из одного распределения."""
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    keep = (a + b) > 0
+    a, b = a[keep], b[keep]
+    expected_a = (a + b) * a.sum() / (a.sum() + b.sum())
+    expected_b = (a + b) - expected_a
+    statistic = (((a - expected_a) ** 2) / expected_a + ((b - expected_b) ** 2) / expected_b).sum()
+    return _chi2_sf(statistic, len(a) - 1)
+
+def _check_event_sampling(matches: int, seed: int, alpha: float = 0.001) -> list:
+    """
+    Пропуски (_sample_events_skip) дают то же распределение событий, что и попытка в каждом раунде.
+    По каждому типу события сравниваются гистограммы числа событий за матч и номеров раундов с событием.
+    :return: список описаний расхождений (пустой, если всё в порядке)
+    """
+    rng = np.random.default_rng(seed)
+    rounds = rng.integers(game_logic.ROUNDS_TO_WIN, game_logic.MAX_ROUNDS + 1, size=matches)
+    samples = [game_logic._sample_events_skip(rounds, rng), game_logic._sample_events_per_round(rounds, rng)]
+
+    problems = []
+    for code, event_type in enumerate(game_logic.MATCH_EVENT_TYPES):
+        counts = []
+        positions = []
+        for match_idx, round_no, event_code in samples:
+            mask = event_code == code
+            per_match = np.bincount(match_idx[mask], minlength=matches)
+            counts.append(np.bincount(per_match, minlength=game_logic.MAX_ROUNDS + 1))
+            positions.append(np.bincount(round_no[mask], minlength=game_logic.MAX_ROUNDS + 1))
+        for name, (a, b) in (("число за матч", counts), ("номер раунда", positions)):
+            p_value = _homogeneity_p_value(a, b)
+            if p_value < alpha:
+                problems.append(f"{event_type}: {name} расходится (p = {p_value:.2g})")
+    return problems
+
+def test_event_skip_sampling_matches_per_round_reference():
+    assert _check_event_sampling(matches=100000, seed=1) == []
+
+def test_event_encoding_fits_in_byte():
+    # Событие хранится байтом: (раунд − 1) × число типов + код типа
+    assert game_logic.MAX_ROUNDS * len(game_logic.MATCH_EVENT_TYPES) <= 256
+
+def test_event_skip_sampling_rate():
+    rng = np.random.default_rng(2)
+    rounds = rng.integers(game_logic.ROUNDS_TO_WIN, game_logic.MAX_ROUNDS + 1, size=50000)
+    _, _, code = game_logic._sample_events_skip(rounds, rng)
+    counts = np.bincount(code, minlength=len(game_logic.MATCH_EVENT_TYPES))
+    expected = game_logic._MATCH_EVENT_PROBS * rounds.sum()
+    # Пять стандартных отклонений биномиального числа событий
+    assert np.all(np.abs(counts - expected) < 5 * np.sqrt(expected))
+
+def test_single_match_engine_matches_duel_model():
+    normal = np.array([0.6, 0.5, 0.5, 0.4, 0.3])
+    clutch = np.array([0.6, 0.7, 0.5, 0.4, 0.5])
+    enemy = 0.45
+    rng = random.Random(3)
+    matches = 2000
+    won = played = 0
+    single_codes = []
+    for _ in range(matches):
+        rounds_mask, rounds, events = game_logic._play_match(normal, clutch, enemy, rng)
+        assert max(bin(rounds_mask).count("1"), rounds - bin(rounds_mask).count("1")) == game_logic.ROUNDS_TO_WIN
+        won += bin(rounds_mask).count("1")
+        played += rounds
+        single_codes.extend(code for _, code, _, _ in events)
+
+    # Доля выигранных раундов — точная вероятность раунда из букмекера
+    p_round = odds.round_win_probability(normal, clutch, enemy)
+    assert abs(won / played - p_round) < 4 * np.sqrt(p_round * (1 - p_round) / played)
+
+    # Эйсы и клатчи случаются так же часто, как в пакетном движке
+    batch = game_logic.simulate_matches_players(np.tile(normal, (matches, 1)), np.tile(clutch, (matches, 1)),
+                                                np.full(matches, enemy), 3)
+    batch_played = int(batch["user_score"].sum()) + int(batch["enemy_score"].sum())
+    for code in (game_logic._ACE_CODE, game_logic._CLUTCH_CODE):
+        single_rate = single_codes.count(code) / played
+        batch_rate = np.count_nonzero(batch["event_code"] == code) / batch_played
+        assert abs(single_rate - batch_rate) < 5 * np.sqrt(batch_rate / min(played, batch_played))
+
+def test_player_match_odds_events_match_duel_engine():
+    normal = np.array([0.9, 0.8, 0.2, 0.0, 0.0])
+    clutch = np.array([0.6, 0.7, 0.5, 0.0, 0.0])
+    enemy = 0.3
+    exact = odds.player_match_odds(normal, clutch, enemy)
+    rng = random.Random(5)
+    matches = 3000
+    seen = {game_logic.ACE_EVENT: 0, game_logic.CLUTCH_EVENT: 0}
+    wins = 0
+    for _ in range(matches):
+        rounds_mask, rounds, events = game_logic._play_match(normal, clutch, enemy, rng)
+        codes = {code for _, code, _, _ in events}
+        for event_type in seen:
+            seen[event_type] += game_logic.MATCH_EVENT_TYPES.index(event_type) in codes
+        wins += 2 * bin(rounds_mask).count("1") > rounds
+    for name, p, hits in [("win", exact["win"], wins)] + [(t, exact["events"][t], seen[t]) for t in seen]:
+        assert abs(hits / matches - p) < 4 * np.sqrt(p * (1 - p) / matches), name
+
+def test_duel_engine_is_calibrated_to_team_model():
+    # Пятёрка с одинаковыми шансами: раунд берётся ровно с командной вероятностью
+    team = _team()
+    _, normal, clutch = game_logic.lineup_chances(team)
+    assert len(set(normal + clutch)) == 1
+    for user_power, enemy_power in ((300.0, 200.0), (240.0, 300.0), (100.0, 100.0)):
+        enemy = game_logic.enemy_chance(normal, user_power, enemy_power)
+        p_round = odds.round_win_probability(normal, clutch, enemy)
+        assert abs(p_round - user_power / (user_power + enemy_power)) < 1e-4
+
+    # Тактики сохраняют баланс командного движка, под который подобраны множители config.TACTICS
+    low, high = config.ENEMY_POWER_RANGE
+    nodes = [low + (high - low) * (i + 0.5) / 64 for i in range(64)]
+    for tactic, params in config.TACTICS.items():
+        strength = params["reward_multiplier"] * len(team)
+        team_model = sum(odds.match_odds(strength / (strength + f))["win"] for f in nodes) / len(nodes)
+        assert abs(odds.pre_match_win_probability(team, modifiers.tactic_vector(tactic)) - team_model) < 0.005
+
+    # Разные шансы в пятёрке: средний шанс держит раунд рядом с командной вероятностью
+    normal = (0.9, 0.7, 0.5, 0.4, 0.3)
+    clutch = (0.8, 0.8, 0.6, 0.4, 0.3)
+    for user_power, enemy_power in ((300.0, 200.0), (200.0, 300.0)):
+        p_round = odds.round_win_probability(normal, clutch, game_logic.enemy_chance(normal, user_power, enemy_power))
+        assert abs(p_round - user_power / (user_power + enemy_power)) < 0.03
+
+def test_league_runs_on_player_engine():
+    teams = [_team(stat) for stat in (40, 60, 80)]
+    chances = [game_logic.lineup_chances(team) for team in teams]
+    powers = [game_logic.calculate_team_power(team) for team in teams]
+    table = game_logic.simulate_league([normal for _, normal, _ in chances], [clutch for _, _, clutch in chances],
+                                       powers, legs=200, rng=7)
+    assert table["wins"].sum() == 3 * 200
+    assert table["points"][2] > table["points"][1] > table["points"][0]
+    assert table["round_diff"].sum() == 0
@@ -0,0 +1,150 @@
+import asyncio
+
+from aiogram import Bot, F
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, Update
+
+import middlewares
+
+class _States(StatesGroup):
+    selecting_tactic = State()
+
+def _callback(update_id: int, data: str, user_id: int = 7) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id), "chat_instance": "test", "data": data,
+            "from": {"id": user_id, "is_bot": False, "first_name": "Игрок"},
+            "message": {"message_id": 10, "date": 0, "chat": {"id": user_id, "type": "private"}},
+        },
+    })
+
+def _dispatcher():
+    throttling = middlewares.ThrottlingMiddleware(user_rate=(1000.0, 1000), action_rates={})
+    user_serial = middlewares.UserSerialMiddleware()
+    return middlewares.create_dispatcher(MemoryStorage(), throttling, user_serial), user_serial
+
+def test_queued_updates_see_state_changed_by_previous_one(monkeypatch):
+    answered = []
+
+    async def answer(self, *args, **kwargs):
+        answered.append(self.data)
+
+    monkeypatch.setattr(CallbackQuery, "answer", answer)
+
+    async def main():
+        bot = Bot("42:TEST")
+        dp, user_serial = _dispatcher()
+        played = []
+
+        @dp.callback_query(_States.selecting_tactic, F.data.startswith("tactic_"))
+        async def play(callback: CallbackQuery, state: FSMContext):
+            played.append(callback.data)
+            await asyncio.sleep(0.02)
+            await state.clear()
+
+        await dp.fsm.get_context(bot, chat_id=7, user_id=7).set_state(_States.selecting_tactic)
+        # Двойное нажатие по двум кнопкам тактики и повтор уже обрабатываемой кнопки
+        await asyncio.gather(dp.feed_update(bot, _callback(1, "tactic_rush")),
+                             dp.feed_update(bot, _callback(2, "tactic_defense")),
+                             dp.feed_update(bot, _callback(3, "tactic_rush")))
+
+        assert played == ["tactic_rush"]
+        assert answered == ["tactic_rush"] and user_serial.coalesced == 1
+        stats = user_serial.stats()
+        assert stats["active_users"] == 0 and stats["max_depth"] == 2
+        await bot.session.close()
+
+    asyncio.run(main())
+
+def test_users_do_not_wait_for_each_other():
+    async def main():
+        bot = Bot("42:TEST")
+        dp, _ = _dispatcher()
+        running = set()
+        overlapped = asyncio.Event()
+
+        @dp.callback_query()
+        async def slow(callback: CallbackQuery):
+            running.add(callback.from_user.id)
+            if len(running) == 2:
+                overlapped.set()
+            await asyncio.wait_for(overlapped.wait(), 1)
+
+        await asyncio.gather(dp.feed_update(bot, _callback(1, "a", user_id=1)),
+                             dp.feed_update(bot, _callback(2, "a", user_id=2)))
+        assert overlapped.is_set()
+        await bot.session.close()
+
+    asyncio.run(main())
+
+def _message(update_id: int, text: str, user_id: int = 7) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text, "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Игрок"},
+        },
+    })
+
+def test_throttling_rejects_over_rate(monkeypatch):
+    answered = []
+
+    async def answer(self, text=None, *args, **kwargs):
+        answered.append((self.data, text))
+
+    monkeypatch.setattr(CallbackQuery, "answer", answer)
+
+    async def main():
+        bot = Bot("42:TEST")
+        # Общее ведро на 3 обновления, у тактики своё — на 2; оба пополняются раз в 10 секунд
+        throttling = middlewares.ThrottlingMiddleware(user_rate=(0.1, 3), action_rates={"tactic_": (0.1, 2)})
+        dp = middlewares.create_dispatcher(MemoryStorage(), throttling, middlewares.UserSerialMiddleware())
+        handled = []
+
+        @dp.callback_query()
+        async def press(callback: CallbackQuery):
+            handled.append(callback.data)
+
+        @dp.message()
+        async def command(message):
+            handled.append(message.text)
+
+        for update_id, data in enumerate(("tactic_rush", "tactic_defense", "tactic_traps", "menu", "menu"), 1):
+            await dp.feed_update(bot, _callback(update_id, data))
+        await dp.feed_update(bot, _message(6, "/start"))
+        # Другой пользователь не делит вёдра с первым
+        await dp.feed_update(bot, _callback(7, "tactic_rush", user_id=8))
+
+        # Третья тактика упирается в ведро действия и не тратит общее; второе «menu» — в общее ведро
+        assert handled == ["tactic_rush", "tactic_defense", "menu", "tactic_rush"]
+        assert answered == [("tactic_traps", "⏳ Слишком часто, подождите немного"),
+                            ("menu", "⏳ Слишком часто, подождите немного")]
+        # Лишнее сообщение отбрасывается молча
+        assert throttling.stats() == {"buckets": 4, "rejected": 3}
+        await bot.session.close()
+
+    asyncio.run(main())
+
+def test_throttling_sweeps_full_buckets():
+    async def main():
+        bot = Bot("42:TEST")
+        throttling = middlewares.ThrottlingMiddleware(user_rate=(100.0, 1), action_rates={}, sweep_interval=0.05)
+        dp = middlewares.create_dispatcher(MemoryStorage(), throttling, middlewares.UserSerialMiddleware())
+
+        @dp.callback_query()
+        async def press(callback: CallbackQuery):
+            pass
+
+        for user_id in range(1, 21):
+            await dp.feed_update(bot, _callback(user_id, "menu", user_id=user_id))
+        assert throttling.stats()["buckets"] == 20
+        # Через 1/100 с вёдра снова полные, а после интервала очистки удаляются при следующем обновлении
+        await asyncio.sleep(0.06)
+        await dp.feed_update(bot, _callback(21, "menu", user_id=99))
+        assert throttling.stats() == {"buckets": 1, "rejected": 0}
+        await bot.session.close()
+
+    asyncio.run(main())
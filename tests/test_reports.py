@@ -0,0 +1,29 @@
+import asyncio
+import re
+
+import config
+import game_logic
+import reports
+from storage import Player
+
+def _team():
+    return [Player(i, 1, f"Игрок_{i}", "Entry Fragger", "Опытный", 90, 90, 90, 100, 100) for i in range(1, 6)]
+
+def _unescaped_markdown(text: str) -> list:
+    # Служебный символ без обратной косой черты перед ним
+    return re.findall(r"(?<!\\)[_*`\[]", text)
+
+def test_highlight_nickname_is_escaped():
+    events = [{"type": game_logic.ACE_EVENT, "round": 3, "winner": "user", "player_id": 1},
+              {"type": game_logic.CLUTCH_EVENT, "round": 7, "winner": "user", "player_id": 2, "versus": 3}]
+    lines = list(reports.render_highlights(events, _team()))
+    assert "Игрок\\_1" in lines[0]
+    assert "Игрок\\_2" in lines[1]
+    assert not _unescaped_markdown("\n".join(lines))
+
+def test_match_report_is_valid_markdown():
+    team = _team()
+    for seed in range(50):
+        result = asyncio.run(game_logic.simulate_match_pro(team, next(iter(config.TACTICS)), seed=seed))
+        for page in reports.render_match_report(result, team, result["opponent_name"]):
+            assert not _unescaped_markdown(page)
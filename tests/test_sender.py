@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import sender
+
+class _Bot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text, time.monotonic()))
+
+def test_scheduler_keeps_priority_and_chat_limits():
+    async def main():
+        bot = _Bot()
+        # Бот отправляет одно сообщение за раз, у чата ведро на 2 сообщения и 20 в секунду
+        outbox = sender.SendScheduler(bot, global_rate=(200.0, 1), chat_rate=(20.0, 2), merge_limit=0)
+        for chat_id in range(1, 4):
+            for i in range(3):
+                outbox.send(chat_id, f"{chat_id}:{i}")
+        outbox.send(4, "срочно", sender.PRIORITY_HIGH)
+        await outbox.close()
+
+        texts = [text for _, text, _ in bot.sent]
+        assert texts[0] == "срочно"
+        assert sorted(texts) == sorted([f"{chat_id}:{i}" for chat_id in range(1, 4) for i in range(3)] + ["срочно"])
+        for chat_id in range(1, 4):
+            chat = [(text, at) for sent_to, text, at in bot.sent if sent_to == chat_id]
+            assert [text for text, _ in chat] == [f"{chat_id}:{i}" for i in range(3)]
+            # Третье сообщение ждёт токена чата: не раньше 1/20 с после первого
+            assert chat[2][1] - chat[0][1] >= 0.05 - 1e-3
+        assert outbox.stats()["queued"] == 0
+
+    asyncio.run(main())
+
+def test_scheduler_forgets_idle_chats():
+    async def main():
+        outbox = sender.SendScheduler(_Bot(), global_rate=(1000.0, 100), chat_rate=(100.0, 1))
+        for chat_id in range(50):
+            outbox.send(chat_id, "привет")
+        await asyncio.wait_for(outbox._idle.wait(), 1)
+        # Ведро чата полное через 1/100 с: после этого чат больше не хранится
+        await asyncio.sleep(0.05)
+        assert outbox.stats()["chats"] == 0
+        assert not outbox._ready
+        await outbox.close()
+
+    asyncio.run(main())
@@ -0,0 +1,49 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import simulation
+
+def test_executor_applies_backpressure():
+    async def main():
+        executor = simulation.SimulationExecutor(workers=0, max_pending=2)
+        # Пул потоков вместо процессов: задачи можно задержать событием, а не временем
+        executor._pool = ThreadPoolExecutor(4)
+        gate = threading.Event()
+        try:
+            held = [asyncio.create_task(executor.run(gate.wait, 5)) for _ in range(2)]
+            while executor.pending < 2:
+                await asyncio.sleep(0.005)
+
+            # Очередь полна: без ожидания — сразу SimulationBusy, с ожиданием — ждём свободного места
+            with pytest.raises(simulation.SimulationBusy):
+                await executor.run(sum, (1, 2), wait=False)
+            queued = asyncio.create_task(executor.run(sum, (1, 2)))
+            await asyncio.sleep(0.05)
+            assert not queued.done()
+            assert executor.stats() == {"workers": 0, "pending": 2, "completed": 0}
+
+            gate.set()
+            assert await asyncio.gather(*held) == [True, True]
+            assert await queued == 3
+            assert executor.stats() == {"workers": 0, "pending": 0, "completed": 3}
+        finally:
+            gate.set()
+            await executor.stop()
+
+    asyncio.run(main())
+
+def test_executor_without_pool_runs_inline():
+    async def main():
+        executor = simulation.SimulationExecutor(workers=0, max_pending=1)
+        executor.start()
+        assert await executor.run(divmod, 7, 2, wait=False) == (3, 1)
+        with pytest.raises(ZeroDivisionError):
+            await executor.run(divmod, 1, 0)
+        # Ошибка задачи не занимает место в очереди
+        assert executor.stats() == {"workers": 0, "pending": 0, "completed": 2}
+        await executor.stop()
+
+    asyncio.run(main())
@@ -0,0 +1,280 @@
+import asyncio
+
+import pytest
+
+import config
+import database
+import game_logic
+import sqlite_backend
+from memory_backend import MemoryBackend
+from sqlite_backend import SQLiteBackend
+
+def _run_with_sqlite(tmp_path, scenario):
+    async def main():
+        await database.init_db(SQLiteBackend(str(tmp_path / "test.db"), readers=1))
+        try:
+            await scenario()
+        finally:
+            await database.close_db()
+    asyncio.run(main())
+
+def test_cancelled_transaction_is_rolled_back(tmp_path):
+    async def scenario():
+        await database.create_user(1, "Команда 1")
+        started = asyncio.Event()
+
+        async def handler():
+            async with database.transaction():
+                await database.update_user_balance(1, 777)
+                started.set()
+                await asyncio.sleep(60)
+
+        task = asyncio.create_task(handler())
+        await started.wait()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        # Следующая транзакция на том же писателе не должна закоммитить брошенные записи
+        await database.create_user(2, "Команда 2")
+        user = await database.get_user(1)
+        assert user.balance == 1000
+
+    _run_with_sqlite(tmp_path, scenario)
+
+def test_hot_queries_use_indexes(tmp_path):
+    async def scenario():
+        assert await database.check_query_plans() == []
+
+    _run_with_sqlite(tmp_path, scenario)
+
+def test_query_plan_check_reports_unindexed_query(tmp_path, monkeypatch):
+    query = "SELECT player_id FROM players WHERE nickname = ?"
+    monkeypatch.setattr(sqlite_backend, "_INDEXED_QUERIES", sqlite_backend._INDEXED_QUERIES + [(query, "idx_players_owner")])
+
+    async def scenario():
+        problems = await database.check_query_plans()
+        assert len(problems) == 1 and query in problems[0]
+
+    _run_with_sqlite(tmp_path, scenario)
+
+def test_query_plan_check_requires_covering_bet_index(tmp_path, monkeypatch):
+    # Индекс без tactic: get_active_bet всё ещё ищет по нему, но читает строку из таблицы
+    narrow = "CREATE INDEX IF NOT EXISTS idx_bets_user_active_tactic ON bets (user_id, is_active, amount, odds)"
+    monkeypatch.setattr(sqlite_backend, "_INDEXES", [
+        narrow if "idx_bets_user_active_tactic" in index_sql else index_sql for index_sql in sqlite_backend._INDEXES
+    ])
+
+    async def scenario():
+        problems = await database.check_query_plans()
+        assert len(problems) == 1 and "COVERING INDEX idx_bets_user_active_tactic" in problems[0]
+
+    _run_with_sqlite(tmp_path, scenario)
+
+def test_write_behind_stop_keeps_in_flight_flush(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "WRITE_BEHIND", True)
+    monkeypatch.setattr(config, "WRITE_BEHIND_INTERVAL", 0.01)
+    path = str(tmp_path / "test.db")
+
+    async def main():
+        await database.init_db(SQLiteBackend(path, readers=1))
+        await database.create_user(1, "Команда 1")
+        backend = database._get_backend()
+        writer = backend.pool._writer
+        executemany = writer.executemany
+
+        async def slow_executemany(*args):
+            await asyncio.sleep(0.2)
+            return await executemany(*args)
+
+        monkeypatch.setattr(writer, "executemany", slow_executemany)
+        await database.update_user_balance(1, 500)
+        while not backend.buffer._inflight:
+            await asyncio.sleep(0.005)
+        # Остановка посреди сброса не должна потерять забранную пачку
+        await database.close_db()
+
+        await database.init_db(SQLiteBackend(path, readers=1))
+        try:
+            assert (await database.get_user(1)).balance == 1500
+        finally:
+            await database.close_db()
+
+    asyncio.run(main())
+
+async def _lineup_power_scenario():
+    # Составы больше пятёрки: сила и рейтинг считаются по тем, кто играет матчи
+    for owner_id, stat in ((1, 60), (2, 70)):
+        await database.create_user(owner_id, f"Команда {owner_id}")
+        await database.create_players(owner_id, [
+            {"nickname": f"Игрок {i}", "position": ("AWPer", "Entry Fragger", "Lurker", "IGL")[i % 4],
+             "rarity": "Опытный", "aim": stat + 3 * i, "reaction": stat, "tactics": stat - i}
+            for i in range(8)
+        ])
+    players = await database.get_team_players(1)
+    # Уставший лидер выпадает из пятёрки, а запасной с улучшенным аимом входит в неё
+    await database.update_player_stats(players[-1].player_id, stamina=10)
+    await database.update_player_stats(players[0].player_id, aim=99)
+    await database.adjust_team_stats(2, stamina=-60)
+
+    expected = {}
+    for owner_id in (1, 2):
+        lineup = database.starting_lineup(await database.get_team_players(owner_id))
+        power = await database.get_team_power(owner_id)
+        assert power.players == database.LINEUP_SIZE
+        assert power.power == pytest.approx(game_logic.calculate_team_power(lineup))
+        expected[owner_id] = power.power
+    top = await database.get_top_teams(10)
+    assert [power.owner_id for power in top] == sorted(expected, key=expected.get, reverse=True)
+
+def test_team_power_is_lineup_power_sqlite(tmp_path):
+    _run_with_sqlite(tmp_path, _lineup_power_scenario)
+
+async def _player_transfer_scenario():
+    for owner_id in (1, 2):
+        await database.create_user(owner_id, f"Команда {owner_id}")
+        await database.create_player(owner_id, f"Игрок {owner_id}", "IGL", "Опытный", 50, 50, 50)
+    (player,) = await database.get_team_players(1)
+    # Прогреваем кэш составов и силы обоих владельцев
+    for owner_id in (1, 2):
+        await database.get_team_players(owner_id)
+        await database.get_team_power(owner_id)
+
+    await database.update_player_stats(player.player_id, owner_id=2, aim="+10")
+    assert await database.get_team_players(1) == []
+    assert sorted(p.aim for p in await database.get_team_players(2)) == [50, 60]
+    assert (await database.get_team_power(1)).players == 0
+    power = await database.get_team_power(2)
+    assert power.players == 2
+    assert power.power == pytest.approx(game_logic.calculate_team_power(await database.get_team_players(2)))
+
+def test_player_transfer_refreshes_both_owners_sqlite(tmp_path):
+    _run_with_sqlite(tmp_path, _player_transfer_scenario)
+
+def test_player_transfer_refreshes_both_owners_memory():
+    async def main():
+        await database.init_db(MemoryBackend())
+        try:
+            await _player_transfer_scenario()
+            # Откат перевода возвращает игрока в прежний состав
+            (player,) = [p for p in await database.get_team_players(2) if p.aim == 60]
+            with pytest.raises(RuntimeError):
+                async with database.transaction():
+                    await database.update_player_stats(player.player_id, owner_id=1)
+                    raise RuntimeError
+            assert await database.get_team_players(1) == []
+            assert (await database.get_team_power(2)).players == 2
+        finally:
+            await database.close_db()
+    asyncio.run(main())
+
+def test_memory_user_matches_limit():
+    async def main():
+        await database.init_db(MemoryBackend())
+        try:
+            match_ids = [
+                await database.save_match(database.MatchRecord(None, 1, seed, "Раш", (), (), 1.0, 1.0, 0, 0, (), 0))
+                for seed in range(3)
+            ]
+            assert await database.get_user_matches(1, limit=0) == []
+            assert await database.get_user_matches(1, limit=-1) == []
+            assert [m.match_id for m in await database.get_user_matches(1, limit=2)] == match_ids[:0:-1]
+        finally:
+            await database.close_db()
+    asyncio.run(main())
+
+def test_team_power_backfill_runs_once(tmp_path):
+    path = str(tmp_path / "test.db")
+
+    async def reopen():
+        await database.close_db()
+        await database.init_db(SQLiteBackend(path, readers=1))
+        return database._get_backend().pool._writer
+
+    async def main():
+        await database.init_db(SQLiteBackend(path, readers=1))
+        try:
+            await _lineup_power_scenario()
+            expected = (await database.get_team_power(1)).power
+            writer = database._get_backend().pool._writer
+            await writer.execute("UPDATE team_power SET aim = 0 WHERE owner_id = 1")
+            await writer.commit()
+
+            # Повторное открытие не пересчитывает таблицу: её ведут триггеры
+            await reopen()
+            assert (await database.get_team_power(1)).power != pytest.approx(expected)
+
+            # Пустую таблицу (старая база) открытие заполняет
+            writer = await reopen()
+            await writer.execute("DELETE FROM team_power")
+            await writer.commit()
+            await reopen()
+            assert (await database.get_team_power(1)).power == pytest.approx(expected)
+        finally:
+            await database.close_db()
+    asyncio.run(main())
+
+def test_team_power_is_lineup_power_memory():
+    async def main():
+        await database.init_db(MemoryBackend())
+        try:
+            await _lineup_power_scenario()
+        finally:
+            await database.close_db()
+    asyncio.run(main())
+
+def test_memory_top_teams_index_follows_changes_and_rollbacks():
+    async def main():
+        await database.init_db(MemoryBackend())
+        try:
+            for owner_id in range(1, 21):
+                await database.create_user(owner_id, f"Команда {owner_id}")
+                await database.create_player(owner_id, "Игрок", "IGL", "Опытный", 40 + owner_id, 50, 50)
+            await database.adjust_team_stats(3, aim=60)
+            await database.reduce_player_stamina(20, 90)
+            with pytest.raises(RuntimeError):
+                async with database.transaction():
+                    await database.adjust_team_stats(1, aim=60)
+                    raise RuntimeError
+
+            powers = database._get_backend().team_powers
+            expected = sorted(powers.values(), key=lambda power: (-power.power, power.owner_id))[:5]
+            assert await database.get_top_teams(5) == expected
+            assert expected[0].owner_id == 3
+        finally:
+            await database.close_db()
+    asyncio.run(main())
+
+def test_cache_invalidation_is_per_key():
+    cache = sqlite_backend.TTLCache(maxsize=10, ttl=60)
+    first, second = cache.begin(1), cache.begin(2)
+    # Запись в команду 2 посреди чтения: устаревшая команда 2 не кэшируется, команда 1 — кэшируется
+    cache.invalidate(2)
+    cache.finish(1, first, "сила 1")
+    cache.finish(2, second, "старая сила 2")
+    assert cache.get(1) == "сила 1"
+    assert cache.get(2) is None
+    assert not cache._loading
+
+def test_memory_rollback_undoes_list_appends():
+    async def main():
+        await database.init_db(MemoryBackend())
+        try:
+            await database.create_user(1, "Команда 1")
+            await database.create_player(1, "Игрок", "IGL", "Опытный", 50, 50, 50)
+            await database.add_team_effect(1, "Буткемп", 2)
+            with pytest.raises(RuntimeError):
+                async with database.transaction():
+                    await database.create_player(1, "Новичок", "AWPer", "Опытный", 90, 90, 90)
+                    await database.create_player(2, "Чужой", "AWPer", "Опытный", 90, 90, 90)
+                    await database.add_team_effect(1, "Травма", 1)
+                    await database.create_bet(1, 100)
+                    raise RuntimeError
+
+            assert [player.nickname for player in await database.get_team_players(1)] == ["Игрок"]
+            assert await database.get_team_players(2) == []
+            assert [m.name for m in await database.get_team_modifiers(1)] == ["Буткемп"]
+            assert await database.get_active_bet(1) is None
+            assert (await database.get_team_power(1)).players == 1
+        finally:
+            await database.close_db()
+    asyncio.run(main())
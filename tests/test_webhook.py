@@ -0,0 +1,201 @@
+import asyncio
+import importlib
+import os
+import signal
+import socket
+import sys
+
+import aiohttp
+from aiohttp import web
+
+import config
+import database
+import webhook
+from memory_backend import MemoryBackend
+
+class _Request:
+    headers = {}
+
+    async def json(self):
+        return {"update_id": 1}
+
+class _Dispatcher:
+    def __init__(self):
+        self.started = asyncio.Event()
+
+    async def feed_update(self, bot, update):
+        async with database.transaction():
+            await database.update_user_balance(1, 500)
+            self.started.set()
+            await asyncio.sleep(60)
+
+def test_drain_cancels_slow_handlers_before_returning():
+    async def main():
+        await database.init_db(MemoryBackend())
+        try:
+            await database.create_user(1, "Команда 1")
+            dp = _Dispatcher()
+            server = webhook.WebhookServer(dp, bot=None, secret="", max_concurrency=4, drain_timeout=0.05)
+            handler = asyncio.create_task(server.handle(_Request()))
+            await dp.started.wait()
+
+            await server.drain()
+            # После drain обработчик уже завершён и откатил транзакцию — хранилище можно закрывать
+            assert handler.done()
+            assert handler.result().status == 503
+            assert server.stats()["in_flight"] == 0 and server.cancelled == 1
+            assert (await database.get_user(1)).balance == 1000
+        finally:
+            await database.close_db()
+    asyncio.run(main())
+
+class _FakeBotApi:
+    """
+    Поддельный сервер Bot API: отвечает как Telegram и записывает вызовы.
+    editMessageText ждёт release — так обработчики обновлений остаются в работе, пока тест не отпустит.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.release = asyncio.Event()
+        self.runner = None
+        self.url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        await web.SockSite(self.runner, sock).start()
+        self.url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        fields = dict(await request.post())
+        self.calls.append((method, fields))
+        if method == "editMessageText":
+            await self.release.wait()
+        result = True
+        if method in ("sendMessage", "editMessageText"):
+            result = {"message_id": 1, "date": 0, "text": fields["text"],
+                      "chat": {"id": int(fields["chat_id"]), "type": "private"}}
+        return web.json_response({"ok": True, "result": result})
+
+    def methods(self, method: str) -> list:
+        return [fields for name, fields in self.calls if name == method]
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+async def _until(predicate, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "не дождались"
+        await asyncio.sleep(0.01)
+
+def _message(update_id: int, user_id: int, text: str) -> dict:
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "text": text, "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Игрок"}}}
+
+def _callback(update_id: int, user_id: int, data: str) -> dict:
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": "test", "data": data,
+        "from": {"id": user_id, "is_bot": False, "first_name": "Игрок"},
+        "message": {"message_id": 10, "date": 0, "text": "Меню", "chat": {"id": user_id, "type": "private"}}}}
+
+def test_webhook_end_to_end(monkeypatch):
+    async def main():
+        api = _FakeBotApi()
+        await api.start()
+        port = _free_port()
+        for name, value in (("BOT_TOKEN", "42:TEST"), ("BOT_API_URL", api.url), ("STORAGE_BACKEND", "memory"),
+                            ("WEBHOOK_URL", "https://bot.example"), ("WEBHOOK_SECRET", "secret"),
+                            ("WEBHOOK_MAX_CONCURRENCY", 2), ("WEBHOOK_DRAIN_TIMEOUT", 5.0),
+                            ("WEBAPP_HOST", "127.0.0.1"), ("WEBAPP_PORT", port), ("SIM_WORKERS", 0)):
+            monkeypatch.setattr(config, name, value)
+        # Свежий импорт: бот, сессия и сервер вебхука собираются из настроек выше
+        monkeypatch.delitem(sys.modules, "bot", raising=False)
+        bot = importlib.import_module("bot")
+        server = bot.webhook_server
+        url = f"http://127.0.0.1:{port}"
+        headers = {webhook.SECRET_HEADER: "secret"}
+
+        await database.init_db()
+        running = asyncio.create_task(webhook.run(bot.dp, bot.bot, server))
+        try:
+            async with aiohttp.ClientSession() as client:
+                async def health():
+                    try:
+                        async with client.get(url + "/health") as response:
+                            return response.status, await response.text()
+                    except aiohttp.ClientConnectionError:
+                        return None, None
+
+                while (await health())[0] != 200:
+                    assert not running.done(), "сервер не запустился"
+                    await asyncio.sleep(0.01)
+                # Вебхук зарегистрирован у (поддельного) Telegram вместе с секретом
+                (registered,) = api.methods("setWebhook")
+                assert registered["url"] == "https://bot.example" + config.WEBHOOK_PATH
+                assert registered["secret_token"] == "secret"
+
+                # Без секрета или с чужим секретом обновление не принимается
+                for wrong in ({}, {webhook.SECRET_HEADER: "guess"}):
+                    async with client.post(url + config.WEBHOOK_PATH, json=_message(1, 1, "/start"),
+                                           headers=wrong) as response:
+                        assert response.status == 401
+                assert server.processed == 0
+
+                # Настоящее обновление проходит весь путь: диспетчер, хранилище, очередь исходящих
+                async with client.post(url + config.WEBHOOK_PATH, json=_message(2, 1, "/start"),
+                                       headers=headers) as response:
+                    assert response.status == 200
+                await _until(lambda: api.methods("sendMessage"))
+                assert api.methods("sendMessage")[0]["chat_id"] == "1"
+                state = await bot.dp.fsm.get_context(bot.bot, chat_id=1, user_id=1).get_state()
+                assert state == bot.GameStates.waiting_for_team_name.state
+
+                # Два обновления висят на Bot API — третье сверх лимита получает 503 с Retry-After
+                slow = [asyncio.create_task(client.post(url + config.WEBHOOK_PATH, headers=headers,
+                                                        json=_callback(10 + user_id, user_id, "choose_mascot")))
+                        for user_id in (2, 3)]
+                await _until(lambda: len(api.methods("editMessageText")) == 2)
+                assert server.stats()["in_flight"] == 2
+                async with client.post(url + config.WEBHOOK_PATH, json=_callback(20, 4, "choose_mascot"),
+                                       headers=headers) as response:
+                    assert response.status == 503
+                    assert response.headers["Retry-After"] == "1"
+
+                # SIGTERM: сервер перестаёт принимать обновления, но дожидается начатых
+                os.kill(os.getpid(), signal.SIGTERM)
+                await _until(lambda: server.stats()["in_flight"] == 2 and server._draining)
+                assert await health() == (503, "draining")
+                async with client.post(url + config.WEBHOOK_PATH, json=_message(21, 5, "/start"),
+                                       headers=headers) as response:
+                    assert response.status == 503
+                assert not running.done()
+
+                api.release.set()
+                for response in await asyncio.gather(*slow):
+                    assert response.status == 200
+                    response.release()
+                await asyncio.wait_for(running, 5)
+                assert len(api.methods("answerCallbackQuery")) == 2
+                assert server.stats() == {"in_flight": 0, "processed": 3, "rejected": 2, "failed": 0, "cancelled": 0}
+                # Сервер закрыт только после того, как начатые обновления завершились
+                assert (await health())[0] is None
+        finally:
+            api.release.set()
+            if not running.done():
+                running.cancel()
+            await asyncio.gather(running, return_exceptions=True)
+            await bot.storage.close()
+            await database.close_db()
+            await api.runner.cleanup()
+
+    asyncio.run(main())
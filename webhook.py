@@ -0,0 +1,149 @@
+import asyncio
+import hmac
+import signal
+
+from aiohttp import web
+from aiogram.types import Update
+
+import config
+
+# Режим вебхука: Telegram (или локальный поддельный Bot API) сам присылает обновления POST-запросами.
+# Одновременно обрабатывается не больше max_concurrency обновлений; лишние получают 503 с Retry-After,
+# и Telegram повторит доставку — за балансировщиком её может принять другой экземпляр.
+# При остановке сервер перестаёт принимать обновления и дожидается уже начатых (не дольше drain_timeout);
+# не успевшие прерываются, и сервер ждёт, пока они откатятся, — только потом закрывается хранилище.
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class WebhookServer:
+    """
+    aiohttp-сервер, который передаёт обновления в диспетчер.
+    :param dp: диспетчер aiogram
+    :param bot: бот, от имени которого обрабатываются обновления
+    """
+
+    def __init__(self, dp, bot, path: str = None, secret: str = None,
+                 max_concurrency: int = None, drain_timeout: float = None):
+        self.dp = dp
+        self.bot = bot
+        self.path = path or config.WEBHOOK_PATH
+        self.secret = config.WEBHOOK_SECRET if secret is None else secret
+        self.max_concurrency = max_concurrency or config.WEBHOOK_MAX_CONCURRENCY
+        self.drain_timeout = config.WEBHOOK_DRAIN_TIMEOUT if drain_timeout is None else drain_timeout
+        self._in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._draining = False
+        self._handlers = set()  # задачи aiohttp, обрабатывающие обновления
+        self._runner = None
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.router.add_get("/health", self.health)
+        return app
+
+    async def health(self, request: web.Request) -> web.Response:
+        # Во время остановки балансировщик должен перестать слать сюда запросы
+        if self._draining:
+            return web.Response(status=503, text="draining")
+        return web.Response(text="ok")
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        if self._draining or self._in_flight >= self.max_concurrency:
+            self.rejected += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+
+        handler = asyncio.current_task()
+        self._in_flight += 1
+        self._idle.clear()
+        self._handlers.add(handler)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+            await self.dp.feed_update(self.bot, update)
+            self.processed += 1
+        except asyncio.CancelledError:
+            if not self._draining:
+                raise
+            # Прервали при остановке: транзакция обработчика откатилась, пусть Telegram доставит повторно
+            self.cancelled += 1
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        except Exception as e:
+            # Ошибку обработчика не возвращаем Telegram: иначе он будет повторять то же обновление
+            self.failed += 1
+            print(f"Ошибка обработки обновления: {e}")
+        finally:
+            self._handlers.discard(handler)
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.set()
+        return web.Response()
+
+    async def start(self, host: str = None, port: int = None):
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host or config.WEBAPP_HOST, port or config.WEBAPP_PORT)
+        await site.start()
+
+    async def drain(self):
+        """
+        Перестаёт принимать обновления, дожидается начатых и останавливает сервер.
+        Не успевшие за drain_timeout обработчики отменяются, и drain ждёт их завершения:
+        после него хранилище можно закрывать.
+        """
+        self._draining = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), self.drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"Не дождались {self._in_flight} обновлений за {self.drain_timeout} с, прерываем их")
+            handlers = list(self._handlers)
+            for handler in handlers:
+                handler.cancel()
+            await asyncio.gather(*handlers, return_exceptions=True)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "processed": self.processed,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+        }
+
+async def run(dp, bot, server: WebhookServer = None):
+    """
+    Обслуживает вебхук до SIGTERM/SIGINT, затем мягко останавливается.
+    Вебхук регистрируется, если задан config.WEBHOOK_URL; при остановке не удаляется,
+    потому что остальные экземпляры за балансировщиком продолжают работу.
+    """
+    server = server or WebhookServer(dp, bot)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    await server.start()
+    try:
+        if config.WEBHOOK_URL:
+            await bot.set_webhook(
+                config.WEBHOOK_URL.rstrip("/") + server.path,
+                secret_token=server.secret or None,
+                max_connections=min(server.max_concurrency, 100),  # больше Telegram не разрешает
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+        await dp.emit_startup(bot=bot)
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        await server.drain()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()